@@ -11,13 +11,40 @@ import os
 import re
 import math
 import threading
+import heapq
+import itertools
+import bisect
+import http.server
 import logging
 import requests
 import json
+import sqlite3
+import concurrent.futures
+import secrets
+import hashlib
+import asyncio
+import abc
+import collections
+import collections.abc
 import paho.mqtt.client as mqtt
 import click
-from time import sleep, monotonic
-from typing import Dict, Any, Optional
+from contextlib import contextmanager
+from time import monotonic, perf_counter, sleep
+from typing import Awaitable, Callable, Deque, Dict, Any, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Set, Tuple, Type
+# Optional: lets the asyncio runtime POST without a thread. Without it, POSTs
+# go through the requests session in the default executor.
+try:
+    import aiohttp
+    HAS_AIOHTTP = True
+except ImportError:
+    HAS_AIOHTTP = False
+# Optional: encodes ABRP request bodies faster than the json module (see
+# PayloadEncoder and tools/bench_payload.py).
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
 
 ## [ CONFIGURATION ]
 # Shared ABRP "Generic" application key. This is NOT a per-user secret - it
@@ -32,16 +59,11 @@ DEFAULT_CAR_NUMBER = 1
 # Driving default is 2.5s: ABRP recommends a data point roughly every 5s and says
 # faster updates don't materially improve its predictions, so 2.5s stays
 # responsive while cutting redundant POSTs vs the old 1s default. Fractional
-# values are supported (see the wall-clock scheduler in update_timely).
+# values are supported (see the deadline Scheduler driving update_timely).
 DEFAULT_REFRESH_RATE_DRIVING = 2.5
 DEFAULT_REFRESH_RATE_CHARGING = 6
 DEFAULT_REFRESH_RATE_PARKED = 30
 
-# The update loop polls on this fixed tick (seconds) and decides what to send
-# from a wall-clock timer, so any fractional rate >= MIN_REFRESH_RATE works.
-# Smaller tick => finer rate granularity and faster state-change detection, at
-# the cost of more (negligible) idle wakeups.
-REFRESH_TICK = 0.5
 # Lower bound for any refresh rate (seconds). ABRP's practical floor is ~1s; this
 # also keeps a misconfigured value from hammering the loop and the ABRP API.
 MIN_REFRESH_RATE = 1.0
@@ -56,6 +78,132 @@ STATE_LABELS = {"charging": "charging", "driving": "driving"}
 # soon as both arrive).
 MODEL_DETECTION_TIMEOUT = 10
 
+# ABRP telemetry endpoint. The per-user token is appended once per bridge as a
+# query parameter (see TeslaMateABRP.recipients), not rebuilt on every send.
+ABRP_API_URL = "https://api.iternio.com/1/tlm/send"
+
+# Several ABRP accounts can follow one car (USER_TOKEN "token1,token2", each
+# optionally named as label=token). Every snapshot is encoded once and POSTed
+# to each account, concurrently from a pool of at most MAX_DELIVERY_WORKERS
+# threads per car. Tokens are never published: each account's status topics
+# and queued backlog are keyed by its label (its position, unless named).
+MAX_DELIVERY_WORKERS = 4
+RECIPIENT_LABEL_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# HTTP connection pooling for ABRP POSTs. A long-lived keep-alive session skips
+# the TCP+TLS handshake on every send; the pool is sized for the number of
+# concurrent POSTs (one per car in multi-car mode). Connect and read timeouts are
+# separate so a dead link fails fast while a slow ABRP reply still gets time.
+DEFAULT_HTTP_POOL_SIZE = 4
+DEFAULT_HTTP_CONNECT_TIMEOUT = 5.0
+DEFAULT_HTTP_READ_TIMEOUT = 10.0
+
+# Prometheus metrics endpoint (opt-in via METRICS_PORT), served at /metrics.
+# Binds all interfaces by default so it's reachable from outside the container.
+DEFAULT_METRICS_BIND = "0.0.0.0"  # nosec B104
+# Histogram buckets (seconds): network round trips and scheduler lag, and the
+# sub-millisecond in-process work (message handling, lock waits).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01)
+# Data age at ABRP (seconds): a parked car's oldest field can be hours old.
+AGE_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+# Freshness tracing: how old the data in each accepted POST was, split into
+# the time it waited for a send (refresh rate), for the sender (slow sends)
+# and the POST itself. Percentiles over the last FRESHNESS_WINDOW accepted
+# POSTs go to the status topic at most every FRESHNESS_PUBLISH_INTERVAL seconds.
+FRESHNESS_WINDOW = 200
+FRESHNESS_PUBLISH_INTERVAL = 60.0
+
+# Store-and-forward queue (opt-in via QUEUE_PATH). Telemetry that couldn't be
+# delivered (ABRP unreachable, e.g. in a tunnel) is kept on disk with its
+# original utc and replayed once ABRP is reachable again. Rows older than
+# QUEUE_MAX_AGE seconds or beyond QUEUE_MAX_SIZE rows are evicted oldest-first.
+DEFAULT_QUEUE_MAX_AGE = 6 * 3600
+DEFAULT_QUEUE_MAX_SIZE = 10000
+# Backlog replay rate (POSTs per second), kept low so catching up stays gentle.
+DEFAULT_QUEUE_DRAIN_RATE = 1.0
+# A backlog POST is deferred when a live send is due within this many seconds,
+# so catching up never delays current telemetry.
+QUEUE_LIVE_GUARD = 1.0
+# Shortest timeout a replay POST gets when the next live send is close.
+MIN_REPLAY_TIMEOUT = 0.5
+
+# Retained-message bootstrap. After (re)subscribing, the broker replays the
+# retained TeslaMate topics; they are collected and applied together, and the
+# first send waits for the end of that burst. The end is detected by an echo of
+# a message published to BOOTSTRAP_TOPIC/<random> right after the SUBSCRIBE
+# (brokers deliver it after the retained messages), by the first live
+# (non-retained) message, or, if the broker allows neither, after
+# BOOTSTRAP_TIMEOUT seconds (on a timer of its own, since model detection
+# waits for the burst before the first send is scheduled).
+BOOTSTRAP_TOPIC = "tm2abrp/bootstrap"
+BOOTSTRAP_TIMEOUT = 5.0
+
+# Warm-restart state cache (opt-in via STATE_CACHE_PATH). Each car's last known
+# telemetry, car model and published status are saved at most every
+# STATE_CACHE_INTERVAL seconds and on shutdown, and restored at startup unless
+# older than STATE_CACHE_MAX_AGE seconds.
+STATE_CACHE_INTERVAL = 60.0
+STATE_CACHE_MAX_AGE = 24 * 3600
+
+# Change-detection send suppression (opt-in via SUPPRESS_UNCHANGED). A due send
+# is skipped when no field moved by more than its deadband since the last update
+# ABRP accepted; a send still goes out at least every SEND_KEEPALIVE seconds.
+# "position" is the lat/lon pair, in meters. Fields without a deadband must match
+# exactly; utc is never compared.
+DEFAULT_SEND_KEEPALIVE = 300
+DEFAULT_DEADBANDS = {
+    "soc": 1,
+    "ext_temp": 0.5,
+    "est_battery_range": 1,
+    "ideal_battery_range": 1,
+    "elevation": 5,
+    "power": 0.5,
+    "position": 25,
+}
+
+# Motion-adaptive driving rate (opt-in via ADAPTIVE_DRIVING). While driving, a
+# send goes out early (never sooner than MIN_REFRESH_RATE after the last one)
+# when the car turns, its speed or power swings, or it has covered a set
+# distance since the last sent point. On straight, steady stretches the interval
+# grows by ADAPTIVE_STRETCH per send, from REFRESH_RATE_DRIVING up to
+# ADAPTIVE_MAX_INTERVAL. Heading in degrees, speed in km/h, power in kW,
+# distance in meters.
+DEFAULT_ADAPTIVE_MAX_INTERVAL = 10.0
+ADAPTIVE_STRETCH = 1.5
+DEFAULT_MOTION_THRESHOLDS: Dict[str, float] = {
+    "heading": 15,
+    "speed": 15,
+    "power": 25,
+    "distance": 250,
+}
+# Topics whose messages can trigger an early send.
+MOTION_TOPICS = frozenset(("heading", "speed", "power", "latitude", "longitude"))
+
+# Status topic publishing. STATUS_FORMAT "topics" publishes each field to
+# <status-topic>/<field> (at most once per STATUS_MIN_INTERVAL seconds if it's
+# set); "json" publishes one document with every field to <status-topic>/state,
+# at most once per STATUS_MIN_INTERVAL (default 1) seconds.
+STATUS_FORMATS = ("topics", "json")
+STATUS_DOCUMENT_TOPIC = "state"
+DEFAULT_STATUS_QOS = 1
+DEFAULT_STATUS_MIN_INTERVAL = 1.0
+
+# Extra telemetry sinks (opt-in via SINKS, specs like webhook:URL, influx:URL
+# or jsonl:PATH). Every snapshot sent to ABRP is also handed to each sink. A
+# sink has its own queue of SINK_QUEUE_SIZE records (oldest dropped when full)
+# and worker thread, which writes batches of up to SINK_BATCH_SIZE records at
+# least every SINK_FLUSH_INTERVAL seconds and backs off (doubling up to
+# SINK_MAX_BACKOFF seconds) while writes fail, so a slow or broken sink never
+# delays ABRP delivery.
+SINK_KINDS = ("webhook", "influx", "jsonl")
+DEFAULT_SINK_BATCH_SIZE = 50
+DEFAULT_SINK_FLUSH_INTERVAL = 5.0
+SINK_QUEUE_SIZE = 1000
+SINK_MAX_BACKOFF = 60.0
+LINE_PROTOCOL_MEASUREMENT = "abrp"
+
 # Tesla model ID mapping
 MODEL_MAPPINGS = {
     "3": {
@@ -94,6 +242,85 @@ def validate_refresh_rate(value: Any, default: float, name: str) -> float:
         return default
 
 
+def validate_setting(value: Any, default: float, name: str, minimum: float) -> float:
+    """Validate a numeric setting, falling back to the default for missing,
+    non-finite or below-``minimum`` values (same rules as validate_refresh_rate)."""
+    if value is None:
+        return default
+    try:
+        number = float(value)
+        if not math.isfinite(number) or number < minimum:
+            raise ValueError
+        return number
+    except (ValueError, TypeError):
+        logging.warning(
+            f"Invalid {name} provided: {value}. "
+            f"Must be a number >= {minimum}. Using default: {default}."
+        )
+        return default
+
+
+def parse_thresholds(spec: Optional[str], defaults: Dict[str, float], what: str,
+                     known: bool = False) -> Dict[str, float]:
+    """Parse a ``name=value,...`` spec of non-negative numbers on top of `defaults`.
+
+    Invalid entries (and, with `known`, names not in `defaults`) are skipped
+    with a warning naming `what` they were meant to be.
+    """
+    thresholds: Dict[str, float] = dict(defaults)
+    for entry in (spec or "").split(","):
+        if not entry.strip():
+            continue
+        name, _, value = entry.partition("=")
+        name = name.strip()
+        try:
+            number = float(value)
+            if not name or not math.isfinite(number) or number < 0 or (known and name not in defaults):
+                raise ValueError
+        except ValueError:
+            logging.warning(f"Invalid {what} {entry.strip()!r}, expected field=number. Ignoring it.")
+            continue
+        thresholds[name] = number
+    return thresholds
+
+
+def parse_deadbands(spec: Optional[str]) -> Dict[str, float]:
+    """Parse a ``field=value,...`` deadband spec on top of DEFAULT_DEADBANDS.
+
+    Invalid entries are skipped with a warning; ``field=0`` makes a field
+    compare exactly.
+    """
+    return parse_thresholds(spec, DEFAULT_DEADBANDS, "deadband")
+
+
+def parse_field_ttls(spec: Optional[str]) -> Dict[str, float]:
+    """Parse a ``field=seconds,...`` FIELD_TTLS spec into TTLs by field.
+
+    A field whose last MQTT message is older than its TTL is left out of ABRP
+    updates and the status topic until TeslaMate publishes it again; values
+    the bridge sets itself (utc, parked housekeeping) never expire.
+
+    Invalid entries and names that aren't telemetry fields (or utc, which is
+    stamped on every send) are skipped with a warning; ``field=0`` means no TTL.
+    """
+    ttls = {}
+    for name, seconds in parse_thresholds(spec, {}, "field TTL").items():
+        if name not in TelemetryRecord.INDEX or name == "utc":
+            logging.warning(f"Unknown field {name!r} in field TTLs. Ignoring it.")
+        elif seconds > 0:
+            ttls[name] = seconds
+    return ttls
+
+
+def distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle (haversine) distance between two points, in meters."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * 6371000.0 * math.asin(min(1.0, math.sqrt(a)))
+
+
 # Matches a `token=<value>` query-string parameter so the ABRP user token can be
 # stripped out of anything that gets logged or published (e.g. requests/urllib3
 # exception strings embed the full request URL, which carries the token).
@@ -123,9 +350,1786 @@ def parse_bool_env(name: str, default: bool) -> bool:
     logging.warning(f"Invalid {name} value: {value!r}. Using default: {default}.")
     return default
 
+def create_mqtt_client(config: Dict[str, Any], client_id: str, will_topic: Optional[str]) -> mqtt.Client:
+    """Build a paho client with authentication, TLS and last will configured.
+
+    Shared by the single-car bridge and the multi-car fleet so both set up the
+    broker connection identically. Callbacks are attached by the caller.
+    """
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id)
+
+    # Set up authentication based on available credentials
+    mqtt_username = config.get("MQTTUSERNAME")
+    mqtt_password = config.get("MQTTPASSWORD")
+
+    if mqtt_username and mqtt_password:
+        logging.debug(f"Using MQTT authentication with username: {mqtt_username} and password")
+        client.username_pw_set(mqtt_username, mqtt_password)
+    elif mqtt_username:
+        logging.debug(f"Using MQTT username only: {mqtt_username} (no password)")
+        client.username_pw_set(mqtt_username)
+    else:
+        logging.debug("No MQTT authentication configured")
+
+    # Set up TLS if needed with better error handling
+    if config.get("MQTTTLS"):
+        try:
+            import ssl
+            logging.debug("Using TLS with MQTT")
+            verify_cert = config.get("MQTT_VERIFY_CERT", True)
+            cert_reqs = ssl.CERT_REQUIRED if verify_cert else ssl.CERT_NONE
+            client.tls_set(cert_reqs=cert_reqs)
+            logging.debug(f"TLS configured with certificate verification: {verify_cert}")
+        except ImportError:
+            logging.error("SSL module not available. TLS cannot be enabled.")
+        except Exception as e:
+            logging.error(f"Failed to configure TLS: {e}")
+
+    # Set up last will if a status topic is set
+    if will_topic:
+        logging.debug(f"Using MQTT status topic: {will_topic} for last will")
+        client.will_set(will_topic, payload="offline", qos=2, retain=True)
+
+    return client
+
+
+def connect_mqtt_client(client: mqtt.Client, config: Any) -> None:
+    """Connect to the configured broker and start paho's network loop thread
+    (unless ASYNC_RUNTIME is set: AsyncRuntime then drives the socket).
+
+    Exits the process on failure: without a broker there is nothing to bridge.
+    """
+    mqtt_port = config.get("MQTTPORT", DEFAULT_MQTT_PORT)
+    mqtt_server = config.get("MQTTSERVER")
+
+    # Convert port to integer
+    try:
+        mqtt_port = int(mqtt_port)
+    except (ValueError, TypeError):
+        logging.warning(f"Invalid MQTT port provided: {mqtt_port}. Using default: {DEFAULT_MQTT_PORT}")
+        mqtt_port = DEFAULT_MQTT_PORT
+
+    logging.debug(f"Attempting to connect to MQTT server: {mqtt_server}:{mqtt_port}")
+
+    try:
+        client.connect(mqtt_server, mqtt_port)
+        if not config.get("ASYNC_RUNTIME"):
+            client.loop_start()
+        logging.debug("MQTT client connection started successfully")
+    except ConnectionRefusedError:
+        error_msg = f"Connection refused to MQTT server {mqtt_server}:{mqtt_port}. Check if the server is running and accessible."
+        logging.critical(error_msg)
+        sys.exit(error_msg)
+    except TimeoutError:
+        error_msg = f"Connection timeout to MQTT server {mqtt_server}:{mqtt_port}. Check network connectivity and firewall settings."
+        logging.critical(error_msg)
+        sys.exit(error_msg)
+    except Exception as e:
+        error_msg = f"Failed to connect to MQTT server: {e}"
+        logging.critical(error_msg)
+        sys.exit(error_msg)
+
+
+def mqtt_connect_error(reason_code: Any) -> Optional[str]:
+    """Map a CONNACK reason code to a fatal error message (None on success)."""
+    if reason_code == 5 or reason_code == 4:  # Auth failure codes
+        return "MQTT Authentication failed. Check your username and password."
+    elif reason_code == 3:  # Server unavailable
+        return "MQTT Broker unavailable. Check if the server is running."
+    elif reason_code == 2:  # Client identifier rejected
+        return "MQTT Client ID rejected. Try using a different client ID."
+    elif reason_code != 0:
+        return f"Could not connect to MQTT server. Reason: {mqtt.connack_string(reason_code)} (code {reason_code})"
+    return None
+
+class ABRPSession:
+    """Long-lived, pooled HTTP(S) session for ABRP telemetry POSTs.
+
+    Keeps connections to api.iternio.com alive between sends so only the first
+    POST pays for the TCP+TLS handshake. One instance is shared by every car in
+    multi-car mode. stats() exposes the connection reuse counters.
+    """
+
+    def __init__(self, pool_size: int = DEFAULT_HTTP_POOL_SIZE,
+                 connect_timeout: float = DEFAULT_HTTP_CONNECT_TIMEOUT,
+                 read_timeout: float = DEFAULT_HTTP_READ_TIMEOUT):
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        # No automatic retries: a failed send is simply superseded by the next
+        # scheduled one, which carries fresher data anyway.
+        self.adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=0
+        )
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "ABRPSession":
+        """Build a session from the HTTP_* config keys, validating each."""
+        return cls(
+            pool_size=int(validate_setting(
+                config.get("HTTP_POOL_SIZE"), DEFAULT_HTTP_POOL_SIZE, "HTTP pool size", 1
+            )),
+            connect_timeout=validate_setting(
+                config.get("HTTP_CONNECT_TIMEOUT"), DEFAULT_HTTP_CONNECT_TIMEOUT, "HTTP connect timeout", 0.1
+            ),
+            read_timeout=validate_setting(
+                config.get("HTTP_READ_TIMEOUT"), DEFAULT_HTTP_READ_TIMEOUT, "HTTP read timeout", 0.1
+            ),
+        )
+
+    def post(self, url: str, timeout: Optional[Tuple[float, float]] = None, **kwargs) -> requests.Response:
+        """POST through the pooled session with the configured timeouts
+        (or tighter ones, e.g. for backlog replay)."""
+        return self.session.post(url, timeout=timeout or self.timeout, **kwargs)
+
+    def stats(self) -> Dict[str, int]:
+        """Connection reuse counters summed over every pooled host.
+
+        ``connections`` is the number of connections opened, ``requests`` the
+        number of requests sent and ``reused`` how many went over an existing
+        keep-alive connection.
+        """
+        pools = self.adapter.poolmanager.pools
+        connections = requests_sent = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                requests_sent += pool.num_requests
+        return {
+            "connections": connections,
+            "requests": requests_sent,
+            "reused": max(0, requests_sent - connections),
+        }
+
+    def close(self):
+        self.session.close()
+
+def parse_user_tokens(value: Any) -> List[Tuple[str, str]]:
+    """(label, token) pairs from a USERTOKEN setting: a single token, several
+    separated by commas (or a list, from the cars config), each optionally
+    written as label=token. Unnamed tokens are labelled 1, 2, ... by position.
+
+    Raises ValueError on an invalid or duplicate label.
+    """
+    entries = value if isinstance(value, (list, tuple)) else str(value or "").split(",")
+    pairs: List[Tuple[str, str]] = []
+    for position, entry in enumerate((str(e).strip() for e in entries if str(e).strip()), start=1):
+        label, sep, token = entry.partition("=")
+        if not sep:
+            label, token = str(position), entry
+        if not RECIPIENT_LABEL_RE.match(label) or not token:
+            raise ValueError(f"Invalid user token entry #{position}, expected TOKEN or LABEL=TOKEN "
+                             f"(labels: letters, digits, _ and -).")
+        if any(label == existing for existing, _ in pairs):
+            raise ValueError(f"User token label {label!r} is used more than once.")
+        pairs.append((label, token))
+    return pairs
+
+
+def token_key(token: str) -> str:
+    """A short, stable stand-in for a user token (a truncated SHA-256), for
+    keying an account's queued rows without storing the token itself."""
+    return hashlib.sha256(token.encode()).hexdigest()[:12]
+
+
+class ABRPRecipient:
+    """One ABRP account (user token) a car's telemetry is delivered to.
+
+    Queued rows are kept under ``<car>/<token_key>`` and each account has its
+    own backlog drainer. Rows follow the token rather than its label or
+    position, so adding, removing, reordering or renaming tokens doesn't hand
+    them to another account. With a single account, status topics keep their
+    plain names (``_tm2abrp_post_last_status``); with several, each gets its
+    own (``_tm2abrp_<label>_post_last_status``).
+    """
+
+    def __init__(self, label: str, url: str, prefix: str, queue_target: str, suffix: str = ""):
+        self.label = label
+        self.url = url
+        self.prefix = prefix
+        self.queue_target = queue_target
+        # Appended to log lines so they say which account they're about.
+        self.suffix = suffix
+        self.drainer: Optional["BacklogDrainer"] = None
+
+
+class Metrics:
+    """Counters and histograms for the bridge's hot paths, rendered in the
+    Prometheus text exposition format.
+
+    Samples are keyed by their label values (in FAMILIES order), so recording
+    one is a dict update under a lock. One instance is shared by every car in
+    multi-car mode; the ``car`` label tells them apart.
+    """
+
+    # name -> (type, help, label names, histogram buckets)
+    FAMILIES: Dict[str, Tuple[str, str, Tuple[str, ...], Tuple[float, ...]]] = {
+        "tm2abrp_mqtt_messages_total": (
+            "counter", "MQTT messages received, by TeslaMate topic.", ("car", "topic"), ()),
+        "tm2abrp_process_message_seconds": (
+            "histogram", "Time spent applying one MQTT message.", ("car",), FAST_BUCKETS),
+        "tm2abrp_data_lock_wait_seconds": (
+            "histogram", "Time spent waiting for a car's data lock.", ("car", "site"), FAST_BUCKETS),
+        "tm2abrp_abrp_post_seconds": (
+            "histogram", "ABRP telemetry POST latency, by outcome.", ("car", "outcome"), LATENCY_BUCKETS),
+        "tm2abrp_scheduler_lag_seconds": (
+            "histogram", "How late routine sends ran past their intended deadline.", ("car",), LATENCY_BUCKETS),
+        "tm2abrp_sends_total": (
+            "counter", "Due sends by car state and decision (sent or suppressed).", ("car", "state", "decision"), ()),
+        "tm2abrp_snapshots_superseded_total": (
+            "counter", "Snapshots replaced by a newer one before the sender got to them.", ("car",), ()),
+        "tm2abrp_send_in_flight_seconds": (
+            "histogram", "Time the sender worker spent delivering one snapshot.", ("car",), LATENCY_BUCKETS),
+        "tm2abrp_sink_records_total": (
+            "counter", "Records handled by the extra telemetry sinks (written, failed or dropped).",
+            ("sink", "outcome"), ()),
+        "tm2abrp_data_age_seconds": (
+            "histogram", "Age of the data in accepted ABRP POSTs, by stage (see FreshnessTracker).",
+            ("car", "stage"), AGE_BUCKETS),
+    }
+    # ABRPSession.stats() key -> (metric name, help)
+    SESSION_STATS = {
+        "connections": ("tm2abrp_http_connections_total", "HTTP connections opened to ABRP."),
+        "requests": ("tm2abrp_http_requests_total", "HTTP requests sent to ABRP."),
+        "reused": ("tm2abrp_http_reused_total", "HTTP requests sent over a kept-alive connection."),
+    }
+
+    def __init__(self, port: Optional[int] = None, bind: str = DEFAULT_METRICS_BIND,
+                 session: Optional["ABRPSession"] = None):
+        self.port = port
+        self.bind = bind
+        self.session = session
+        self.server: Optional["MetricsServer"] = None
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Tuple[str, ...], float]] = {}
+        # Per label set: one count per bucket (the last is +Inf), then the sum.
+        self._histograms: Dict[str, Dict[Tuple[str, ...], List[float]]] = {}
+        for name, (kind, _, _, _) in self.FAMILIES.items():
+            (self._counters if kind == "counter" else self._histograms)[name] = {}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], session: Optional["ABRPSession"] = None) -> Optional["Metrics"]:
+        """Build the registry if METRICS_PORT is set, else None."""
+        port = config.get("METRICS_PORT")
+        if port is None or port == "":
+            return None
+        try:
+            port = int(port)
+            if not 0 <= port <= 65535:
+                raise ValueError
+        except (TypeError, ValueError):
+            logging.warning(f"Invalid metrics port {port!r}, metrics endpoint disabled.")
+            return None
+        return cls(port, config.get("METRICS_BIND") or DEFAULT_METRICS_BIND, session)
+
+    def inc(self, name: str, labels: Tuple[str, ...], value: float = 1):
+        """Add `value` to a counter."""
+        with self._lock:
+            samples = self._counters[name]
+            samples[labels] = samples.get(labels, 0) + value
+
+    def observe(self, name: str, labels: Tuple[str, ...], value: float):
+        """Record one histogram observation."""
+        buckets = self.FAMILIES[name][3]
+        index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            samples = self._histograms[name]
+            counts = samples.get(labels)
+            if counts is None:
+                counts = samples[labels] = [0.0] * (len(buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def render(self) -> str:
+        """The current samples in the Prometheus text format (version 0.0.4)."""
+        with self._lock:
+            counters = {name: dict(samples) for name, samples in self._counters.items()}
+            histograms = {name: {labels: list(counts) for labels, counts in samples.items()}
+                          for name, samples in self._histograms.items()}
+        lines: List[str] = []
+        for name, (kind, help_text, label_names, buckets) in self.FAMILIES.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for labels, value in sorted(counters[name].items()):
+                    lines.append(f"{name}{self._labels(label_names, labels)} {value!r}")
+                continue
+            for labels, counts in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, count in zip(buckets + (math.inf,), counts):
+                    cumulative += int(count)
+                    le = "+Inf" if bound == math.inf else repr(bound)
+                    lines.append(f"{name}_bucket{self._labels(label_names + ('le',), labels + (le,))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(label_names, labels)} {counts[-1]!r}")
+                lines.append(f"{name}_count{self._labels(label_names, labels)} {cumulative}")
+        if self.session is not None:
+            stats = self.session.stats()
+            for key, (name, help_text) in self.SESSION_STATS.items():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter", f"{name} {stats[key]}"]
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+        escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+        return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+    def start_server(self):
+        """Serve /metrics in the background; a port that can't be bound only
+        costs the endpoint, not the bridge."""
+        if self.port is None or self.server is not None:
+            return
+        try:
+            self.server = MetricsServer(self, self.port, self.bind)
+        except OSError as e:
+            logging.error(f"Could not start the metrics endpoint on {self.bind}:{self.port}: {e}")
+            return
+        logging.info(f"Serving metrics on http://{self.bind}:{self.server.port}/metrics.")
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+
+class MetricsServer:
+    """Minimal HTTP server exposing Metrics.render() at /metrics from a daemon thread."""
+
+    def __init__(self, metrics: Metrics, port: int, bind: str = DEFAULT_METRICS_BIND):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(f"Metrics request: {format % args}")
+
+        self.httpd = http.server.ThreadingHTTPServer((bind, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class Scheduler:
+    """Deadline heap driving the update loop.
+
+    Each scheduled key (a TeslaMateABRP) has one pending deadline on the
+    monotonic clock. wait() sleeps exactly until the earliest deadline or until
+    woken from another thread, so there are no idle wakeups between sends and a
+    state change is picked up as soon as its MQTT message is processed.
+    """
+
+    def __init__(self, clock: Callable[[], float] = monotonic):
+        self.clock = clock
+        self._heap: List[Tuple[float, int, Any]] = []
+        # Current deadline per key; heap entries that don't match are stale and
+        # skipped lazily, so rescheduling a key never has to search the heap.
+        self._deadlines: Dict[Any, float] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._woken = False
+        # Called after every schedule()/wake(), for waiters other than wait()
+        # (the asyncio runtime). May be called from any thread.
+        self.listener: Optional[Callable[[], None]] = None
+
+    def schedule(self, key: Any, deadline: float):
+        """Set (or replace) the key's next deadline and wake the waiter."""
+        with self._cond:
+            self._deadlines[key] = deadline
+            heapq.heappush(self._heap, (deadline, next(self._seq), key))
+            self._cond.notify()
+        if self.listener is not None:
+            self.listener()
+
+    def wake(self, key: Any = None):
+        """Wake the waiter: make `key` due now, or, without a key, just return
+        from wait() so the loop re-checks its exit conditions."""
+        if key is not None:
+            self.schedule(key, self.clock())
+            return
+        with self._cond:
+            self._woken = True
+            self._cond.notify()
+        if self.listener is not None:
+            self.listener()
+
+    def next_deadline(self) -> Optional[float]:
+        """Earliest pending deadline, or None if nothing is scheduled."""
+        with self._cond:
+            return self._peek()
+
+    def pop_due(self, now: float) -> List[Any]:
+        """Remove and return every key whose deadline is at or before `now`."""
+        with self._cond:
+            return self._pop_due(now)
+
+    def wait(self) -> List[Any]:
+        """Block until at least one key is due (returning the due keys) or
+        wake() is called without a key (returning whatever is due, maybe [])."""
+        with self._cond:
+            while True:
+                now = self.clock()
+                deadline = self._peek()
+                if self._woken or (deadline is not None and deadline <= now):
+                    self._woken = False
+                    return self._pop_due(now)
+                self._wait(None if deadline is None else deadline - now)
+
+    def _wait(self, timeout: Optional[float]):
+        # Separate hook so tests and replay can substitute a virtual clock.
+        self._cond.wait(timeout)
+
+    def _peek(self) -> Optional[float]:
+        while self._heap:
+            deadline, _, key = self._heap[0]
+            if self._deadlines.get(key) == deadline:
+                return deadline
+            heapq.heappop(self._heap)  # stale entry
+        return None
+
+    def _pop_due(self, now: float) -> List[Any]:
+        due: List[Any] = []
+        while True:
+            deadline = self._peek()
+            if deadline is None or deadline > now:
+                return due
+            _, _, key = heapq.heappop(self._heap)
+            del self._deadlines[key]
+            due.append(key)
+
+
+def run_schedule(scheduler: Scheduler, fatal_error: Callable[[], Optional[str]]):
+    """Run the update loop: tick every due key and reschedule it at the
+    deadline its tick() returns (None leaves it idle until woken).
+
+    Exits via SystemExit once `fatal_error()` reports a fatal MQTT failure.
+    """
+    while True:
+        # A fatal MQTT failure is flagged from the callback thread; exit the
+        # process from the main thread so it doesn't wait here forever and
+        # the container runtime can apply its restart policy.
+        error = fatal_error()
+        if error:
+            raise SystemExit(error)
+        for key in scheduler.wait():
+            deadline = key.tick()
+            if deadline is not None:
+                scheduler.schedule(key, deadline)
+
+class TelemetryRecord(collections.abc.Mapping):
+    """Read-only telemetry with a fixed schema.
+
+    Values live in a list indexed by FIELDS, with a bitmask saying which are
+    present (e.g. ``kwh_charged`` only while charging), so a copy is one list
+    and one int instead of a dict. Reads behave like a dict of the present
+    fields, in schema order. A parallel list holds when the MQTT message
+    behind each field arrived (scheduler clock; restored from the state cache
+    across restarts), None for fields the bridge set itself (utc, parked
+    housekeeping).
+    """
+
+    # Everything ABRP's tlm payload may carry; order is the payload order.
+    FIELDS = (
+        "utc", "soc", "power", "speed", "lat", "lon", "elevation", "is_charging", "is_dcfc",
+        "is_parked", "est_battery_range", "ideal_battery_range", "ext_temp", "model",
+        "trim_badging", "car_model", "tlm_type", "voltage", "current", "kwh_charged",
+        "heading", "odometer",
+    )
+    INDEX = {name: index for index, name in enumerate(FIELDS)}
+    # The car's identity: sent once as a retained message, so its arrival
+    # says nothing about how fresh the telemetry is (see Payload.arrived).
+    STATIC_FIELDS = frozenset(("model", "trim_badging", "car_model"))
+
+    __slots__ = ("_values", "_present", "_arrived")
+
+    def __init__(self, values: Optional[List[Any]] = None, present: int = 0,
+                 arrived: Optional[List[Optional[float]]] = None):
+        self._values = values if values is not None else [None] * len(self.FIELDS)
+        self._present = present
+        self._arrived: List[Optional[float]] = arrived if arrived is not None else [None] * len(self.FIELDS)
+
+    def __getitem__(self, key: str) -> Any:
+        index = self.INDEX[key]
+        if not self._present >> index & 1:
+            raise KeyError(key)
+        return self._values[index]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        index = self.INDEX.get(key)
+        if index is None or not self._present >> index & 1:
+            return default
+        return self._values[index]
+
+    def __contains__(self, key: object) -> bool:
+        index = self.INDEX.get(key)  # type: ignore[call-overload]
+        return index is not None and bool(self._present >> index & 1)
+
+    def __iter__(self) -> Iterator[str]:
+        present = self._present
+        return (name for index, name in enumerate(self.FIELDS) if present >> index & 1)
+
+    def __len__(self) -> int:
+        return self._present.bit_count()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self.items())})"
+
+    def arrived(self, key: str) -> Optional[float]:
+        """When the MQTT message behind a field arrived; None if it's absent
+        or wasn't set from a message."""
+        index = self.INDEX[key]
+        return self._arrived[index] if self._present >> index & 1 else None
+
+    def expired(self, ttls: Mapping[str, float], now: float) -> int:
+        """Bitmask (by FIELDS index) of the present fields whose MQTT message
+        arrived more than their TTL before `now`."""
+        mask = 0
+        present = self._present
+        arrived = self._arrived
+        for name, ttl in ttls.items():
+            index = self.INDEX[name]
+            stamp = arrived[index]
+            if stamp is not None and present >> index & 1 and now - stamp > ttl:
+                mask |= 1 << index
+        return mask
+
+    def without(self, omit: int) -> "TelemetryRecord":
+        """This record minus the fields in bitmask `omit` (shares the lists,
+        so only use it on a snapshot's record)."""
+        if not omit:
+            return self
+        return TelemetryRecord(self._values, self._present & ~omit, self._arrived)
+
+    def to_payload(self) -> "Payload":
+        """The present fields as ABRP's tlm object, leaving out any non-finite
+        number (json with allow_nan=False would reject the whole payload)."""
+        present = self._present
+        values = self._values
+        arrived = self._arrived
+        payload = Payload()
+        oldest: Optional[float] = None
+        newest: Optional[float] = None
+        for index, name in enumerate(self.FIELDS):
+            if present >> index & 1:
+                value = values[index]
+                if isinstance(value, float) and not math.isfinite(value):
+                    continue
+                payload[name] = value
+                stamp = arrived[index]
+                if stamp is not None and name not in self.STATIC_FIELDS:
+                    if oldest is None or stamp < oldest:
+                        oldest = stamp
+                    if newest is None or stamp > newest:
+                        newest = stamp
+        if oldest is not None and newest is not None:
+            payload.arrived = (oldest, newest)
+        return payload
+
+
+class Payload(dict):
+    """An ABRP tlm object, plus when the MQTT messages behind its fields
+    arrived: ``arrived`` is (oldest, newest) over the telemetry fields (not
+    the car's identity, TelemetryRecord.STATIC_FIELDS) or None if none came
+    from a message, and ``taken`` is when update_abrp built it (None for
+    payloads from elsewhere, e.g. the outbox). Encodes like a plain dict."""
+    arrived: Optional[Tuple[float, float]] = None
+    taken: Optional[float] = None
+
+
+class Snapshot(NamedTuple):
+    """A read-only copy of a bridge's telemetry and the version it was taken at."""
+    version: int
+    data: TelemetryRecord
+
+
+class TelemetryData(TelemetryRecord, collections.abc.MutableMapping):
+    """The live telemetry record, with a version counter and lock-free snapshots.
+
+    Writes come from one thread at a time (the MQTT callback thread, or the
+    update loop's parked housekeeping, both holding the bridge's data_lock)
+    and each one bumps ``version``. Readers call snapshot() instead of taking
+    the lock: like a seqlock, the copy is retried if a write or an open
+    batch() overlapped it, so it never mixes two messages. The snapshot is
+    cached per version, so polling an unchanged store costs nothing and
+    comparing versions tells a reader whether there is anything new.
+    Setting a field outside FIELDS raises KeyError. Writes inside
+    ``batch(arrived=...)`` record that arrival time for the fields they set;
+    any other write clears it.
+    """
+
+    __slots__ = ("version", "writing", "stamp", "_snapshot")
+
+    def __init__(self, initial: Optional[Dict[str, Any]] = None):
+        super().__init__()
+        self.version = 0
+        self.writing = 0
+        self.stamp: Optional[float] = None  # arrival time given to writes, None outside batch(arrived)
+        self._snapshot: Optional[Snapshot] = None
+        for key, value in (initial or {}).items():
+            self[key] = value
+        self.version = 0
+
+    @contextmanager
+    def batch(self, arrived: Optional[float] = None) -> Iterator["TelemetryData"]:
+        """Group several writes so no snapshot sees only some of them; with
+        `arrived`, stamp them with when their MQTT message arrived."""
+        self.writing += 1
+        stamp = self.stamp
+        if arrived is not None:
+            self.stamp = arrived
+        try:
+            yield self
+        finally:
+            self.stamp = stamp
+            self.writing -= 1
+
+    def snapshot(self) -> Snapshot:
+        """The latest consistent telemetry, without locking."""
+        while True:
+            version = self.version
+            cached = self._snapshot
+            if not self.writing:
+                if cached is not None and cached.version == version:
+                    return cached
+                record = TelemetryRecord(list(self._values), self._present, list(self._arrived))
+                # The re-check catches a write or batch that started meanwhile.
+                if not self.writing and self.version == version:
+                    snapshot = Snapshot(version, record)
+                    self._snapshot = snapshot
+                    return snapshot
+            sleep(0)
+
+    def __setitem__(self, key: str, value: Any):
+        index = self.INDEX[key]
+        self.writing += 1
+        self._values[index] = value
+        self._arrived[index] = self.stamp
+        self._present |= 1 << index
+        self.version += 1
+        self.writing -= 1
+
+    def __delitem__(self, key: str):
+        index = self.INDEX[key]
+        if not self._present >> index & 1:
+            raise KeyError(key)
+        self.writing += 1
+        self._present &= ~(1 << index)
+        self._values[index] = None
+        self.version += 1
+        self.writing -= 1
+
+    def pop(self, key: str, *default: Any) -> Any:
+        if key not in self:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        value = self[key]
+        del self[key]
+        return value
+
+
+# Built once: json.dumps with non-default options makes a new encoder per call.
+_JSON_ENCODER = json.JSONEncoder(separators=(",", ":"), allow_nan=False)
+
+
+def dump_json(value: Any) -> bytes:
+    """Compact JSON as UTF-8 bytes, with orjson when it's installed."""
+    if HAS_ORJSON:
+        return orjson.dumps(value)
+    return _JSON_ENCODER.encode(value).encode("utf-8")
+
+
+class PayloadEncoder:
+    """Builds the body of an ABRP POST ({"tlm": {...}}) as bytes: one
+    orjson.dumps() call when orjson is installed, otherwise one call to a
+    prebuilt json.JSONEncoder. Non-finite numbers raise ValueError either way.
+    """
+
+    def encode(self, tlm: Mapping[str, Any]) -> bytes:
+        if not HAS_ORJSON:
+            return _JSON_ENCODER.encode({"tlm": tlm}).encode("utf-8")
+        body = orjson.dumps({"tlm": tlm})
+        # orjson writes nan/inf as null; only then is a scan needed.
+        if b"null" in body:
+            for value in tlm.values():
+                if type(value) is float and not math.isfinite(value):
+                    raise ValueError(f"Out of range float values are not JSON compliant: {value!r}")
+        return body
+
+
+class TopicHandler(NamedTuple):
+    """How process_message applies one TeslaMate topic: parse the payload,
+    validate it, store it in ``field`` (if any), then run ``hook(bridge, value)``."""
+    field: Optional[str]
+    parser: Callable[[str], Any]
+    # Reject nan/inf (float topics) and values outside [minimum, maximum].
+    finite: bool = False
+    minimum: Optional[float] = None
+    maximum: Optional[float] = None
+    # Only keep the field while the value is above this; otherwise remove it.
+    present_above: Optional[float] = None
+    # Ignored entirely when SKIPLOCATION is set.
+    location: bool = False
+    # Process empty payloads too (for topics where "" is meaningful).
+    allow_empty: bool = False
+    hook: Optional[Callable[[Any, Any], None]] = None
+
+
+def compile_topic_handler(handler: TopicHandler) -> Callable[[Any, str], None]:
+    """Turn a TopicHandler into an ``apply(bridge, payload)`` function.
+
+    The steps a topic doesn't need are left out at compile time, so the common
+    plain "parse and store" topics run a minimal function on the paho callback
+    thread. Parse errors surface as ValueError for process_message to drop.
+    """
+    field, parser, finite, minimum, maximum, present_above, location, allow_empty, hook = handler
+    isfinite = math.isfinite
+    plain = minimum is None and maximum is None and present_above is None and hook is None \
+        and not location and not allow_empty and field is not None
+
+    if plain and not finite:
+        def apply_plain(bridge, payload):
+            if payload:
+                bridge.data[field] = parser(payload)
+        return apply_plain
+
+    if plain:
+        def apply_finite(bridge, payload):
+            if payload:
+                value = parser(payload)
+                # Reject non-finite values (nan/inf): json(allow_nan=False)
+                # would otherwise reject the whole payload on every POST.
+                if isfinite(value):
+                    bridge.data[field] = value
+        return apply_finite
+
+    def apply(bridge, payload):
+        if location and bridge.config.get("SKIPLOCATION"):
+            return
+        # Skip empty payloads for most topics
+        if not payload and not allow_empty:
+            return
+        value = parser(payload)
+        if finite and not isfinite(value):
+            return
+        if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+            return
+        if field is not None:
+            if present_above is None or value > present_above:
+                bridge.data[field] = value
+            else:
+                # Below the threshold the reading is meaningless (e.g. no
+                # charger connected): drop the field instead of sending 0.
+                bridge.data.pop(field, None)
+        if hook is not None:
+            hook(bridge, value)
+    return apply
+
+
+class TelemetryOutbox:
+    """Bounded, crash-safe on-disk queue of telemetry ABRP didn't receive.
+
+    Backed by SQLite (WAL journal), so queued rows survive a crash or restart.
+    Rows are grouped by ``target`` (car and account), keep the snapshot's
+    original ``utc`` and are evicted by age and by total size, oldest first.
+    """
+
+    def __init__(self, path: str, max_age: float = DEFAULT_QUEUE_MAX_AGE,
+                 max_size: int = DEFAULT_QUEUE_MAX_SIZE):
+        self.max_age = max_age
+        self.max_size = max_size
+        # Used from the update loop and (later) sender threads: serialize
+        # access ourselves instead of relying on sqlite's thread check.
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, target TEXT NOT NULL, "
+            "utc INTEGER NOT NULL, tlm TEXT NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS outbox_target ON outbox (target, id)")
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> Optional["TelemetryOutbox"]:
+        """Open the queue configured by QUEUE_PATH, or None if it's disabled."""
+        path = config.get("QUEUE_PATH")
+        if not path:
+            return None
+        return cls(
+            path,
+            max_age=validate_setting(config.get("QUEUE_MAX_AGE"), DEFAULT_QUEUE_MAX_AGE, "queue max age", 1),
+            max_size=int(validate_setting(
+                config.get("QUEUE_MAX_SIZE"), DEFAULT_QUEUE_MAX_SIZE, "queue max size", 1
+            )),
+        )
+
+    def put(self, target: str, tlm: Dict[str, Any]):
+        """Queue one unsent snapshot, then apply the eviction policies."""
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO outbox (target, utc, tlm) VALUES (?, ?, ?)",
+                (target, int(tlm.get("utc", 0)), json.dumps(tlm)),
+            )
+            self._evict()
+
+    def peek(self, target: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """Oldest (row id, snapshot) queued for target, or None."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT id, tlm FROM outbox WHERE target = ? ORDER BY id LIMIT 1", (target,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def remove(self, row_id: int):
+        with self.lock:
+            self.db.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
+
+    def count(self, target: Optional[str] = None) -> int:
+        """Number of queued rows, for one target or in total."""
+        with self.lock:
+            if target is None:
+                return self.db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+            return self.db.execute("SELECT COUNT(*) FROM outbox WHERE target = ?", (target,)).fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def retarget(self, old: str, new: str) -> int:
+        """Move the rows queued for `old` to `new`; returns how many."""
+        with self.lock:
+            return self.db.execute("UPDATE outbox SET target = ? WHERE target = ?", (new, old)).rowcount
+
+    def evict(self):
+        """Apply the eviction policies (put() does so after every insert)."""
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        cutoff = calendar.timegm(datetime.datetime.now(datetime.UTC).timetuple()) - self.max_age
+        self.db.execute("DELETE FROM outbox WHERE utc < ?", (cutoff,))
+        excess = self.db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0] - self.max_size
+        if excess > 0:
+            self.db.execute("DELETE FROM outbox WHERE id IN (SELECT id FROM outbox ORDER BY id LIMIT ?)", (excess,))
+
+
+class StateCache:
+    """On-disk cache of each car's last known state, for warm restarts.
+
+    One JSON file holds an entry per target (the car number): the saved
+    telemetry and when each field's MQTT message arrived (``arrived``), the
+    resolved car model, whether a usable battery level had been seen, what
+    was last published to the status topic and when the entry was saved
+    (``saved_at``). Times are UTC seconds. Writes replace the file
+    atomically, so a crash mid-write leaves the previous version.
+    """
+
+    def __init__(self, path: str, max_age: float = STATE_CACHE_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                entries = json.load(f)
+            if isinstance(entries, dict):
+                self.entries = entries
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable state cache {path}: {e}")
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> Optional["StateCache"]:
+        """Open the cache configured by STATE_CACHE_PATH, or None if it's disabled."""
+        path = config.get("STATE_CACHE_PATH")
+        return cls(path) if path else None
+
+    def load(self, target: str) -> Optional[Dict[str, Any]]:
+        """The target's saved entry, or None if there is none or it's too old."""
+        with self.lock:
+            entry = self.entries.get(target)
+        if not isinstance(entry, dict) or not isinstance(entry.get("data"), dict):
+            return None
+        now = calendar.timegm(datetime.datetime.now(datetime.UTC).timetuple())
+        if now - entry.get("saved_at", 0) > self.max_age:
+            return None
+        return entry
+
+    def save(self, target: str, entry: Dict[str, Any]):
+        """Store the target's entry (stamped with saved_at) and rewrite the file."""
+        entry["saved_at"] = calendar.timegm(datetime.datetime.now(datetime.UTC).timetuple())
+        with self.lock:
+            self.entries[target] = entry
+            tmp = f"{self.path}.tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(self.entries, f, separators=(",", ":"))
+                os.replace(tmp, self.path)
+            except (OSError, ValueError) as e:
+                logging.error(f"Could not write state cache {self.path}: {e}")
+
+
+class BacklogDrainer:
+    """Scheduler key that replays a car's queued telemetry after an outage.
+
+    Runs at most QUEUE_DRAIN_RATE POSTs per second, steps aside whenever the
+    car's next live send is due within QUEUE_LIVE_GUARD, and goes idle on the
+    first failure until the next successful live send restarts it. tick()
+    only decides: once the car's sender is running, each replay POST runs
+    there behind any waiting live snapshot, and the next tick is scheduled
+    when it's done, so a slow ABRP never holds up the update loop. A replay's
+    timeouts are cut to end before the next live send is due, so it can't
+    hold that send up on the sender either.
+    """
+
+    def __init__(self, car: Any, rate: float = DEFAULT_QUEUE_DRAIN_RATE,
+                 recipient: Optional[ABRPRecipient] = None):
+        self.car = car
+        # Which of the car's ABRP accounts this drains (the first by default).
+        self.recipient = recipient or car.recipients[0]
+        self.interval = 1.0 / rate
+        self.active = False
+        self.replayed = 0
+
+    def start(self):
+        """Start draining (no-op if already running or nothing is queued)."""
+        outbox = self.car.outbox
+        if self.active or not outbox.count(self.recipient.queue_target):
+            return
+        # Evict once per drain rather than on every replayed row.
+        outbox.evict()
+        if outbox.count(self.recipient.queue_target):
+            self.active = True
+            self.car.scheduler.wake(self)
+
+    def tick(self, now: Optional[float] = None) -> Optional[float]:
+        car = self.car
+        if now is None:
+            now = car.scheduler.clock()
+        # Live data first: let an imminent live send go ahead of the backlog.
+        live = car.next_send
+        if live is not None and live - now < QUEUE_LIVE_GUARD:
+            return max(live, now)
+
+        if car.sender.running:
+            car.sender.submit_job(self.replay_next, self.finish)
+            return None
+        return self.replayed_next(self.replay_next(), now)
+
+    def replay_next(self) -> Optional[Tuple[int, bool]]:
+        """POST the oldest queued snapshot: (row id, handled), or None once
+        the queue is empty. The blocking part of a drain step."""
+        try:
+            entry = self.car.outbox.peek(self.recipient.queue_target)
+        except sqlite3.Error as e:
+            logging.error(f"Could not read queued telemetry: {e}")
+            return 0, False  # go idle like a failed replay
+        if entry is None:
+            return None
+        row_id, tlm = entry
+        return row_id, self.car.replay_snapshot(tlm, self.recipient, self.timeout())
+
+    def timeout(self) -> Optional[Tuple[float, float]]:
+        """(connect, read) timeouts ending before the car's next live send,
+        or None (the session's own) while none is scheduled."""
+        live = self.car.next_send
+        if live is None:
+            return None
+        budget = max(MIN_REPLAY_TIMEOUT, live - self.car.scheduler.clock())
+        connect, read = self.car.session.timeout
+        return min(connect, budget), min(read, budget)
+
+    def replayed_next(self, result: Optional[Tuple[int, bool]], now: Optional[float] = None) -> Optional[float]:
+        """Book a replay_next() result; returns when to replay the next row,
+        or None once drained or ABRP is unreachable again."""
+        car = self.car
+        if result is None:
+            logging.info(f"ABRP backlog drained{self.recipient.suffix} ({self.replayed} queued updates replayed).")
+            self.active = False
+            car.publish_queue_size(self.recipient)
+            return None
+        row_id, handled = result
+        if not handled:
+            # Still unreachable: wait for the next successful live send.
+            self.active = False
+            return None
+        car.outbox.remove(row_id)
+        self.replayed += 1
+        car.publish_queue_size(self.recipient)
+        return (car.scheduler.clock() if now is None else now) + self.interval
+
+    def finish(self, result: Optional[Tuple[int, bool]]):
+        """Book a replay the sender ran, then schedule the next tick."""
+        try:
+            deadline = self.replayed_next(result)
+        except Exception:
+            self.active = False  # let the next live success restart the drain
+            raise
+        if deadline is not None:
+            self.car.scheduler.schedule(self, deadline)
+
+
+class StatusDocument:
+    """Scheduler key publishing a car's status as one JSON document.
+
+    With STATUS_FORMAT=json, publish_to_mqtt merges what it would have
+    published field by field into ``values`` here; tick() then publishes the
+    whole document, so a cycle's telemetry and send results go out as one
+    PUBLISH instead of one per changed field.
+    """
+
+    def __init__(self, car: Any, topic: str, qos: int, retain: bool,
+                 min_interval: float = DEFAULT_STATUS_MIN_INTERVAL):
+        self.car = car
+        self.topic = topic
+        self.qos = qos
+        self.retain = retain
+        self.min_interval = min_interval
+        self.values: Dict[str, Any] = {}
+        self.lock = threading.Lock()
+        self.dirty = False  # values changed since the last publish
+        self.pending = False  # a tick is scheduled
+        self.last_published: Optional[float] = None
+        self.published = 0
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], car: Any) -> Optional["StatusDocument"]:
+        """Build the document if STATUS_FORMAT is json and a status topic is set, else None."""
+        if config.get("STATUS_FORMAT") != "json" or not car.base_topic:
+            return None
+        return cls(
+            car, f"{car.base_topic}/{STATUS_DOCUMENT_TOPIC}", car.status_qos, car.status_retain,
+            validate_setting(config.get("STATUS_MIN_INTERVAL"), DEFAULT_STATUS_MIN_INTERVAL,
+                             "status min interval", 0),
+        )
+
+    def update(self, values: Mapping[str, Any], removed: Iterable[str] = ()):
+        """Merge values into the document, drop the `removed` keys, and
+        schedule a publish if anything changed."""
+        with self.lock:
+            changed = False
+            for key, value in values.items():
+                if isinstance(value, float) and not math.isfinite(value):
+                    value = None  # not representable in JSON
+                if key not in self.values or self.values[key] != value:
+                    self.values[key] = value
+                    changed = True
+            for key in removed:
+                if key in self.values:
+                    del self.values[key]
+                    changed = True
+            if not changed:
+                return
+            self.dirty = True
+            if self.pending:
+                return
+            self.pending = True
+            deadline = self.car.scheduler.clock()
+            if self.last_published is not None:
+                deadline = max(deadline, self.last_published + self.min_interval)
+        self.car.scheduler.schedule(self, deadline)
+
+    def tick(self, now: Optional[float] = None) -> Optional[float]:
+        if now is None:
+            now = self.car.scheduler.clock()
+        with self.lock:
+            self.pending = False
+            if not self.dirty:
+                return None
+            self.dirty = False
+            self.last_published = now
+            payload = dump_json(self.values)
+        try:
+            self.car.client.publish(self.topic, payload=payload, qos=self.qos, retain=self.retain)
+            self.published += 1
+        except Exception as e:
+            logging.error(f"Failed to publish to MQTT: {e}")
+        return None
+
+
+class StatusThrottle:
+    """Scheduler key rate-limiting the per-field status topics.
+
+    With STATUS_FORMAT=topics and a STATUS_MIN_INTERVAL, publish_to_mqtt
+    merges the fields it would publish into ``values`` here (the latest value
+    of each wins); tick() hands them to publish_fields() at most once per
+    interval.
+    """
+
+    def __init__(self, car: Any, min_interval: float):
+        self.car = car
+        self.min_interval = min_interval
+        self.values: Dict[str, Any] = {}
+        self.removed: Set[str] = set()
+        self.lock = threading.Lock()
+        self.pending = False  # a tick is scheduled
+        self.last_published: Optional[float] = None
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], car: Any) -> Optional["StatusThrottle"]:
+        """Build the throttle if per-field topics get a STATUS_MIN_INTERVAL, else None."""
+        if config.get("STATUS_FORMAT") == "json" or not car.base_topic or config.get("STATUS_MIN_INTERVAL") is None:
+            return None
+        interval = validate_setting(config.get("STATUS_MIN_INTERVAL"), 0, "status min interval", 0)
+        return cls(car, interval) if interval > 0 else None
+
+    def update(self, values: Mapping[str, Any], removed: Iterable[str] = ()):
+        """Queue changed values and the `removed` fields' clearing, and
+        schedule a publish if anything is new."""
+        published = self.car.last_published
+        with self.lock:
+            changed = False
+            for key in removed:
+                self.values.pop(key, None)
+                if key in published:
+                    self.removed.add(key)
+                    changed = True
+            for key, value in values.items():
+                self.removed.discard(key)
+                if key in published and published[key] == value and key not in self.values:
+                    continue
+                self.values[key] = value
+                changed = True
+            if not changed or self.pending:
+                return
+            self.pending = True
+            deadline = self.car.scheduler.clock()
+            if self.last_published is not None:
+                deadline = max(deadline, self.last_published + self.min_interval)
+        self.car.scheduler.schedule(self, deadline)
+
+    def tick(self, now: Optional[float] = None) -> Optional[float]:
+        if now is None:
+            now = self.car.scheduler.clock()
+        with self.lock:
+            self.pending = False
+            values, removed = self.values, self.removed
+            self.values, self.removed = {}, set()
+            self.last_published = now
+        self.car.publish_fields(values, removed)
+        return None
+
+
+class SenderWorker:
+    """Deliver snapshots to ABRP from a dedicated thread.
+
+    The mailbox holds a single snapshot: submitting while one is still waiting
+    replaces it (latest wins), since ABRP only cares about the freshest data,
+    so a slow POST delays at most one pending send instead of piling them up.
+    Background jobs (backlog replay) queue behind it and only run while no
+    snapshot is waiting. Before start() (and after stop()) it isn't running
+    and callers work inline.
+    """
+
+    def __init__(self, send: Callable[[Dict[str, Any]], None], name: str = "",
+                 metrics: Optional[Metrics] = None):
+        self.send = send
+        self.name = name
+        self.metrics = metrics
+        self._cond = threading.Condition()
+        self._pending: Optional[Dict[str, Any]] = None
+        self._jobs: Deque[Tuple[Callable[[], Any], Callable[[Any], None]]] = collections.deque()
+        self._stopping = False
+        self.thread: Optional[threading.Thread] = None
+        self.superseded = 0
+        # perf_counter() when the current delivery started, None while idle.
+        self.in_flight_since: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None
+
+    def submit_job(self, work: Callable[[], Any], done: Callable[[Any], None]):
+        """Run ``done(work())`` on the sender thread once no snapshot is
+        waiting. Jobs still queued at stop() are dropped."""
+        with self._cond:
+            self._jobs.append((work, done))
+            self._cond.notify()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self._stopping = False
+        self.thread = threading.Thread(target=self._run, name=f"abrp-sender-{self.name}", daemon=True)
+        self.thread.start()
+
+    def submit(self, snapshot: Dict[str, Any]):
+        """Queue `snapshot` for delivery, replacing any still waiting."""
+        with self._cond:
+            if self._pending is not None:
+                self.superseded += 1
+                if self.metrics is not None:
+                    self.metrics.inc("tm2abrp_snapshots_superseded_total", (self.name,))
+                logging.debug("Previous ABRP update still waiting to be sent, replacing it with newer data.")
+            self._pending = snapshot
+            self._cond.notify()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Deliver what's pending, then stop the thread (waiting up to `timeout`)."""
+        thread = self.thread
+        if thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        thread.join(timeout)
+        self.thread = None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._jobs and not self._stopping:
+                    self._cond.wait()
+                snapshot, self._pending = self._pending, None
+                job = None
+                if snapshot is None:
+                    if self._stopping:
+                        self._jobs.clear()
+                        return
+                    job = self._jobs.popleft()
+                else:
+                    started = self.in_flight_since = perf_counter()
+            if job is not None:
+                work, done = job
+                try:
+                    done(work())
+                except Exception as e:
+                    logging.critical(f"Unexpected exception in the ABRP sender: {type(e).__name__} - {redact_secrets(e)}")
+                continue
+            try:
+                self.send(snapshot)
+            except Exception as e:
+                logging.critical(f"Unexpected exception in the ABRP sender: {type(e).__name__} - {redact_secrets(e)}")
+            finally:
+                self.in_flight_since = None
+                if self.metrics is not None:
+                    self.metrics.observe("tm2abrp_send_in_flight_seconds", (self.name,), perf_counter() - started)
+
+
+def parse_sink_spec(spec: str) -> Tuple[str, str]:
+    """Split a ``kind:target`` sink spec (see SINK_KINDS) into its parts.
+
+    Raises ValueError on an unknown kind, a missing target or, for the HTTP
+    sinks, a target that isn't an http(s) URL.
+    """
+    kind, _, target = spec.strip().partition(":")
+    if kind not in SINK_KINDS or not target:
+        raise ValueError(f"Invalid sink {spec!r}, expected webhook:URL, influx:URL or jsonl:PATH.")
+    if kind != "jsonl" and not target.startswith(("http://", "https://")):
+        raise ValueError(f"Invalid sink {spec!r}, {kind} sinks need an http(s) URL.")
+    return kind, target
+
+
+def format_line_protocol(car: str, tlm: Mapping[str, Any], measurement: str = LINE_PROTOCOL_MEASUREMENT) -> str:
+    """One InfluxDB line-protocol point for a snapshot, tagged with the car
+    and timestamped (in nanoseconds) from its utc."""
+    fields = []
+    for key, value in tlm.items():
+        if key == "utc" or value is None:
+            continue
+        if isinstance(value, bool):
+            fields.append(f"{key}={'true' if value else 'false'}")
+        elif isinstance(value, int):
+            fields.append(f"{key}={value}i")
+        elif isinstance(value, float):
+            fields.append(f"{key}={value!r}")
+        else:
+            escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+            fields.append(f'{key}="{escaped}"')
+    tag = re.sub(r"([ ,=\\])", r"\\\1", car)
+    line = f"{measurement},car={tag} {','.join(fields)}"
+    utc = tlm.get("utc")
+    return f"{line} {int(utc) * 1_000_000_000}" if utc else line
+
+
+class TelemetrySink(abc.ABC):
+    """Somewhere sent telemetry goes.
+
+    The bridge hands every snapshot it sends to its sinks with submit(car,
+    tlm). submit() runs on the update loop, so it must return promptly and
+    must not modify ``tlm``; start() and stop() bracket the bridge's run.
+    """
+
+    name = "sink"
+
+    def start(self):
+        pass
+
+    @abc.abstractmethod
+    def submit(self, car: str, tlm: Mapping[str, Any]):
+        """Take one sent snapshot for `car`."""
+
+    def stop(self, timeout: Optional[float] = None):
+        pass
+
+
+class ABRPSink(TelemetrySink):
+    """The ABRP API, through the bridge's latest-wins sender (inline until
+    the sender is started)."""
+
+    name = "abrp"
+
+    def __init__(self, bridge: Any):
+        self.bridge = bridge
+
+    def start(self):
+        self.bridge.sender.start()
+
+    def submit(self, car: str, tlm: Mapping[str, Any]):
+        if self.bridge.sender.running:
+            self.bridge.sender.submit(tlm)
+        else:
+            self.bridge.send_snapshot(tlm)
+
+    def stop(self, timeout: Optional[float] = None):
+        self.bridge.sender.stop(timeout)
+
+
+class MQTTMirrorSink(TelemetrySink):
+    """The status topic mirror. paho's publish() only queues the message for
+    its network loop, so this one writes inline."""
+
+    name = "mqtt"
+
+    def __init__(self, bridge: Any):
+        self.bridge = bridge
+
+    def submit(self, car: str, tlm: Mapping[str, Any]):
+        self.bridge.publish_to_mqtt(tlm)
+
+
+class QueuedSink(TelemetrySink):
+    """Base for the external sinks: a worker thread drains a bounded queue
+    and hands records to write() in batches.
+
+    A batch goes out once ``batch_size`` records are waiting or
+    ``flush_interval`` seconds after the previous one. When the queue is full
+    the oldest record is dropped. A failed write() is logged, its batch put
+    back (as far as room allows) and the sink backs off, doubling up to
+    SINK_MAX_BACKOFF seconds; nothing it does reaches the ABRP path. The
+    worker calls close() itself on its way out, so a stop() that times out
+    never closes the sink under a write still in progress.
+    """
+
+    def __init__(self, name: str, batch_size: int = DEFAULT_SINK_BATCH_SIZE,
+                 flush_interval: float = DEFAULT_SINK_FLUSH_INTERVAL, queue_size: int = SINK_QUEUE_SIZE,
+                 metrics: Optional[Metrics] = None):
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.metrics = metrics
+        self.queue: Deque[Tuple[str, Mapping[str, Any]]] = collections.deque(maxlen=queue_size)
+        self._cond = threading.Condition()
+        self._stopping = False
+        self.thread: Optional[threading.Thread] = None
+        self.written = 0
+        self.dropped = 0
+        self.failures = 0
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self._stopping = False
+        self.thread = threading.Thread(target=self._run, name=f"sink-{self.name}", daemon=True)
+        self.thread.start()
+
+    def submit(self, car: str, tlm: Mapping[str, Any]):
+        with self._cond:
+            if len(self.queue) == self.queue.maxlen:
+                self._count("dropped", 1)
+            self.queue.append((car, tlm))
+            if len(self.queue) >= self.batch_size:
+                self._cond.notify()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Write what's queued (one attempt per batch), then stop the thread."""
+        thread = self.thread
+        if thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        thread.join(timeout)
+        if thread.is_alive():
+            logging.warning(f"Telemetry sink {self.name} is still writing; it will close once done.")
+        self.thread = None
+
+    @abc.abstractmethod
+    def write(self, batch: List[Tuple[str, Mapping[str, Any]]]):
+        """Deliver (car, tlm) records; raise on failure."""
+
+    def close(self):
+        pass
+
+    def _run(self):
+        try:
+            self._drain()
+        finally:
+            try:
+                self.close()
+            except Exception as e:
+                logging.error(f"Telemetry sink {self.name} failed to close: {type(e).__name__} - {e}")
+
+    def _drain(self):
+        backoff = 0.0
+        while True:
+            with self._cond:
+                if not self._stopping and len(self.queue) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                if not self.queue:
+                    if self._stopping:
+                        return
+                    continue
+                batch = [self.queue.popleft() for _ in range(min(self.batch_size, len(self.queue)))]
+            try:
+                self.write(batch)
+            except Exception as e:
+                self.failures += 1
+                self._requeue(batch)
+                backoff = min(SINK_MAX_BACKOFF, max(1.0, backoff * 2))
+                logging.warning(f"Telemetry sink {self.name} failed, retrying in {backoff:.0f}s: "
+                                f"{type(e).__name__} - {redact_secrets(e)}")
+                with self._cond:
+                    if self._stopping:
+                        return
+                    self._cond.wait_for(lambda: self._stopping, backoff)
+                continue
+            backoff = 0.0
+            self._count("written", len(batch))
+
+    def _requeue(self, batch: List[Tuple[str, Mapping[str, Any]]]):
+        """Put a failed batch back in front of newer records, dropping its
+        oldest records if those filled the queue meanwhile."""
+        with self._cond:
+            room = (self.queue.maxlen or 0) - len(self.queue)
+            kept = batch[len(batch) - room:] if room < len(batch) else batch
+            self.queue.extendleft(reversed(kept))
+            if len(kept) < len(batch):
+                self._count("dropped", len(batch) - len(kept))
+        self._count("failed", len(batch))
+
+    def _count(self, outcome: str, records: int):
+        if outcome == "written":
+            self.written += records
+        elif outcome == "dropped":
+            self.dropped += records
+        if self.metrics is not None:
+            self.metrics.inc("tm2abrp_sink_records_total", (self.name, outcome), records)
+
+
+class WebhookSink(QueuedSink):
+    """POST each batch as a JSON array of {"car": ..., "tlm": ...} objects."""
+
+    def __init__(self, name: str, url: str, **kwargs):
+        super().__init__(name, **kwargs)
+        self.url = url
+        self.session = requests.Session()
+
+    def write(self, batch: List[Tuple[str, Mapping[str, Any]]]):
+        body = dump_json([{"car": car, "tlm": tlm} for car, tlm in batch])
+        response = self.session.post(self.url, data=body, headers={"Content-Type": "application/json"},
+                                     timeout=(DEFAULT_HTTP_CONNECT_TIMEOUT, DEFAULT_HTTP_READ_TIMEOUT))
+        response.raise_for_status()
+
+    def close(self):
+        self.session.close()
+
+
+class LineProtocolSink(WebhookSink):
+    """POST each batch to an InfluxDB write endpoint (v1 /write or v2
+    /api/v2/write, database/bucket and credentials in the URL) as line
+    protocol, one point per snapshot."""
+
+    def write(self, batch: List[Tuple[str, Mapping[str, Any]]]):
+        body = "\n".join(format_line_protocol(car, tlm) for car, tlm in batch).encode("utf-8")
+        response = self.session.post(self.url, data=body, headers={"Content-Type": "text/plain; charset=utf-8"},
+                                     timeout=(DEFAULT_HTTP_CONNECT_TIMEOUT, DEFAULT_HTTP_READ_TIMEOUT))
+        response.raise_for_status()
+
+
+class JsonlFileSink(QueuedSink):
+    """Append each record to a file as a {"car": ..., "tlm": ...} JSON line."""
+
+    def __init__(self, name: str, path: str, **kwargs):
+        super().__init__(name, **kwargs)
+        self.path = path
+        self.file = open(path, "ab")
+
+    def write(self, batch: List[Tuple[str, Mapping[str, Any]]]):
+        self.file.write(b"".join(dump_json({"car": car, "tlm": tlm}) + b"\n" for car, tlm in batch))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+SINK_CLASSES: Dict[str, Callable[..., QueuedSink]] = {
+    "webhook": WebhookSink,
+    "influx": LineProtocolSink,
+    "jsonl": JsonlFileSink,
+}
+
+
+def build_sinks(config: Dict[str, Any], metrics: Optional[Metrics] = None) -> List[TelemetrySink]:
+    """The external sinks listed in SINKS (none by default). Names are the
+    sink kind, numbered when a kind is used more than once."""
+    specs = [parse_sink_spec(spec) for spec in config.get("SINKS") or ()]
+    batch_size = int(validate_setting(config.get("SINK_BATCH_SIZE"), DEFAULT_SINK_BATCH_SIZE, "sink batch size", 1))
+    flush_interval = validate_setting(
+        config.get("SINK_FLUSH_INTERVAL"), DEFAULT_SINK_FLUSH_INTERVAL, "sink flush interval", 0.1
+    )
+    kinds = collections.Counter(kind for kind, _ in specs)
+    seen: collections.Counter = collections.Counter()
+    sinks: List[TelemetrySink] = []
+    for kind, target in specs:
+        seen[kind] += 1
+        name = kind if kinds[kind] == 1 else f"{kind}-{seen[kind]}"
+        sinks.append(SINK_CLASSES[kind](name, target, batch_size=batch_size,
+                                        flush_interval=flush_interval, metrics=metrics))
+    return sinks
+
+
+class ChangeDetector:
+    """Decide whether a due send carries any meaningful change.
+
+    Compares a candidate snapshot against the last one ABRP accepted using
+    per-field deadbands, and always lets a send through once the keepalive
+    ceiling has passed so ABRP keeps seeing the car.
+    """
+
+    # Never compared: utc changes on every send, lat/lon are compared together
+    # as "position".
+    IGNORED_FIELDS = frozenset(("utc", "lat", "lon"))
+
+    def __init__(self, deadbands: Dict[str, float], keepalive: float = DEFAULT_SEND_KEEPALIVE):
+        self.deadbands = deadbands
+        self.keepalive = keepalive
+        self.last_sent: Optional[Dict[str, Any]] = None
+        self.last_sent_at: Optional[float] = None
+        # Telemetry version last found to hold no meaningful change, so an
+        # unchanged store isn't compared field by field again.
+        self.unchanged_version: Optional[int] = None
+        self.suppressed = 0
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> Optional["ChangeDetector"]:
+        """Build the detector if SUPPRESS_UNCHANGED is on, else None."""
+        if not config.get("SUPPRESS_UNCHANGED"):
+            return None
+        return cls(
+            parse_deadbands(config.get("DEADBANDS")),
+            validate_setting(config.get("SEND_KEEPALIVE"), DEFAULT_SEND_KEEPALIVE, "send keepalive", MIN_REFRESH_RATE),
+        )
+
+    def is_meaningful(self, snapshot: Mapping[str, Any], now: float, version: Optional[int] = None) -> bool:
+        """True if the snapshot should be sent (changed, or keepalive due).
+
+        ``version`` is the snapshot's telemetry version, if it has one.
+        """
+        last = self.last_sent
+        if last is None or self.last_sent_at is None or now - self.last_sent_at >= self.keepalive:
+            return True
+        if version is not None and version == self.unchanged_version:
+            return False
+        if self._differs(snapshot, last):
+            return True
+        self.unchanged_version = version
+        return False
+
+    def _differs(self, snapshot: Mapping[str, Any], last: Dict[str, Any]) -> bool:
+        if snapshot.keys() != last.keys():
+            return True  # a field appeared or vanished (e.g. charging started)
+        deadbands = self.deadbands
+        for key, value in snapshot.items():
+            if key in self.IGNORED_FIELDS:
+                continue
+            old = last[key]
+            if value == old:
+                continue
+            band = deadbands.get(key)
+            if (band and isinstance(value, (int, float)) and isinstance(old, (int, float))
+                    and not isinstance(value, bool) and abs(value - old) < band):
+                continue
+            return True
+        if "lat" in snapshot and "lon" in snapshot:
+            moved = distance_m(last["lat"], last["lon"], snapshot["lat"], snapshot["lon"])
+            if moved >= deadbands.get("position", 0) and moved > 0:
+                return True
+        return False
+
+    def mark_sent(self, snapshot: Dict[str, Any], now: float):
+        """Remember what ABRP accepted, as the baseline for later comparisons."""
+        self.last_sent = snapshot
+        self.last_sent_at = now
+        self.unchanged_version = None
+
+
+class MotionPolicy:
+    """Adapt the driving send interval to how the car is moving.
+
+    check() runs on every motion message and reports the first threshold
+    crossed since the last sent point, once per point; mark_sent() moves the
+    baseline and stretches the interval after routine sends or resets it after
+    an early or forced one.
+    """
+
+    def __init__(self, thresholds: Dict[str, float], base_interval: float,
+                 max_interval: float = DEFAULT_ADAPTIVE_MAX_INTERVAL):
+        self.thresholds = thresholds
+        self.base_interval = base_interval
+        self.max_interval = max(max_interval, base_interval)
+        self.interval = base_interval
+        self.last_point: Optional[Dict[str, Any]] = None
+        self.triggered: Optional[str] = None
+        self.early_sends = 0
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], base_interval: float) -> Optional["MotionPolicy"]:
+        """Build the policy if ADAPTIVE_DRIVING is on, else None."""
+        if not config.get("ADAPTIVE_DRIVING"):
+            return None
+        return cls(
+            parse_thresholds(config.get("MOTION_THRESHOLDS"), DEFAULT_MOTION_THRESHOLDS, "motion threshold", known=True),
+            base_interval,
+            validate_setting(config.get("ADAPTIVE_MAX_INTERVAL"), DEFAULT_ADAPTIVE_MAX_INTERVAL,
+                             "adaptive max interval", MIN_REFRESH_RATE),
+        )
+
+    def check(self, data: Dict[str, Any]) -> Optional[str]:
+        """Return the reason `data` warrants an early send, or None. Reports
+        each sent point at most once, until mark_sent() moves the baseline."""
+        last = self.last_point
+        if last is None or self.triggered is not None:
+            return None
+        limits = self.thresholds
+        turn = abs((data["heading"] - last["heading"] + 180) % 360 - 180)
+        if turn >= limits["heading"] > 0:
+            reason = "heading"
+        elif abs(data["speed"] - last["speed"]) >= limits["speed"] > 0:
+            reason = "speed"
+        elif abs(data["power"] - last["power"]) >= limits["power"] > 0:
+            reason = "power"
+        elif (limits["distance"] > 0 and "lat" in data and "lat" in last
+              and distance_m(last["lat"], last["lon"], data["lat"], data["lon"]) >= limits["distance"]):
+            reason = "distance"
+        else:
+            return None
+        self.triggered = reason
+        return reason
+
+    def mark_sent(self, data: Mapping[str, Any], stretch: bool):
+        """Make `data` the new baseline; grow the interval if `stretch` (a
+        routine send), otherwise fall back to the base driving rate."""
+        if self.triggered is not None:
+            self.early_sends += 1
+        if stretch and self.triggered is None:
+            self.interval = min(self.interval * ADAPTIVE_STRETCH, self.max_interval)
+        else:
+            self.interval = self.base_interval
+        self.triggered = None
+        self.last_point = {key: data[key] for key in ("heading", "speed", "power", "lat", "lon") if key in data}
+
+    def reset(self):
+        """Forget the baseline (e.g. once the car stops driving)."""
+        self.interval = self.base_interval
+        self.last_point = None
+        self.triggered = None
+
+
+class FreshnessTracker:
+    """How old the data was when ABRP accepted it.
+
+    record() takes an accepted Payload and splits its age into stages:
+
+    - ``oldest_field`` / ``newest_field``: age of its stalest and freshest
+      field at acceptance
+    - ``refresh_wait``: newest field's arrival to the snapshot (refresh rate)
+    - ``send_queue``: snapshot to the POST starting (a busy sender)
+    - ``round_trip``: the POST itself
+
+    Data that arrives late from the broker shows up as none of these, since
+    TeslaMate messages carry no timestamp; a gap between the car and
+    ``newest_field`` is upstream of the bridge. Every stage is measured on the
+    scheduler's clock (virtual under --replay, where a POST takes no time).
+    The last `window` samples of each stage are kept for summary().
+    """
+
+    STAGES = ("oldest_field", "newest_field", "refresh_wait", "send_queue", "round_trip")
+
+    def __init__(self, window: int = FRESHNESS_WINDOW):
+        self.samples: Dict[str, Deque[float]] = {stage: collections.deque(maxlen=window) for stage in self.STAGES}
+        self.lock = threading.Lock()
+        self.last_published: Optional[float] = None
+
+    def record(self, payload: Mapping[str, Any], accepted: float, posted: Optional[float]) -> Dict[str, float]:
+        """Add the stages (seconds) of a payload POSTed at `posted` (if known)
+        and accepted at `accepted`, and return them; payloads without arrival
+        times (e.g. from the outbox) only give round_trip."""
+        stages: Dict[str, float] = {}
+        if posted is not None:
+            stages["round_trip"] = max(0.0, accepted - posted)
+        arrived = getattr(payload, "arrived", None)
+        if arrived is not None:
+            oldest, newest = arrived
+            stages["oldest_field"] = accepted - oldest
+            stages["newest_field"] = accepted - newest
+            taken = getattr(payload, "taken", None)
+            if taken is not None:
+                stages["refresh_wait"] = max(0.0, taken - newest)
+                if posted is not None:
+                    stages["send_queue"] = max(0.0, posted - taken)
+        with self.lock:
+            for stage, seconds in stages.items():
+                self.samples[stage].append(seconds)
+        return stages
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """p50/p90/p99 (seconds, nearest rank) of each stage with samples."""
+        with self.lock:
+            samples = {stage: sorted(values) for stage, values in self.samples.items() if values}
+        return {
+            stage: {f"p{q}": round(values[min(len(values) - 1, math.ceil(q / 100 * len(values)) - 1)], 3)
+                    for q in (50, 90, 99)}
+            for stage, values in samples.items()
+        }
+
+    def publish_due(self, now: float) -> bool:
+        """True at most once per FRESHNESS_PUBLISH_INTERVAL."""
+        with self.lock:
+            if self.last_published is not None and now - self.last_published < FRESHNESS_PUBLISH_INTERVAL:
+                return False
+            self.last_published = now
+            return True
+
+
 ## [ la CLASSe américaine ]
 class TeslaMateABRP:
-    def __init__(self, config):
+    def __init__(self, config, client: Any = None,
+                 session: Optional[ABRPSession] = None, scheduler: Optional[Scheduler] = None,
+                 outbox: Optional[TelemetryOutbox] = None, metrics: Optional[Metrics] = None,
+                 state_cache: Optional[StateCache] = None, sinks: Optional[List[TelemetrySink]] = None):
         self.config = config
         self.configure_logging()
         self.base_topic = self.config.get("BASETOPIC")
@@ -133,16 +2137,51 @@ class TeslaMateABRP:
         # ABRP application key: config override (env/Docker secret) or the
         # shared default. Not a per-user secret (see APIKEY above).
         self.api_key = self.config.get("APIKEY") or APIKEY
+        # Request targets and headers are fixed for the bridge's lifetime, so
+        # build them once instead of on every send: one target per ABRP
+        # account following this car (see MAX_DELIVERY_WORKERS).
+        base_url = self.config.get('ABRP_URL') or ABRP_API_URL
+        car_number = str(self.config.get("CARNUMBER"))
+        tokens = parse_user_tokens(self.config.get("USERTOKEN")) or [("1", "")]
+        shared = len(tokens) > 1
+        self.recipients = [
+            ABRPRecipient(label, f"{base_url}?token={token}",
+                          f"{self.prefix}_{label}" if shared else self.prefix,
+                          f"{car_number}/{token_key(token)}",
+                          f" ({label})" if shared else "")
+            for label, token in tokens
+        ]
+        self.abrp_url = self.recipients[0].url
+        # POSTs to several accounts run concurrently; one goes out inline.
+        self.delivery_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        if shared:
+            self.delivery_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(len(tokens), MAX_DELIVERY_WORKERS), thread_name_prefix=f"abrp-post-{car_number}"
+            )
+        self.abrp_headers = {"Authorization": f"APIKEY {self.api_key}", "Content-Type": "application/json"}
+        # Pooled keep-alive HTTP session (shared across cars in multi-car mode).
+        self.session = session or ABRPSession.from_config(self.config)
+        # Optional hot-path metrics (shared across cars in multi-car mode).
+        self.metrics = metrics or Metrics.from_config(self.config, self.session)
+        self.car_label = str(self.config.get("CARNUMBER"))
         # Only set state_topic if base_topic is provided
         self.state_topic = f"{self.base_topic}/{self.prefix}_status" if self.base_topic else None
-        
-        self.setup_mqtt_client()
+
+        # In multi-car mode the fleet owns a single shared, already-connected
+        # client and routes messages to us (and replay passes an OfflineClient);
+        # otherwise we set up our own, recording its stream if CAPTURE_PATH is set.
+        self.recorder: Optional[MessageRecorder] = None
+        if client is None:
+            self.setup_mqtt_client()
+        else:
+            self.client = client
         self.state = ""
         self.prev_state = ""
         self.charger_phases = 1
         self.has_usable_battery_level = False  # Flag to track if we've received usable_battery_level
-        # Guards self.data: it is mutated by the paho callback thread (on_message)
-        # and read/serialized by the main update loop.
+        # Serializes writers of self.data: the paho callback thread (on_message)
+        # and the update loop's parked housekeeping and utc stamp. Readers
+        # don't take it, they use self.data.snapshot().
         self.data_lock = threading.Lock()
         # Last value published per MQTT key, so unchanged values aren't
         # republished every cycle (retain=True already holds them on the broker).
@@ -150,10 +2189,51 @@ class TeslaMateABRP:
         # Set from the paho callback thread (on_connect) to request a shutdown
         # that must happen on the main thread.
         self.fatal_error: Optional[str] = None
+        # Retained-burst bootstrap state (see BOOTSTRAP_TOPIC): while
+        # bootstrapping, retained messages are held in bootstrap_buffer (latest
+        # payload per topic) and tick() doesn't send.
+        self.bootstrapping = False
+        self.bootstrap_buffer: Dict[str, Tuple[str, Optional[float]]] = {}
+        self.bootstrap_deadline = 0.0
+        self.bootstrap_timer: Optional[threading.Timer] = None
+        self.sentinel_topic: Optional[str] = None
         # Set once both model and trim_badging have been received, so
         # find_car_model() can return as soon as the data arrives instead of
         # blocking for a fixed delay.
         self.model_data_ready = threading.Event()
+        # find_car_model() gave up; retried when a retained burst is applied.
+        self.model_detection_failed = False
+        # Monotonic time of the last ABRP send; None -> send on the next tick.
+        self.last_send: Optional[float] = None
+        # Set from the MQTT thread when a shift_state change should be sent
+        # right away rather than at the next scheduled deadline.
+        self.send_requested = False
+        # Deadline scheduler driving tick() (shared across cars in multi-car mode).
+        self.scheduler = scheduler or Scheduler()
+        # Deadline of the next scheduled live send (None while idle).
+        self.next_send: Optional[float] = None
+        # Delivers snapshots off the update loop once run() starts it.
+        self.sender = SenderWorker(self.send_snapshot, self.car_label, self.metrics)
+        self.encoder = PayloadEncoder()
+        # Where sent snapshots go: ABRP and the status topic mirror, plus the
+        # optional external sinks (shared across cars in multi-car mode).
+        self.abrp_sink = ABRPSink(self)
+        self.mqtt_sink = MQTTMirrorSink(self)
+        self.sinks = build_sinks(self.config, self.metrics) if sinks is None else sinks
+        # Optional change detection: skip due sends that carry no news.
+        self.change_detector = ChangeDetector.from_config(self.config)
+        # How old the data in accepted POSTs was (metrics and status topic).
+        self.freshness = FreshnessTracker()
+        # Optional per-field TTLs: stale fields are left out of sends.
+        self.field_ttls = parse_field_ttls(self.config.get("FIELD_TTLS"))
+        # Status topic delivery; in json format one document replaces the
+        # per-field topics.
+        self.status_qos = self.config.get("STATUS_QOS")
+        if self.status_qos not in (0, 1, 2):
+            self.status_qos = DEFAULT_STATUS_QOS
+        self.status_retain = bool(self.config.get("STATUS_RETAIN", True))
+        self.status_document = StatusDocument.from_config(self.config, self)
+        self.status_throttle = StatusThrottle.from_config(self.config, self)
 
         # Refresh rates (in seconds), validated with fallback to defaults
         self.refresh_rate_driving = validate_refresh_rate(
@@ -165,9 +2245,11 @@ class TeslaMateABRP:
         self.refresh_rate_parked = validate_refresh_rate(
             self.config.get("REFRESH_RATE_PARKED"), DEFAULT_REFRESH_RATE_PARKED, "parked"
         )
+        # Optional motion-adaptive driving rate (replaces the fixed driving rate).
+        self.motion_policy = MotionPolicy.from_config(self.config, self.refresh_rate_driving)
         
         # Default data structure for ABRP
-        self.data = {
+        self.data = TelemetryData({
             "utc": 0,
             "soc": 0,
             "power": 0,
@@ -189,7 +2271,91 @@ class TeslaMateABRP:
             "current": 0,
             "kwh_charged": 0,
             "heading": 0
-        }
+        })
+
+        # Optional store-and-forward queue for telemetry ABRP didn't receive
+        # (shared across cars in multi-car mode, keyed by car number).
+        self.outbox = outbox or TelemetryOutbox.from_config(self.config)
+        self.queue_target = str(self.config.get("CARNUMBER"))
+        if self.outbox is not None:
+            # Rows from before they were keyed by token were queued under the
+            # bare car number, for the (then only) first account.
+            moved = self.outbox.retarget(self.queue_target, self.recipients[0].queue_target)
+            if moved:
+                logging.info(f"Moved {moved} queued updates of car {self.car_label} to its first ABRP account.")
+            drain_rate = validate_setting(
+                self.config.get("QUEUE_DRAIN_RATE"), DEFAULT_QUEUE_DRAIN_RATE, "queue drain rate", 0.01
+            )
+            for recipient in self.recipients:
+                recipient.drainer = BacklogDrainer(self, drain_rate, recipient)
+        # The (first) account's drainer.
+        self.drainer = self.recipients[0].drainer
+
+        # Optional warm-restart cache (shared across cars in multi-car mode):
+        # start from the last known state instead of zeros.
+        self.state_cache = state_cache or StateCache.from_config(self.config)
+        self.state_saved_at: Optional[float] = None
+        self.model_from_cache = False
+        self.model_thread: Optional[threading.Thread] = None
+        if self.state_cache is not None:
+            self.restore_state()
+
+    def restore_state(self):
+        """Load this car's entry from the state cache, if there's a usable one."""
+        entry = self.state_cache.load(self.queue_target) if self.state_cache is not None else None
+        if entry is None:
+            return
+        # Arrival times go back onto the scheduler clock, so FIELD_TTLS and
+        # freshness tracing see the fields' real age. Entries saved without
+        # them count every field as arriving at saved_at.
+        offset = datetime.datetime.now(datetime.UTC).timestamp() - self.scheduler.clock()
+        arrived = entry.get("arrived")
+        with self.data_lock, self.data.batch():
+            for key, value in entry["data"].items():
+                if key in TelemetryData.INDEX and key != "car_model":
+                    stamp = entry["saved_at"] if not isinstance(arrived, dict) else arrived.get(key)
+                    with self.data.batch(None if stamp is None else stamp - offset):
+                        self.data[key] = value
+            if not self.config.get("CARMODEL") and entry.get("car_model"):
+                self.data["car_model"] = entry["car_model"]
+                self.model_from_cache = True
+        self.has_usable_battery_level = bool(entry.get("has_usable_battery_level"))
+        self.last_published.update(entry.get("last_published") or {})
+        age = calendar.timegm(datetime.datetime.now(datetime.UTC).timetuple()) - entry["saved_at"]
+        logging.info(f"Restored the state of car {self.car_label} saved {age}s ago.")
+
+    def save_state(self, now: Optional[float] = None):
+        """Write this car's state to the cache, at most every STATE_CACHE_INTERVAL
+        seconds of the scheduler clock (always when `now` is None)."""
+        if self.state_cache is None:
+            return
+        if now is not None:
+            if self.state_saved_at is not None and now - self.state_saved_at < STATE_CACHE_INTERVAL:
+                return
+            self.state_saved_at = now
+        record = self.data.snapshot().data
+        payload = record.to_payload()
+        # The scheduler clock doesn't survive a restart; keep arrivals as UTC.
+        offset = datetime.datetime.now(datetime.UTC).timestamp() - self.scheduler.clock()
+        self.state_cache.save(self.queue_target, {
+            "data": payload,
+            "arrived": {name: round(stamp + offset, 3) for name in payload
+                        if (stamp := record.arrived(name)) is not None},
+            "car_model": self.data.get("car_model") or None,
+            "has_usable_battery_level": self.has_usable_battery_level,
+            "last_published": dict(self.last_published),
+        })
+
+    def detect_car_model(self, timeout: float = MODEL_DETECTION_TIMEOUT):
+        """find_car_model(), in the background if a cached model is already in use."""
+        if not self.model_from_cache:
+            self.find_car_model(timeout)
+            return
+        logging.info(f"Using cached car model {self.data['car_model']}, revalidating it in the background.")
+        self.model_thread = threading.Thread(
+            target=self.find_car_model, args=(timeout,), name=f"model-detection-{self.car_label}", daemon=True
+        )
+        self.model_thread.start()
 
     def configure_logging(self):
         log_level = logging.DEBUG if self.config.get("DEBUG") else logging.INFO
@@ -206,77 +2372,19 @@ class TeslaMateABRP:
             logging.debug("Logging level set to DEBUG.")
 
     def setup_mqtt_client(self):
-        self.client = mqtt.Client(
-            mqtt.CallbackAPIVersion.VERSION2, 
-            f"teslamateToABRP-{self.config.get('CARNUMBER')}"
+        self.client = create_mqtt_client(
+            self.config,
+            f"teslamateToABRP-{self.config.get('CARNUMBER')}",
+            self.state_topic,
         )
 
-        # Set up authentication based on available credentials
-        mqtt_username = self.config.get("MQTTUSERNAME")
-        mqtt_password = self.config.get("MQTTPASSWORD")
-        
-        if mqtt_username and mqtt_password:
-            logging.debug(f"Using MQTT authentication with username: {mqtt_username} and password")
-            self.client.username_pw_set(mqtt_username, mqtt_password)
-        elif mqtt_username:
-            logging.debug(f"Using MQTT username only: {mqtt_username} (no password)")
-            self.client.username_pw_set(mqtt_username)
-        else:
-            logging.debug("No MQTT authentication configured")
-
-        # Set up TLS if needed with better error handling
-        if self.config.get("MQTTTLS"):
-            try:
-                import ssl
-                logging.debug("Using TLS with MQTT")
-                verify_cert = self.config.get("MQTT_VERIFY_CERT", True)
-                cert_reqs = ssl.CERT_REQUIRED if verify_cert else ssl.CERT_NONE
-                self.client.tls_set(cert_reqs=cert_reqs)
-                logging.debug(f"TLS configured with certificate verification: {verify_cert}")
-            except ImportError:
-                logging.error("SSL module not available. TLS cannot be enabled.")
-            except Exception as e:
-                logging.error(f"Failed to configure TLS: {e}")
-
-        # Set up last will if base topic is set
-        if self.base_topic:
-            logging.debug(f"Using MQTT base topic: {self.base_topic} for last will")
-            self.client.will_set(self.state_topic, payload="offline", qos=2, retain=True)
-
         # Set up callbacks
+        self.recorder = MessageRecorder.from_config(self.config)
         self.client.on_connect = self.on_connect
-        self.client.on_message = self.on_message
+        self.client.on_message = self.on_message if self.recorder is None else self.recorder.wrap(self.on_message)
         self.client.on_disconnect = self.on_disconnect
 
-        # Connect to MQTT server with better error handling
-        mqtt_port = self.config.get("MQTTPORT", DEFAULT_MQTT_PORT)
-        mqtt_server = self.config.get("MQTTSERVER")
-        
-        # Convert port to integer
-        try:
-            mqtt_port = int(mqtt_port)
-        except (ValueError, TypeError):
-            logging.warning(f"Invalid MQTT port provided: {mqtt_port}. Using default: {DEFAULT_MQTT_PORT}")
-            mqtt_port = DEFAULT_MQTT_PORT
-        
-        logging.debug(f"Attempting to connect to MQTT server: {mqtt_server}:{mqtt_port}")
-        
-        try:
-            self.client.connect(mqtt_server, mqtt_port)
-            self.client.loop_start()
-            logging.debug("MQTT client connection started successfully")
-        except ConnectionRefusedError:
-            error_msg = f"Connection refused to MQTT server {mqtt_server}:{mqtt_port}. Check if the server is running and accessible."
-            logging.critical(error_msg)
-            sys.exit(error_msg)
-        except TimeoutError:
-            error_msg = f"Connection timeout to MQTT server {mqtt_server}:{mqtt_port}. Check network connectivity and firewall settings."
-            logging.critical(error_msg)
-            sys.exit(error_msg)
-        except Exception as e:
-            error_msg = f"Failed to connect to MQTT server: {e}"
-            logging.critical(error_msg)
-            sys.exit(error_msg)
+        connect_mqtt_client(self.client, self.config)
 
     def on_connect(self, client, userdata, flags, reason_code, properties):
         result_str = mqtt.connack_string(reason_code)
@@ -287,30 +2395,20 @@ class TeslaMateABRP:
         # sys.exit() here would only raise SystemExit in that thread and leave
         # the main update loop spinning forever. Record the fatal reason instead
         # and let the main thread (update_timely) perform the shutdown.
-        if reason_code == 5 or reason_code == 4:  # Auth failure codes
-            error_msg = "MQTT Authentication failed. Check your username and password."
-            logging.critical(error_msg)
-            self.fatal_error = error_msg
-            return
-        elif reason_code == 3:  # Server unavailable
-            error_msg = "MQTT Broker unavailable. Check if the server is running."
+        error_msg = mqtt_connect_error(reason_code)
+        if error_msg:
             logging.critical(error_msg)
             self.fatal_error = error_msg
+            self.scheduler.wake()
             return
-        elif reason_code == 2:  # Client identifier rejected
-            error_msg = "MQTT Client ID rejected. Try using a different client ID."
-            logging.critical(error_msg)
-            self.fatal_error = error_msg
-            return
-        elif reason_code != 0:
-            error_msg = f"Could not connect to MQTT server. Reason: {result_str} (code {reason_code})"
-            logging.critical(error_msg)
-            self.fatal_error = error_msg
-            return
-        
+
         logging.debug("MQTT connection successful, subscribing to topics...")
-        client.subscribe(f"teslamate/cars/{self.config.get('CARNUMBER')}/#")
-        logging.debug(f"Subscribed to teslamate/cars/{self.config.get('CARNUMBER')}/#")
+        self.begin_bootstrap()
+        self.sentinel_topic = f"{BOOTSTRAP_TOPIC}/{secrets.token_hex(8)}"
+        topics = self.subscriptions()
+        client.subscribe(topics + [(self.sentinel_topic, 0)])
+        client.publish(self.sentinel_topic, payload="", qos=0, retain=False)
+        logging.debug(f"Subscribed to {len(topics)} topics under teslamate/cars/{self.config.get('CARNUMBER')}/")
 
         # Only publish online status if base_topic is set
         if self.base_topic:
@@ -331,13 +2429,22 @@ class TeslaMateABRP:
 
     def on_message(self, client, userdata, message):
         try:
+            if message.topic == self.sentinel_topic:
+                self.end_bootstrap("end of retained messages")
+                return
+            arrived = self.scheduler.clock()
             payload = str(message.payload.decode("utf-8"))
             topic_name = message.topic.split('/')[-1]
+            if self.bootstrapping and self.buffer_retained(topic_name, payload, message.retain, arrived):
+                return
 
-            # Hold the data lock for the whole message: process_message and
-            # handle_state_change mutate self.data, which the main loop reads.
-            with self.data_lock:
-                self.process_message(topic_name, payload)
+            # One batch per message: process_message and handle_state_change
+            # may change several fields, and snapshots must see all or none.
+            if self.metrics is None:
+                with self.data_lock, self.data.batch(arrived):
+                    self.process_message(topic_name, payload)
+            else:
+                self._process_message_timed(self.metrics, topic_name, payload, arrived)
 
         except Exception as e:
             logging.critical(
@@ -345,141 +2452,98 @@ class TeslaMateABRP:
                 f"topic: {message.topic}, payload: {message.payload}"
             )
 
-    def process_message(self, topic: str, payload: str):
-        """Process individual MQTT message based on topic name."""
+    def begin_bootstrap(self):
+        """Start collecting the retained burst a new subscription delivers."""
+        with self.data_lock:
+            self.bootstrapping = True
+            self.bootstrap_buffer.clear()
+            self.bootstrap_deadline = self.scheduler.clock() + BOOTSTRAP_TIMEOUT
+            if self.bootstrap_timer is not None:
+                self.bootstrap_timer.cancel()
+            self.bootstrap_timer = threading.Timer(BOOTSTRAP_TIMEOUT, self.bootstrap_timed_out)
+            self.bootstrap_timer.daemon = True
+            self.bootstrap_timer.start()
+        self.scheduler.schedule(self, self.bootstrap_deadline)
 
-        # Skip empty payloads for most topics
-        if not payload and topic not in ["shift_state", "state"]:
-            return
+    def bootstrap_timed_out(self):
+        """End a burst the broker never closed (bootstrap_timer callback).
+        A no-op if it ended already or the scheduler's clock says it's not
+        due; tick() then ends it."""
+        if self.bootstrapping and self.scheduler.clock() >= self.bootstrap_deadline:
+            self.end_bootstrap("timed out waiting for the end of retained messages")
 
-        if topic == "model":
-            self.data["model"] = payload
-            self._maybe_signal_model_ready()
-        elif topic == "trim_badging":
-            self.data["trim_badging"] = payload
-            self._maybe_signal_model_ready()
-        elif topic == "latitude" and not self.config.get("SKIPLOCATION"):
-            try:
-                self.data["lat"] = float(payload)
-            except ValueError:
-                pass
-        elif topic == "longitude" and not self.config.get("SKIPLOCATION"):
-            try:
-                self.data["lon"] = float(payload)
-            except ValueError:
-                pass
-        elif topic == "elevation":
-            try:
-                self.data["elevation"] = int(payload)
-            except ValueError:
-                pass
-        elif topic == "speed":
-            try:
-                self.data["speed"] = int(payload)
-            except ValueError:
-                pass
-        elif topic == "power":
-            try:
-                value = float(payload)
-                # Reject non-finite values (nan/inf): json(allow_nan=False) would
-                # otherwise reject the whole payload and break every later POST.
-                if not math.isfinite(value):
-                    raise ValueError("non-finite power")
-                self.data["power"] = value
-                if self.data["is_charging"] and value < -11:
-                    self.data["is_dcfc"] = True
-            except ValueError:
-                pass
-        elif topic == "charger_power":
-            try:
-                if payload and int(payload) != 0:
-                    self.data["is_charging"] = True
-                    if int(payload) > 11:
-                        self.data["is_dcfc"] = True
-                elif payload and int(payload) == 0:
-                    # Charger power dropped to 0: clear the charge flags so a
-                    # missed 'state' transition can't latch stale charging flags.
-                    self.data["is_charging"] = False
-                    self.data["is_dcfc"] = False
-            except ValueError:
-                pass
-        elif topic == "heading":
-            try:
-                self.data["heading"] = int(payload)
-            except ValueError:
-                pass
-        elif topic == "outside_temp":
-            try:
-                self.data["ext_temp"] = float(payload)
-            except ValueError:
-                pass
-        elif topic == "odometer":
-            try:
-                self.data["odometer"] = float(payload)
-            except ValueError:
-                pass
-        elif topic == "ideal_battery_range_km":
-            try:
-                self.data["ideal_battery_range"] = float(payload)
-            except ValueError:
-                pass
-        elif topic == "est_battery_range_km":
-            try:
-                self.data["est_battery_range"] = float(payload)
-            except ValueError:
-                pass
-        elif topic == "charger_actual_current":
-            try:
-                if payload and int(payload) > 0:
-                    self.data["current"] = int(payload)
-                else:
-                    self.data["current"] = 0
-                    self.data.pop("current", None)
-            except ValueError:
-                pass
-        elif topic == "charger_voltage":
-            try:
-                if payload and int(payload) > 5:
-                    self.data["voltage"] = int(payload)
-                else:
-                    self.data["voltage"] = 0
-                    self.data.pop("voltage", None)
-            except ValueError:
-                pass
-        elif topic == "shift_state":
-            if payload == "P":
-                self.data["is_parked"] = True
-            elif payload in ["D", "R", "N"]:
-                self.data["is_parked"] = False
-        elif topic == "state":
-            self.state = payload
-            self.handle_state_change(payload)
-        elif topic == "usable_battery_level":
-            try:
-                self.data["soc"] = int(payload)
-                self.has_usable_battery_level = True
-            except ValueError:
-                pass
-        elif topic == "battery_level":
-            try:
-                # Only use battery_level if we haven't received usable_battery_level
-                if not self.has_usable_battery_level:
-                    self.data["soc"] = int(payload)
-            except ValueError:
-                pass
-        elif topic == "charge_energy_added":
-            try:
-                self.data["kwh_charged"] = float(payload)
-            except ValueError:
-                pass
-        elif topic == "charger_phases":
-            try:
-                self.charger_phases = 3 if payload and int(payload) > 1 else 1
-            except ValueError:
-                pass
-        else:
+    def buffer_retained(self, topic: str, payload: str, retained: bool, arrived: Optional[float] = None) -> bool:
+        """Hold a retained message (and when it arrived) until the burst ends.
+        A live message ends the burst instead (returns False: process it as
+        usual)."""
+        with self.data_lock:
+            if not self.bootstrapping:
+                return False
+            if retained:
+                self.bootstrap_buffer[topic] = (payload, arrived)
+                return True
+        self.end_bootstrap("live message")
+        return False
+
+    def end_bootstrap(self, reason: str):
+        """Apply the retained burst as one batch and send right away."""
+        with self.data_lock:
+            if not self.bootstrapping:
+                return
+            self.bootstrapping = False
+            with self.data.batch():
+                for topic, (payload, arrived) in self.bootstrap_buffer.items():
+                    with self.data.batch(arrived):
+                        self.process_message(topic, payload)
+            count = len(self.bootstrap_buffer)
+            self.bootstrap_buffer.clear()
+            self.send_requested = True
+            if self.bootstrap_timer is not None:
+                self.bootstrap_timer.cancel()
+                self.bootstrap_timer = None
+        logging.debug(f"Applied {count} retained messages ({reason}).")
+        self.scheduler.wake(self)
+        if self.model_detection_failed and self.model_data_ready.is_set():
+            self.find_car_model(timeout=0)
+
+    def _process_message_timed(self, metrics: Metrics, topic: str, payload: str, arrived: Optional[float] = None):
+        """process_message in a data batch, recording the lock wait and
+        handling time."""
+        started = perf_counter()
+        with self.data_lock, self.data.batch(arrived):
+            acquired = perf_counter()
+            self.process_message(topic, payload)
+        done = perf_counter()
+        metrics.inc("tm2abrp_mqtt_messages_total", (self.car_label, topic))
+        metrics.observe("tm2abrp_data_lock_wait_seconds", (self.car_label, "message"), acquired - started)
+        metrics.observe("tm2abrp_process_message_seconds", (self.car_label,), done - acquired)
+
+    def subscriptions(self) -> List[Tuple[str, int]]:
+        """(topic, QoS) pairs for one SUBSCRIBE covering just the TeslaMate
+        topics this car consumes, instead of teslamate/cars/<n>/#."""
+        skip_location = self.config.get("SKIPLOCATION")
+        prefix = f"teslamate/cars/{self.config.get('CARNUMBER')}/"
+        return [
+            (prefix + topic, 0) for topic, handler in sorted(self.TOPIC_HANDLERS.items())
+            if not (handler.location and skip_location)
+        ]
+
+    def process_message(self, topic: str, payload: str):
+        """Process individual MQTT message based on topic name.
+
+        One dict lookup resolves the topic to its handler, precompiled from
+        TOPIC_HANDLERS (see compile_topic_handler), which parses, validates
+        and stores the value and runs its hook, if any.
+        """
+        apply = self._TOPIC_APPLIERS.get(topic)
+        if apply is None:
             # Unhandled topic
             logging.debug(f"Unneeded topic: {topic} {payload}")
+            return
+        try:
+            apply(self, payload)
+        except ValueError:
+            return
 
         # Calculate accurate power on AC charging
         if self.data["is_charging"] and not self.data["is_dcfc"] and "voltage" in self.data and "current" in self.data:
@@ -490,6 +2554,68 @@ class TeslaMateABRP:
             except (OverflowError, ValueError):
                 pass
 
+        if self.motion_policy is not None and topic in MOTION_TOPICS and self.state == "driving":
+            self._check_motion()
+
+    def _check_motion(self):
+        """Bring the next driving send forward if the car turned, changed pace
+        or travelled far enough since the last sent point."""
+        reason = self.motion_policy.check(self.data)
+        if reason is None:
+            return
+        logging.debug(f"Motion change ({reason}), sending to ABRP early.")
+        self.send_requested = True
+        if self.last_send is None:
+            self.scheduler.wake(self)
+        else:
+            self.scheduler.schedule(self, max(self.last_send + MIN_REFRESH_RATE, self.scheduler.clock()))
+
+    # Topic hooks, run by process_message after the parsed value is stored.
+    def _on_power(self, value: float):
+        if self.data["is_charging"] and value < -11:
+            self.data["is_dcfc"] = True
+
+    def _on_charger_power(self, value: int):
+        if value != 0:
+            self.data["is_charging"] = True
+            if value > 11:
+                self.data["is_dcfc"] = True
+        else:
+            # Charger power dropped to 0: clear the charge flags so a
+            # missed 'state' transition can't latch stale charging flags.
+            self.data["is_charging"] = False
+            self.data["is_dcfc"] = False
+
+    def _on_shift_state(self, value: str):
+        was_parked = self.data["is_parked"]
+        if value == "P":
+            self.data["is_parked"] = True
+        elif value in ["D", "R", "N"]:
+            self.data["is_parked"] = False
+        # Leaving or entering park: send now instead of at the next
+        # (possibly 30s-away parked) deadline.
+        if self.data["is_parked"] != was_parked:
+            self.send_requested = True
+            self.scheduler.wake(self)
+
+    def _on_state(self, value: str):
+        changed = value != self.state
+        self.state = value
+        self.handle_state_change(value)
+        if changed:
+            self.scheduler.wake(self)
+
+    def _on_usable_battery_level(self, value: int):
+        self.has_usable_battery_level = True
+
+    def _on_battery_level(self, value: int):
+        # Only use battery_level if we haven't received usable_battery_level
+        if not self.has_usable_battery_level:
+            self.data["soc"] = value
+
+    def _on_charger_phases(self, value: int):
+        self.charger_phases = 3 if value > 1 else 1
+
     def handle_state_change(self, state: str):
         """Update car state and relevant data fields."""
         if state == "driving":
@@ -505,21 +2631,36 @@ class TeslaMateABRP:
             self.data["is_charging"] = False
             self.data["is_dcfc"] = False
 
-    def _maybe_signal_model_ready(self):
+    def _maybe_signal_model_ready(self, value: Any = None):
         """Signal find_car_model() once both model and trim_badging are known."""
         if self.data["model"] and self.data["trim_badging"]:
             self.model_data_ready.set()
 
-    def find_car_model(self):
+    def find_car_model(self, timeout: float = MODEL_DETECTION_TIMEOUT):
         """Determine car model from TeslaMate data."""
         # Wait for the model + trim_badging messages (set by process_message),
         # returning as soon as both arrive; fall back to the timeout otherwise.
-        if not self.model_data_ready.wait(timeout=MODEL_DETECTION_TIMEOUT):
+        if not self.model_data_ready.wait(timeout=timeout):
             logging.debug(
                 "Timed out waiting for model/trim_badging; "
                 "proceeding with whatever data has arrived."
             )
 
+        with self.data_lock, self.data.batch():
+            car_model = self._resolve_car_model()
+        self.model_detection_failed = not car_model
+        if car_model is None:
+            return
+        if car_model:
+            logging.info(f"Car model automatically determined as: {car_model}.")
+        else:
+            logging.warning(
+                "Car model could not be automatically determined, "
+                "please set it through the CLI or environment var according to the documentation for best results."
+            )
+
+    def _resolve_car_model(self) -> Optional[str]:
+        """Set car_model from model and trim_badging; None if they're unknown."""
         # Handle Model 3 and Y using mapping dictionary
         if self.data["model"] in MODEL_MAPPINGS and self.data["trim_badging"] in MODEL_MAPPINGS[self.data["model"]]:
             self.data["car_model"] = MODEL_MAPPINGS[self.data["model"]][self.data["trim_badging"]]
@@ -532,111 +2673,266 @@ class TeslaMateABRP:
                 f"Your {self.data['model']} trim could not be automatically determined. "
                 f"Trim reported as: {self.data['trim_badging']}."
             )
-            return
-
-        if self.data["car_model"]:
-            logging.info(f"Car model automatically determined as: {self.data['car_model']}.")
-        else:
-            logging.warning(
-                "Car model could not be automatically determined, "
-                "please set it through the CLI or environment var according to the documentation for best results."
-            )
+            return None
+        return self.data["car_model"]
 
-    def publish_to_mqtt(self, data_object: Dict[str, Any]):
+    def publish_to_mqtt(self, data_object: Mapping[str, Any]):
         """Publish data to MQTT topics."""
         # Only publish if base_topic is set
         if not self.base_topic:
             return
             
         logging.debug(f"Publishing to MQTT: {data_object}")
-        # Snapshot under the lock so a concurrent mutation of self.data on the
-        # MQTT callback thread can't raise "dictionary changed size during
-        # iteration" here on the main thread.
-        with self.data_lock:
-            items = list(data_object.items())
-        for key, value in items:
-            # Skip republishing unchanged values: retain=True already keeps the
-            # last value on the broker, so this only drops redundant traffic
+        # Iterate a snapshot: self.data may change on the MQTT callback thread.
+        expired: List[str] = []
+        if isinstance(data_object, TelemetryData):
+            data_object, expired = self.fresh_telemetry(data_object.snapshot().data)
+        if self.status_document is not None:
+            self.status_document.update(data_object, expired)
+        elif self.status_throttle is not None:
+            self.status_throttle.update(data_object, expired)
+        else:
+            self.publish_fields(data_object, expired)
+
+    def publish_fields(self, data_object: Mapping[str, Any], expired: Iterable[str] = ()):
+        """Publish each changed field to its own status topic, and clear the
+        `expired` ones."""
+        for key in expired:
+            # An empty retained message clears the stale value on the broker.
+            if key in self.last_published:
+                del self.last_published[key]
+                try:
+                    self.client.publish(f"{self.base_topic}/{key}", payload=None,
+                                        qos=self.status_qos, retain=self.status_retain)
+                except Exception as e:
+                    logging.error(f"Failed to publish to MQTT: {e}")
+        for key, value in data_object.items():
+            # Skip republishing unchanged values: retained messages already keep
+            # the last value on the broker, so this only drops redundant traffic
             # (e.g. while parked only `utc` changes, not all ~21 fields).
             if key in self.last_published and self.last_published[key] == value:
                 continue
             try:
                 self.client.publish(
                     f"{self.base_topic}/{key}",
-                    payload=value,
-                    qos=1,
-                    retain=True
+                    payload=dump_json(value) if isinstance(value, dict) else value,
+                    qos=self.status_qos,
+                    retain=self.status_retain
                 )
                 self.last_published[key] = value
             except Exception as e:
                 logging.error(f"Failed to publish to MQTT: {e}")
 
     def update_abrp(self):
-        """Send data to ABRP API."""
+        """Send data to ABRP API, then to the external sinks.
+
+        Once run() has started the sender worker, the snapshot is handed to it
+        (replacing any still unsent one) so the update loop never waits on the
+        network; otherwise it is POSTed right away. The external sinks only
+        queue it for their own worker threads.
+        """
         # Don't POST while the MQTT link is down: self.state/self.data are frozen
         # at their last-known values and would be reported to ABRP as if live.
         # paho's background loop auto-reconnects (see on_disconnect).
         if not self.client.is_connected():
             logging.debug("MQTT not connected; skipping ABRP update to avoid sending stale data.")
             return
-        try:
-            headers = {"Authorization": f"APIKEY {self.api_key}"}
-            # Snapshot under the lock so the payload can't change mid-serialize.
-            # Stamp the send time here (P-3) rather than on every idle loop tick.
-            with self.data_lock:
-                self.data["utc"] = calendar.timegm(datetime.datetime.now(datetime.UTC).timetuple())
-                snapshot = dict(self.data)
-            # Defense-in-depth: drop any non-finite numbers (nan/inf) so json
-            # (allow_nan=False) can't reject the whole payload and break every
-            # subsequent POST until the offending value happens to change.
-            snapshot = {
-                k: v for k, v in snapshot.items()
-                if not (isinstance(v, float) and not math.isfinite(v))
-            }
-            body = {"tlm": snapshot}
-            response = requests.post(
-                f"https://api.iternio.com/1/tlm/send?token={self.config.get('USERTOKEN')}",
-                headers=headers,
-                json=body,
-                timeout=10
-            )
-
+        started = perf_counter()
+        # Stamp the send time here (P-3) rather than on every idle loop tick;
+        # that's a write, so it queues behind a message being processed.
+        with self.data_lock:
+            if self.metrics is not None:
+                self.metrics.observe("tm2abrp_data_lock_wait_seconds", (self.car_label, "send"),
+                                     perf_counter() - started)
+            self.data["utc"] = calendar.timegm(datetime.datetime.now(datetime.UTC).timetuple())
+        # to_payload drops any non-finite numbers (nan/inf), defense-in-depth
+        # so json (allow_nan=False) can't reject the whole payload and break
+        # every subsequent POST until the offending value happens to change.
+        snapshot = self.fresh_telemetry(self.data.snapshot().data)[0].to_payload()
+        snapshot.taken = self.scheduler.clock()
+        self.abrp_sink.submit(self.car_label, snapshot)
+        for sink in self.sinks:
             try:
-                resp = response.json()
-                if self.base_topic:
-                    self.publish_to_mqtt({f"{self.prefix}_post_last_status": resp["status"]})
-                
-                if resp["status"] != "ok":
-                    logging.error(f"Error, response from the ABRP API: {redact_secrets(response.text)}.")
-                    if self.base_topic:
-                        self.publish_to_mqtt({f"{self.prefix}_post_last_error": self.nice_now()})
-                else:
-                    # Keep an INFO heartbeat without PII; the full payload
-                    # (lat/lon/odometer) is only emitted at DEBUG.
-                    logging.info(
-                        f"Data sent to ABRP (soc={self.data.get('soc')}%, "
-                        f"state={self.state or 'unknown'})."
-                    )
-                    logging.debug(f"Full data object sent: {self.data}")
-                    if self.base_topic:
-                        self.publish_to_mqtt({f"{self.prefix}_post_last_success": self.nice_now()})
-            except (json.JSONDecodeError, KeyError) as e:
-                logging.error(f"Invalid response from ABRP API: {e}")
-                if self.base_topic:
-                    self.publish_to_mqtt({f"{self.prefix}_post_last_error": self.nice_now()})
+                sink.submit(self.car_label, snapshot)
+            except Exception as e:
+                logging.error(f"Telemetry sink {sink.name} rejected an update: {type(e).__name__} - {e}")
+
+    def fresh_telemetry(self, record: TelemetryRecord) -> Tuple[TelemetryRecord, List[str]]:
+        """`record` without the fields that outlived their FIELD_TTLS entry,
+        and the names of those fields."""
+        if not self.field_ttls:
+            return record, []
+        expired = record.expired(self.field_ttls, self.scheduler.clock())
+        if not expired:
+            return record, []
+        names = [name for index, name in enumerate(TelemetryRecord.FIELDS) if expired >> index & 1]
+        logging.debug(f"Leaving out stale fields: {', '.join(names)}")
+        return record.without(expired), names
+
+    def send_snapshot(self, snapshot: Dict[str, Any]):
+        """POST one snapshot to every ABRP account following the car and
+        handle the replies (runs on the sender worker once it's started).
+
+        The body is encoded once; with several accounts the POSTs run
+        concurrently on the delivery pool and this returns when all are done.
+        """
+        try:
+            body = self.encoder.encode(snapshot)
+        except Exception as ex:
+            self.handle_post_crash(ex)
+            return
+        if self.delivery_pool is None:
+            accepted = [self.post_snapshot(self.recipients[0], snapshot, body)]
+        else:
+            accepted = list(self.delivery_pool.map(
+                lambda recipient: self.post_snapshot(recipient, snapshot, body), self.recipients
+            ))
+        self.mark_delivered(snapshot, accepted)
 
+    def post_snapshot(self, recipient: ABRPRecipient, snapshot: Dict[str, Any], body: bytes) -> bool:
+        """POST an encoded snapshot to one account and handle the reply;
+        True if the account accepted it."""
+        started, posted = perf_counter(), self.scheduler.clock()
+        try:
+            response = self.session.post(recipient.url, headers=self.abrp_headers, data=body)
+            return self.handle_reply(snapshot, started, response, recipient, posted)
         except requests.RequestException as ex:
-            logging.critical(f"Failed to connect to ABRP API: {redact_secrets(ex)}")
-            if self.base_topic:
-                self.publish_to_mqtt({f"{self.prefix}_post_exception": redact_secrets(ex)})
-                self.publish_to_mqtt({f"{self.prefix}_post_last_exception": self.nice_now()})
+            self.handle_post_failure(snapshot, started, ex, recipient)
         except Exception as ex:
-            logging.critical(
-                f"Unexpected exception while POSTing to ABRP API: {type(ex).__name__} - {redact_secrets(ex)}"
+            self.handle_post_crash(ex, recipient)
+        return False
+
+    def mark_delivered(self, snapshot: Dict[str, Any], accepted: List[bool]):
+        """Make `snapshot` the change detector's baseline once every account
+        accepted it; one that missed it keeps the next update coming."""
+        if self.change_detector is not None and all(accepted):
+            self.change_detector.mark_sent(snapshot, self.scheduler.clock())
+
+    def handle_reply(self, snapshot: Dict[str, Any], started: float, response: Any,
+                     recipient: Optional[ABRPRecipient] = None, posted: Optional[float] = None) -> bool:
+        """Act on ABRP's reply to a snapshot POSTed at `started` (perf_counter;
+        `posted` is the same moment on the scheduler's clock, if known) to the
+        first account unless `recipient` says otherwise; `response` needs
+        .json() and .text (a requests.Response or equivalent).
+
+        Returns True if the account accepted the snapshot.
+        """
+        recipient = recipient or self.recipients[0]
+        prefix = recipient.prefix
+        try:
+            resp = response.json()
+            if self.base_topic:
+                self.publish_to_mqtt({f"{prefix}_post_last_status": resp["status"]})
+            self._observe_post(started, "ok" if resp["status"] == "ok" else "rejected")
+
+            if resp["status"] != "ok":
+                logging.error(f"Error, response from the ABRP API{recipient.suffix}: {redact_secrets(response.text)}.")
+                if self.base_topic:
+                    self.publish_to_mqtt({f"{prefix}_post_last_error": self.nice_now()})
+                return False
+
+            # Keep an INFO heartbeat without PII; the full payload
+            # (lat/lon/odometer) is only emitted at DEBUG.
+            logging.info(
+                f"Data sent to ABRP{recipient.suffix} (soc={snapshot.get('soc')}%, "
+                f"state={self.state or 'unknown'})."
             )
+            logging.debug(f"Full data object sent: {snapshot}")
             if self.base_topic:
-                self.publish_to_mqtt({f"{self.prefix}_post_exception": redact_secrets(ex)})
-                self.publish_to_mqtt({f"{self.prefix}_post_last_exception": self.nice_now()})
+                self.publish_to_mqtt({f"{prefix}_post_last_success": self.nice_now()})
+            self.record_freshness(snapshot, posted)
+            # ABRP is reachable: replay anything queued during an outage.
+            if recipient.drainer is not None:
+                recipient.drainer.start()
+            return True
+        except (json.JSONDecodeError, KeyError) as e:
+            self._observe_post(started, "invalid")
+            logging.error(f"Invalid response from ABRP API{recipient.suffix}: {e}")
+            if self.base_topic:
+                self.publish_to_mqtt({f"{prefix}_post_last_error": self.nice_now()})
+            # A non-JSON reply is typically a proxy/gateway error page.
+            self.queue_unsent(snapshot, recipient)
+            return False
+
+    def handle_post_failure(self, snapshot: Dict[str, Any], started: float, ex: Exception,
+                            recipient: Optional[ABRPRecipient] = None):
+        """The POST never got a reply (connection error, timeout, ...)."""
+        recipient = recipient or self.recipients[0]
+        self._observe_post(started, "error")
+        logging.critical(f"Failed to connect to ABRP API{recipient.suffix}: {redact_secrets(ex)}")
+        self.queue_unsent(snapshot, recipient)
+        if self.base_topic:
+            self.publish_to_mqtt({f"{recipient.prefix}_post_exception": redact_secrets(ex)})
+            self.publish_to_mqtt({f"{recipient.prefix}_post_last_exception": self.nice_now()})
+
+    def handle_post_crash(self, ex: Exception, recipient: Optional[ABRPRecipient] = None):
+        """Anything else that went wrong while sending (a bug, not ABRP);
+        reported for `recipient`, or the first account if it's not specific."""
+        recipient = recipient or self.recipients[0]
+        logging.critical(
+            f"Unexpected exception while POSTing to ABRP API{recipient.suffix}: "
+            f"{type(ex).__name__} - {redact_secrets(ex)}"
+        )
+        if self.base_topic:
+            self.publish_to_mqtt({f"{recipient.prefix}_post_exception": redact_secrets(ex)})
+            self.publish_to_mqtt({f"{recipient.prefix}_post_last_exception": self.nice_now()})
+
+    def record_freshness(self, snapshot: Mapping[str, Any], posted: Optional[float]):
+        """Trace how old an accepted snapshot's data was (see FreshnessTracker)
+        into the metrics, and its percentiles to the status topic now and then."""
+        accepted = self.scheduler.clock()
+        stages = self.freshness.record(snapshot, accepted, posted)
+        if self.metrics is not None:
+            for stage, seconds in stages.items():
+                self.metrics.observe("tm2abrp_data_age_seconds", (self.car_label, stage), seconds)
+        if self.base_topic and self.freshness.publish_due(accepted):
+            self.publish_to_mqtt({f"{self.prefix}_freshness": self.freshness.summary()})
+
+    def _observe_post(self, started: float, outcome: str):
+        if self.metrics is not None:
+            self.metrics.observe("tm2abrp_abrp_post_seconds", (self.car_label, outcome), perf_counter() - started)
+
+    def queue_unsent(self, snapshot: Optional[Dict[str, Any]], recipient: Optional[ABRPRecipient] = None):
+        """Keep a snapshot an account (the first by default) didn't receive
+        for later replay (if queueing is on)."""
+        if self.outbox is None or snapshot is None:
+            return
+        recipient = recipient or self.recipients[0]
+        try:
+            self.outbox.put(recipient.queue_target, snapshot)
+            self.publish_queue_size(recipient)
+        except sqlite3.Error as e:
+            logging.error(f"Could not queue unsent telemetry: {e}")
+
+    def replay_snapshot(self, snapshot: Dict[str, Any], recipient: Optional[ABRPRecipient] = None,
+                        timeout: Optional[Tuple[float, float]] = None) -> bool:
+        """POST one queued snapshot (keeping its original utc) to the account
+        it was queued for, within `timeout` (connect, read) if given.
+
+        Returns False if ABRP is still unreachable (keep it queued) and True
+        once it's been handled - accepted, or rejected for good and dropped.
+        """
+        try:
+            # Not through the encoder: old snapshots would only churn its cache.
+            body = dump_json({"tlm": snapshot})
+            url = (recipient or self.recipients[0]).url
+            if timeout is None:
+                response = self.session.post(url, headers=self.abrp_headers, data=body)
+            else:
+                response = self.session.post(url, headers=self.abrp_headers, data=body, timeout=timeout)
+            resp = response.json()
+        except (requests.RequestException, ValueError) as ex:
+            logging.debug(f"Backlog replay to ABRP failed, will retry later: {redact_secrets(ex)}")
+            return False
+        if not isinstance(resp, dict) or resp.get("status") != "ok":
+            logging.warning(f"ABRP rejected queued telemetry (utc={snapshot.get('utc')}), dropping it.")
+        return True
+
+    def publish_queue_size(self, recipient: Optional[ABRPRecipient] = None):
+        """Mirror the number of updates queued for an account to the status topic."""
+        if self.base_topic and self.outbox is not None:
+            recipient = recipient or self.recipients[0]
+            self.publish_to_mqtt({f"{recipient.prefix}_queue_size": self.outbox.count(recipient.queue_target)})
 
     def nice_now(self) -> str:
         """Return a formatted timestamp."""
@@ -650,62 +2946,113 @@ class TeslaMateABRP:
         if state == "charging":
             return self.refresh_rate_charging
         if state == "driving":
+            if self.motion_policy is not None:
+                return self.motion_policy.interval
             return self.refresh_rate_driving
         return None
 
     def update_timely(self):
         """Update ABRP based on car state and per-state refresh timers.
 
-        Scheduling is wall-clock based (monotonic): a send fires once at least
-        `rate` seconds have elapsed since the previous one. This supports
-        fractional-second rates, never accumulates drift (each interval is
-        measured from the last send time, not a counter), and polls on a small
-        fixed tick so state changes - set from the MQTT callback thread - are
-        detected within one tick.
+        Event driven: the Scheduler sleeps exactly until the next send is due
+        (last send + the state's rate, so fractional rates never drift) or until
+        process_message wakes it on a state/shift_state change, which is then
+        handled immediately instead of on the next poll.
         """
-        last_send = None  # monotonic time of the last send; None -> send now
-        while True:
-            # A fatal MQTT failure is flagged from the callback thread; exit the
-            # process from the main thread so it doesn't spin here forever and
-            # the container runtime can apply its restart policy.
-            if self.fatal_error:
-                raise SystemExit(self.fatal_error)
-            sleep(REFRESH_TICK)
-
-            # Snapshot the state once so it can't change mid-iteration.
-            state = self.state
-            state_changed = state != self.prev_state
-            if state_changed:
-                last_send = None  # fire promptly on a state change
-                logging.debug(f"Current car state changed to: {state}.")
-
-            rate = self._refresh_rate_for_state(state)
-            if rate is None:
-                # Log once per entry into an unknown state (not every tick).
-                if state and state_changed:
-                    logging.error(f"Car is in unknown state ({state}), not sending any update to ABRP.")
-                self.prev_state = state
-                continue
+        self.last_send = None
+        self.scheduler.wake(self)
+        run_schedule(self.scheduler, lambda: self.fatal_error)
+
+    def tick(self, now: Optional[float] = None) -> Optional[float]:
+        """Run one scheduler step: detect state changes, do the parked
+        housekeeping and send to ABRP if the refresh interval has elapsed.
+
+        Returns the deadline of the next send, or None while the car is in an
+        unknown state (it then stays idle until the next state message).
+        """
+        if now is None:
+            now = self.scheduler.clock()
+        if self.bootstrapping:
+            # Hold the first send until the retained burst has been applied.
+            if now < self.bootstrap_deadline:
+                return self.bootstrap_deadline
+            self.end_bootstrap("timed out waiting for the end of retained messages")
+        # Snapshot the state once so it can't change mid-iteration.
+        state = self.state
+        state_changed = state != self.prev_state
+        if state_changed:
+            self.last_send = None  # fire promptly on a state change
+            logging.debug(f"Current car state changed to: {state}.")
+            if self.motion_policy is not None:
+                self.motion_policy.reset()
 
-            # Parked/idle housekeeping runs every tick (cheap; zeroes power/speed).
+        rate = self._refresh_rate_for_state(state)
+        if rate is None:
+            # Log once per entry into an unknown state (not every tick).
+            if state and state_changed:
+                logging.error(f"Car is in unknown state ({state}), not sending any update to ABRP.")
+            self.prev_state = state
+            self.next_send = None
+            return None
+
+        if self.send_requested or self.last_send is None or now >= self.last_send + rate:
+            # State changes and shift changes always go out; only routine
+            # sends are subject to change detection.
+            forced = self.send_requested or self.last_send is None
+            self.send_requested = False
+            if self.metrics is not None and not forced and self.next_send is not None:
+                self.metrics.observe("tm2abrp_scheduler_lag_seconds", (self.car_label,), max(0.0, now - self.next_send))
+            # Parked/idle housekeeping right before the send (zeroes power/speed).
             if state in PARKED_STATES:
                 self.handle_parked_state()
-
-            now = monotonic()
-            if last_send is None or (now - last_send) >= rate:
+            if not forced and not self._has_news(now):
+                logging.debug("No meaningful change since the last update, skipping this ABRP send.")
+                if self.metrics is not None:
+                    self.metrics.inc("tm2abrp_sends_total", (self.car_label, state, "suppressed"))
+            else:
+                if self.metrics is not None:
+                    self.metrics.inc("tm2abrp_sends_total", (self.car_label, state, "sent"))
                 if state_changed:
                     label = STATE_LABELS.get(state, "sleeping")
                     logging.info(f"Car is {label}, updating every {rate}s.")
                 self.update_abrp()
                 if self.base_topic:
-                    self.publish_to_mqtt(self.data)
-                last_send = now
+                    self.mqtt_sink.submit(self.car_label, self.data)
+                self.save_state(now)
+                if self.motion_policy is not None and state == "driving":
+                    self.motion_policy.mark_sent(self.data.snapshot().data, stretch=not forced)
+                    rate = self.motion_policy.interval
+            # Slot consumed either way: the next check is one rate later.
+            self.last_send = now
 
-            self.prev_state = state
+        self.prev_state = state
+        self.next_send = self.last_send + rate
+        if self.send_requested:
+            # Requested from the MQTT thread while this tick ran; don't let the
+            # returned deadline override the earlier one it scheduled.
+            self.next_send = min(self.next_send, max(self.last_send + MIN_REFRESH_RATE, now))
+        return self.next_send
+
+    def _has_news(self, now: float) -> bool:
+        """Ask the change detector (if enabled) whether the current data is
+        worth sending; count and publish suppressions."""
+        if self.change_detector is None:
+            return True
+        snapshot = self.data.snapshot()
+        # Compare what would be sent: mark_sent() saw it without stale fields.
+        # Expiry doesn't bump the version, so don't let it vouch for the
+        # filtered view.
+        record, expired = self.fresh_telemetry(snapshot.data)
+        if self.change_detector.is_meaningful(record, now, None if expired else snapshot.version):
+            return True
+        self.change_detector.suppressed += 1
+        if self.base_topic:
+            self.publish_to_mqtt({f"{self.prefix}_sends_suppressed": self.change_detector.suppressed})
+        return False
 
     def handle_parked_state(self):
         """Handle data updates when car is parked."""
-        with self.data_lock:
+        with self.data_lock, self.data.batch():
             # Reset power and speed if they're not zero
             if self.data["power"] != 0:
                 self.data["power"] = 0.0
@@ -719,21 +3066,739 @@ class TeslaMateABRP:
         """Main entry point to run the application."""
         # If car model not provided, try to determine it
         if not self.config.get("CARMODEL"):
-            self.find_car_model()
+            self.detect_car_model()
         else:
             logging.info(f"Car model manually set to: {self.config.get('CARMODEL')}.")
-        
+        if self.metrics is not None:
+            self.metrics.start_server()
+        self.abrp_sink.start()
+        for sink in self.sinks:
+            sink.start()
+
         try:
             # Start the main update loop
             self.update_timely()
         except KeyboardInterrupt:
             logging.info("Received keyboard interrupt, shutting down.")
         finally:
-            # Clean up
-            if self.client.is_connected():
-                self.client.loop_stop()
-                self.client.disconnect()
-            logging.info("Shutdown complete.")
+            self.close()
+
+    def close(self):
+        """Flush the sender and sinks and release the MQTT link, HTTP session and files."""
+        if self.bootstrap_timer is not None:
+            self.bootstrap_timer.cancel()
+        self.abrp_sink.stop(timeout=sum(self.session.timeout))
+        for sink in self.sinks:
+            sink.stop(timeout=sum(self.session.timeout))
+        self.save_state()
+        if self.client.is_connected():
+            self.client.loop_stop()
+            self.client.disconnect()
+        if self.delivery_pool is not None:
+            self.delivery_pool.shutdown(wait=False)
+        self.session.close()
+        if self.outbox is not None:
+            self.outbox.close()
+        if self.metrics is not None:
+            self.metrics.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        logging.info("Shutdown complete.")
+
+    # TeslaMate topic name -> how process_message applies it. Introspectable:
+    # supported_topics() lists the keys, e.g. to build the subscription set.
+    TOPIC_HANDLERS: Dict[str, TopicHandler] = {
+        "model": TopicHandler("model", str, hook=_maybe_signal_model_ready),
+        "trim_badging": TopicHandler("trim_badging", str, hook=_maybe_signal_model_ready),
+        "latitude": TopicHandler("lat", float, finite=True, location=True),
+        "longitude": TopicHandler("lon", float, finite=True, location=True),
+        "elevation": TopicHandler("elevation", int),
+        "speed": TopicHandler("speed", int),
+        "power": TopicHandler("power", float, finite=True, hook=_on_power),
+        "charger_power": TopicHandler(None, int, hook=_on_charger_power),
+        "heading": TopicHandler("heading", int, minimum=0, maximum=360),
+        "outside_temp": TopicHandler("ext_temp", float, finite=True),
+        "odometer": TopicHandler("odometer", float, finite=True),
+        "ideal_battery_range_km": TopicHandler("ideal_battery_range", float, finite=True),
+        "est_battery_range_km": TopicHandler("est_battery_range", float, finite=True),
+        "charger_actual_current": TopicHandler("current", int, present_above=0),
+        "charger_voltage": TopicHandler("voltage", int, present_above=5),
+        "shift_state": TopicHandler(None, str, allow_empty=True, hook=_on_shift_state),
+        "state": TopicHandler(None, str, allow_empty=True, hook=_on_state),
+        "usable_battery_level": TopicHandler("soc", int, minimum=0, maximum=100, hook=_on_usable_battery_level),
+        "battery_level": TopicHandler(None, int, minimum=0, maximum=100, hook=_on_battery_level),
+        "charge_energy_added": TopicHandler("kwh_charged", float, finite=True),
+        "charger_phases": TopicHandler(None, int, hook=_on_charger_phases),
+    }
+    # Precompiled appliers, one per topic (see compile_topic_handler).
+    _TOPIC_APPLIERS: Dict[str, Callable[[Any, str], None]] = {
+        topic: compile_topic_handler(handler) for topic, handler in TOPIC_HANDLERS.items()
+    }
+
+
+def supported_topics() -> List[str]:
+    """Names of the TeslaMate topics the bridge consumes."""
+    return sorted(TeslaMateABRP.TOPIC_HANDLERS)
+
+## [ Multi-car mode ]
+# Per-car keys accepted in the CARS_CONFIG file, mapped to the config keys
+# TeslaMateABRP reads. Anything not listed falls back to the global settings.
+FLEET_CAR_KEYS = {
+    "car_number": "CARNUMBER",
+    "user_token": "USERTOKEN",
+    "car_model": "CARMODEL",
+    "refresh_driving": "REFRESH_RATE_DRIVING",
+    "refresh_charging": "REFRESH_RATE_CHARGING",
+    "refresh_parked": "REFRESH_RATE_PARKED",
+}
+
+
+def load_fleet_config(path: str) -> list:
+    """Load the per-car settings for multi-car mode from a JSON file.
+
+    The file holds a list of objects, one per TeslaMate car, e.g.
+    ``[{"car_number": 1, "user_token": "..."}, {"car_number": 2, ...}]``.
+    Returns a list of config-override dicts (keys as in FLEET_CAR_KEYS).
+    Raises ValueError on a malformed file so main() can report it.
+    """
+    try:
+        with open(path, "r") as f:
+            entries = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        raise ValueError(f"Could not read cars config {path}: {e}")
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"Cars config {path} must be a non-empty JSON list.")
+
+    cars = []
+    seen = set()
+    for entry in entries:
+        if not isinstance(entry, dict) or entry.get("car_number") in (None, ""):
+            raise ValueError(f"Every entry in {path} needs a car_number.")
+        unknown = set(entry) - set(FLEET_CAR_KEYS)
+        if unknown:
+            logging.warning(f"Ignoring unknown cars config keys: {', '.join(sorted(unknown))}.")
+        car = {FLEET_CAR_KEYS[k]: v for k, v in entry.items() if k in FLEET_CAR_KEYS and v is not None}
+        car["CARNUMBER"] = str(car["CARNUMBER"])
+        if car["CARNUMBER"] in seen:
+            raise ValueError(f"Car number {car['CARNUMBER']} is listed more than once in {path}.")
+        seen.add(car["CARNUMBER"])
+        cars.append(car)
+    return cars
+
+
+class TeslaMateABRPFleet:
+    """Serve several TeslaMate cars from one process.
+
+    One MQTT connection subscribes to every car's topics and routes each
+    message by car number to a per-car TeslaMateABRP, and a single update loop
+    drives all cars' schedules, instead of one client/thread/loop per car.
+    """
+
+    def __init__(self, config: Dict[str, Any], cars: list, client: Any = None):
+        self.config = config
+        self.base_topic = self.config.get("BASETOPIC")
+        self.prefix = "_tm2abrp"
+        self.state_topic = f"{self.base_topic}/{self.prefix}_status" if self.base_topic else None
+        # Bootstrap sentinel of the current connection (see BOOTSTRAP_TOPIC).
+        self.sentinel_topic: Optional[str] = None
+        self.fatal_error: Optional[str] = None
+
+        car_numbers = [car["CARNUMBER"] for car in cars]
+        # A client passed in (replay's OfflineClient) is used as is.
+        self.recorder: Optional[MessageRecorder] = None
+        self.client = client or create_mqtt_client(
+            self.config, f"teslamateToABRP-{'-'.join(car_numbers)}", self.state_topic
+        )
+
+        # One pooled HTTP session for every car's ABRP POSTs and one deadline
+        # scheduler for every car's sends.
+        self.session = ABRPSession.from_config(self.config)
+        self.scheduler = Scheduler()
+        # One store-and-forward queue file for all cars (rows keyed by car).
+        self.outbox = TelemetryOutbox.from_config(self.config)
+        self.metrics = Metrics.from_config(self.config, self.session)
+        self.state_cache = StateCache.from_config(self.config)
+        # External sinks get every car's snapshots, tagged with its number.
+        self.sinks = build_sinks(self.config, self.metrics)
+
+        # Per-car bridges share the client; each mirrors its status under
+        # <status-topic>/<car_number> so cars don't overwrite each other.
+        self.cars: Dict[str, TeslaMateABRP] = {}
+        for car in cars:
+            car_config = {**self.config, **car}
+            if self.base_topic:
+                car_config["BASETOPIC"] = f"{self.base_topic}/{car['CARNUMBER']}"
+            self.cars[car["CARNUMBER"]] = TeslaMateABRP(
+                car_config, client=self.client, session=self.session, scheduler=self.scheduler,
+                outbox=self.outbox, metrics=self.metrics, state_cache=self.state_cache, sinks=self.sinks,
+            )
+
+        if client is None:
+            self.recorder = MessageRecorder.from_config(self.config)
+            self.client.on_connect = self.on_connect
+            self.client.on_message = self.on_message if self.recorder is None else self.recorder.wrap(self.on_message)
+            self.client.on_disconnect = self.on_disconnect
+            connect_mqtt_client(self.client, self.config)
+
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        logging.info(
+            f"MQTT Connection returned result: {mqtt.connack_string(reason_code)} (reason code {reason_code})."
+        )
+        # Same as the single-car bridge: flag the failure for the main thread.
+        error_msg = mqtt_connect_error(reason_code)
+        if error_msg:
+            logging.critical(error_msg)
+            self.fatal_error = error_msg
+            self.scheduler.wake()
+            return
+
+        # One SUBSCRIBE for every car rather than one per car, plus the
+        # bootstrap sentinel shared by all of them.
+        for car in self.cars.values():
+            car.begin_bootstrap()
+        self.sentinel_topic = f"{BOOTSTRAP_TOPIC}/{secrets.token_hex(8)}"
+        topics = [topic for car in self.cars.values() for topic in car.subscriptions()]
+        client.subscribe(topics + [(self.sentinel_topic, 0)])
+        client.publish(self.sentinel_topic, payload="", qos=0, retain=False)
+        logging.debug(f"Subscribed to {len(topics)} topics for cars {', '.join(self.cars)}")
+
+        if self.base_topic:
+            client.publish(self.state_topic, payload="online", qos=2, retain=True)
+            for car in self.cars.values():
+                client.publish(car.state_topic, payload="online", qos=2, retain=True)
+
+    def on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
+        # Every car shares the link, so the first car's handler covers them all.
+        next(iter(self.cars.values())).on_disconnect(client, userdata, disconnect_flags, reason_code, properties)
+
+    def on_message(self, client, userdata, message):
+        if message.topic == self.sentinel_topic:
+            for car in self.cars.values():
+                car.end_bootstrap("end of retained messages")
+            return
+        # teslamate/cars/<n>/<topic>: route by car number.
+        parts = message.topic.split('/')
+        car = self.cars.get(parts[2]) if len(parts) > 3 else None
+        if car is None:
+            logging.debug(f"Message for unknown car: {message.topic}")
+            return
+        car.on_message(client, userdata, message)
+
+    def update_timely(self):
+        """Drive every car's schedule from one shared Scheduler (see TeslaMateABRP.tick)."""
+        for car in self.cars.values():
+            car.last_send = None
+            self.scheduler.wake(car)
+        run_schedule(self.scheduler, lambda: self.fatal_error)
+
+    def run(self):
+        """Main entry point to run the fleet."""
+        # Model detection waits overlap: every car's messages arrive on the
+        # same connection, so one shared deadline bounds the total wait.
+        deadline = monotonic() + MODEL_DETECTION_TIMEOUT
+        for number, car in self.cars.items():
+            if not car.config.get("CARMODEL"):
+                car.detect_car_model(timeout=max(0.0, deadline - monotonic()))
+            else:
+                logging.info(f"Car {number} model manually set to: {car.config.get('CARMODEL')}.")
+        if self.metrics is not None:
+            self.metrics.start_server()
+        for car in self.cars.values():
+            car.abrp_sink.start()
+        for sink in self.sinks:
+            sink.start()
+
+        try:
+            self.update_timely()
+        except KeyboardInterrupt:
+            logging.info("Received keyboard interrupt, shutting down.")
+        finally:
+            self.close()
+
+    def close(self):
+        """Flush every car's sender and the sinks and release the shared resources."""
+        for car in self.cars.values():
+            if car.bootstrap_timer is not None:
+                car.bootstrap_timer.cancel()
+            car.abrp_sink.stop(timeout=sum(self.session.timeout))
+            car.save_state()
+            if car.delivery_pool is not None:
+                car.delivery_pool.shutdown(wait=False)
+        for sink in self.sinks:
+            sink.stop(timeout=sum(self.session.timeout))
+        if self.client.is_connected():
+            self.client.loop_stop()
+            self.client.disconnect()
+        self.session.close()
+        if self.outbox is not None:
+            self.outbox.close()
+        if self.metrics is not None:
+            self.metrics.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        logging.info("Shutdown complete.")
+
+## [ asyncio runtime ]
+class AsyncSender:
+    """SenderWorker counterpart for the asyncio runtime: the same latest-wins
+    mailbox and background jobs, delivered by at most one task per car
+    instead of a thread. A job's blocking part runs in the default executor,
+    its ``done`` callback back on the loop.
+
+    submit() and submit_job() must be called on the event loop (tick() runs
+    there).
+    """
+
+    def __init__(self, deliver: Callable[[Dict[str, Any]], Awaitable[None]], name: str = "",
+                 metrics: Optional[Metrics] = None):
+        self.deliver = deliver
+        self.name = name
+        self.metrics = metrics
+        self.running = True
+        self.task: Optional[asyncio.Task] = None
+        self._pending: Optional[Dict[str, Any]] = None
+        self._jobs: Deque[Tuple[Callable[[], Any], Callable[[Any], None]]] = collections.deque()
+        self.superseded = 0
+        self.in_flight_since: Optional[float] = None
+
+    def submit(self, snapshot: Dict[str, Any]):
+        if self._pending is not None:
+            self.superseded += 1
+            if self.metrics is not None:
+                self.metrics.inc("tm2abrp_snapshots_superseded_total", (self.name,))
+            logging.debug("Previous ABRP update still waiting to be sent, replacing it with newer data.")
+        self._pending = snapshot
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._drain())
+
+    def submit_job(self, work: Callable[[], Any], done: Callable[[Any], None]):
+        """Run `work` in the executor once no snapshot is waiting, then
+        ``done(result)`` on the loop."""
+        self._jobs.append((work, done))
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._drain())
+
+    async def _drain(self):
+        try:
+            while self._pending is not None or self._jobs:
+                if self._pending is None:
+                    work, done = self._jobs.popleft()
+                    try:
+                        done(await asyncio.get_running_loop().run_in_executor(None, work))
+                    except Exception as e:
+                        logging.critical(f"Unexpected exception in the ABRP sender: {type(e).__name__} - {redact_secrets(e)}")
+                    continue
+                snapshot, self._pending = self._pending, None
+                started = self.in_flight_since = perf_counter()
+                try:
+                    await self.deliver(snapshot)
+                except Exception as e:
+                    logging.critical(f"Unexpected exception in the ABRP sender: {type(e).__name__} - {redact_secrets(e)}")
+                finally:
+                    self.in_flight_since = None
+                    if self.metrics is not None:
+                        self.metrics.observe("tm2abrp_send_in_flight_seconds", (self.name,), perf_counter() - started)
+        finally:
+            self.task = None
+
+    async def flush(self, timeout: float):
+        """Wait (up to `timeout`) for pending deliveries to finish; queued
+        jobs are dropped."""
+        self.running = False
+        self._jobs.clear()
+        if self.task is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(self.task), timeout)
+            except asyncio.TimeoutError:
+                logging.warning("Gave up waiting for the last ABRP update to be sent.")
+
+    def start(self):
+        self.running = True
+
+    def stop(self, timeout: Optional[float] = None):
+        self.running = False
+
+
+class AsyncRuntime:
+    """Run a bridge (one car or a fleet) on a single asyncio event loop.
+
+    Replaces paho's loop thread and the blocking update loop: the MQTT socket
+    is watched by the event loop (paho's loop_read/loop_write/loop_misc), the
+    Scheduler is awaited instead of waited on, and each car POSTs through an
+    AsyncSender with aiohttp when installed (requests in an executor
+    otherwise). Message handling, ticks and reply handling all run on the
+    loop thread, so the data locks are never contended and fatal errors are
+    seen as soon as the scheduler is woken.
+    """
+
+    # paho's housekeeping (keepalive pings, reconnect) interval.
+    MISC_INTERVAL = 1.0
+    # What a failed POST raises, with or without aiohttp.
+    POST_ERRORS: Tuple[Type[Exception], ...] = (requests.RequestException, asyncio.TimeoutError) + (
+        (aiohttp.ClientError,) if HAS_AIOHTTP else ())
+
+    def __init__(self, bridge: Any):
+        self.bridge = bridge
+        self.client = bridge.client
+        self.scheduler: Scheduler = bridge.scheduler
+        self.cars: List[TeslaMateABRP] = (
+            list(bridge.cars.values()) if isinstance(bridge, TeslaMateABRPFleet) else [bridge]
+        )
+        self.http: Any = None
+        # Set (thread-safely) by the Scheduler's listener; awaited between ticks.
+        self.wakeup = asyncio.Event()
+
+    def run(self):
+        """Run until interrupted or a fatal MQTT error, then shut down."""
+        try:
+            asyncio.run(self.main())
+        except KeyboardInterrupt:
+            logging.info("Received keyboard interrupt, shutting down.")
+        finally:
+            self.bridge.close()
+
+    async def main(self):
+        loop = asyncio.get_running_loop()
+        self.scheduler.listener = lambda: loop.call_soon_threadsafe(self.wakeup.set)
+        self.attach_mqtt(loop)
+        if HAS_AIOHTTP:
+            session = self.cars[0].session
+            self.http = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=session.pool_size),
+                timeout=aiohttp.ClientTimeout(sock_connect=session.timeout[0], sock_read=session.timeout[1]),
+            )
+        for car in self.cars:
+            car.sender = AsyncSender(lambda snapshot, car=car: self.post(car, snapshot), car.car_label, car.metrics)
+        # The external sinks keep their worker threads; submit() only queues.
+        for sink in self.bridge.sinks:
+            sink.start()
+        misc = loop.create_task(self.mqtt_misc())
+        try:
+            await self.detect_models()
+            if self.bridge.metrics is not None:
+                self.bridge.metrics.start_server()
+            await self.run_schedule()
+        finally:
+            misc.cancel()
+            for car in self.cars:
+                await car.sender.flush(sum(car.session.timeout))
+            if self.http is not None:
+                await self.http.close()
+            self.scheduler.listener = None
+
+    def attach_mqtt(self, loop: asyncio.AbstractEventLoop):
+        """Let the event loop drive paho's socket (now and after reconnects)."""
+        client = self.client
+        loop_thread = threading.get_ident()
+
+        def on_loop(callback: Callable[..., Any], *args: Any):
+            # paho calls these from whichever thread publishes or reconnects,
+            # but only the loop's own thread may touch its selector.
+            if threading.get_ident() == loop_thread:
+                callback(*args)
+            else:
+                loop.call_soon_threadsafe(callback, *args)
+
+        def on_socket_open(client, userdata, sock):
+            on_loop(loop.add_reader, sock, client.loop_read)
+
+        def on_socket_close(client, userdata, sock):
+            on_loop(loop.remove_reader, sock)
+            on_loop(loop.remove_writer, sock)
+
+        def on_socket_register_write(client, userdata, sock):
+            on_loop(loop.add_writer, sock, client.loop_write)
+
+        def on_socket_unregister_write(client, userdata, sock):
+            on_loop(loop.remove_writer, sock)
+
+        client.on_socket_open = on_socket_open
+        client.on_socket_close = on_socket_close
+        client.on_socket_register_write = on_socket_register_write
+        client.on_socket_unregister_write = on_socket_unregister_write
+        # Already connected (connect_mqtt_client): pick up the open socket and
+        # the CONNECT packet still waiting to be written.
+        sock = client.socket()
+        if sock is not None:
+            on_socket_open(client, None, sock)
+            if client.want_write():
+                on_socket_register_write(client, None, sock)
+
+    async def mqtt_misc(self):
+        """paho's periodic housekeeping, and reconnecting when the link drops.
+
+        reconnect() is a blocking TCP (and TLS) connect, so it runs in the
+        executor; the loop keeps serving the other cars meanwhile."""
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN:
+                try:
+                    await loop.run_in_executor(None, self.client.reconnect)
+                except OSError as e:
+                    logging.warning(f"MQTT reconnect failed, retrying: {e}")
+            await asyncio.sleep(self.MISC_INTERVAL)
+
+    async def detect_models(self):
+        """Wait (up to MODEL_DETECTION_TIMEOUT in total) for model data, then
+        detect every car's model, as run() does with blocking waits."""
+        pending = [car for car in self.cars if not car.config.get("CARMODEL")]
+        deadline = monotonic() + MODEL_DETECTION_TIMEOUT
+        while any(not car.model_data_ready.is_set() and not car.model_from_cache for car in pending) \
+                and monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for car in self.cars:
+            if car in pending:
+                # A cached model is revalidated in the background instead.
+                car.detect_car_model(timeout=MODEL_DETECTION_TIMEOUT if car.model_from_cache else 0)
+            else:
+                logging.info(f"Car {car.car_label} model manually set to: {car.config.get('CARMODEL')}.")
+
+    async def run_schedule(self):
+        """run_schedule() on the event loop: tick due keys, then sleep until
+        the next deadline or a wakeup. Exits via SystemExit on a fatal MQTT error."""
+        scheduler = self.scheduler
+        wakeup = self.wakeup
+        for car in self.cars:
+            car.last_send = None
+            scheduler.wake(car)
+        while True:
+            if self.bridge.fatal_error:
+                raise SystemExit(self.bridge.fatal_error)
+            wakeup.clear()
+            for key in scheduler.pop_due(scheduler.clock()):
+                deadline = key.tick()
+                if deadline is not None:
+                    scheduler.schedule(key, deadline)
+            deadline = scheduler.next_deadline()
+            timeout = None if deadline is None else max(0.0, deadline - scheduler.clock())
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def post(self, car: TeslaMateABRP, snapshot: Dict[str, Any]):
+        """Deliver one snapshot for `car` (AsyncSender's deliver callback)."""
+        try:
+            body = car.encoder.encode(snapshot)
+        except Exception as ex:
+            car.handle_post_crash(ex)
+            return
+        accepted = await asyncio.gather(*(self.post_to(car, recipient, snapshot, body)
+                                          for recipient in car.recipients))
+        car.mark_delivered(snapshot, list(accepted))
+
+    async def post_to(self, car: TeslaMateABRP, recipient: ABRPRecipient, snapshot: Dict[str, Any],
+                      body: bytes) -> bool:
+        """POST an encoded snapshot to one of `car`'s ABRP accounts; True if
+        it accepted it. Without aiohttp only the POST goes to the executor;
+        the reply is handled here on the loop either way."""
+        started, posted = perf_counter(), car.scheduler.clock()
+        try:
+            if self.http is None:
+                text = await asyncio.get_running_loop().run_in_executor(
+                    None, self.post_blocking, car, recipient, body)
+            else:
+                async with self.http.post(recipient.url, headers=car.abrp_headers, data=body) as response:
+                    text = await response.text()
+        except self.POST_ERRORS as ex:
+            car.handle_post_failure(snapshot, started, ex, recipient)
+            return False
+        except Exception as ex:
+            car.handle_post_crash(ex, recipient)
+            return False
+        reply = BufferedReply(text)
+        return car.handle_reply(snapshot, started, reply, recipient, posted)
+
+    @staticmethod
+    def post_blocking(car: TeslaMateABRP, recipient: ABRPRecipient, body: bytes) -> str:
+        """POST through the car's requests session and return the reply body."""
+        return car.session.post(recipient.url, headers=car.abrp_headers, data=body).text
+
+
+class BufferedReply(NamedTuple):
+    """An already-read HTTP reply body, with the requests.Response methods
+    handle_reply() uses."""
+    text: str
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+
+## [ Capture and replay ]
+class MessageRecorder:
+    """Record the raw TeslaMate MQTT stream to a compact JSON-lines capture.
+
+    Each line is ``[seconds since capture start, topic, payload]``; payload
+    bytes that aren't valid UTF-8 survive the round trip (surrogateescape).
+    """
+
+    def __init__(self, path: str, clock: Callable[[], float] = monotonic):
+        self.clock = clock
+        self.start = clock()
+        self.lock = threading.Lock()
+        self.file = open(path, "w", encoding="utf-8", buffering=1)
+        self.recorded = 0
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> Optional["MessageRecorder"]:
+        """Open the capture file if CAPTURE_PATH is set, else None."""
+        path = config.get("CAPTURE_PATH")
+        if not path:
+            return None
+        logging.info(f"Recording the MQTT stream to {path}.")
+        return cls(path)
+
+    def wrap(self, on_message: Callable[..., None]) -> Callable[..., None]:
+        """Return an on_message callback that records, then delegates."""
+        def recording_on_message(client, userdata, message):
+            self.record(message.topic, message.payload)
+            on_message(client, userdata, message)
+        return recording_on_message
+
+    def record(self, topic: str, payload: bytes):
+        line = json.dumps(
+            [round(self.clock() - self.start, 3), topic, payload.decode("utf-8", "surrogateescape")],
+            separators=(",", ":"),
+        )
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(line + "\n")
+                self.recorded += 1
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_capture(path: str) -> List[Tuple[float, str, bytes]]:
+    """Load a capture written by MessageRecorder as (time, topic, payload)
+    tuples; unreadable lines are skipped with a warning."""
+    messages = []
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                t, topic, payload = json.loads(line)
+                messages.append((float(t), str(topic), str(payload).encode("utf-8", "surrogateescape")))
+            except (ValueError, TypeError) as e:
+                logging.warning(f"Skipping unreadable capture line {number}: {e}")
+    return messages
+
+
+class OfflineClient:
+    """Stands in for the paho client during replay: always 'connected',
+    status publishes go nowhere."""
+
+    def __init__(self):
+        self.published = 0
+
+    def is_connected(self) -> bool:
+        return True
+
+    def publish(self, topic: str, payload: Any = None, qos: int = 0, retain: bool = False):
+        self.published += 1
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+class MessageReplayer:
+    """Feed a capture back through a bridge's on_message on a virtual clock.
+
+    The bridge's Scheduler runs on the replay clock, and due sends are run in
+    deadline order between messages, so the same capture always yields the
+    same sends at the same (virtual) times. `speed` paces playback against
+    the wall clock (1 = real time, N = N times faster); 0 replays as fast as
+    possible.
+    """
+
+    def __init__(self, bridge: Any, messages: List[Tuple[float, str, bytes]], speed: float = 1.0,
+                 sleep: Callable[[float], None] = sleep):
+        self.bridge = bridge
+        self.messages = messages
+        self.speed = speed
+        self.sleep = sleep
+        self.now = 0.0
+        self.cars: List[TeslaMateABRP] = (
+            list(bridge.cars.values()) if isinstance(bridge, TeslaMateABRPFleet) else [bridge]
+        )
+        # A single-car bridge doesn't route by car number; keep other cars out.
+        self.topic_prefix = (
+            None if isinstance(bridge, TeslaMateABRPFleet) else f"teslamate/cars/{bridge.config.get('CARNUMBER')}/"
+        )
+        bridge.scheduler.clock = lambda: self.now
+
+    def run(self) -> int:
+        """Replay every message, returning how many were delivered."""
+        scheduler = self.bridge.scheduler
+        start = self.messages[0][0] if self.messages else 0.0
+        self._advance(start)
+        for car in self.cars:
+            car.last_send = None
+            scheduler.wake(car)
+        delivered = 0
+        for t, topic, payload in self.messages:
+            if self.topic_prefix is not None and not topic.startswith(self.topic_prefix):
+                continue
+            delivered += 1
+            self._run_due(t)
+            self._advance(t)
+            message = mqtt.MQTTMessage(topic=topic.encode("utf-8"))
+            message.payload = payload
+            self.bridge.on_message(self.bridge.client, None, message)
+            self._detect_models()
+        self._run_due(self.now)
+        return delivered
+
+    def _run_due(self, until: float):
+        """Run every scheduled tick with a deadline at or before `until`."""
+        scheduler = self.bridge.scheduler
+        while True:
+            deadline = scheduler.next_deadline()
+            if deadline is None or deadline > until:
+                return
+            self._advance(max(deadline, self.now))
+            for key in scheduler.pop_due(self.now):
+                next_deadline = key.tick()
+                if next_deadline is not None:
+                    scheduler.schedule(key, next_deadline)
+
+    def _advance(self, t: float):
+        if self.speed > 0 and t > self.now:
+            self.sleep((t - self.now) / self.speed)
+        self.now = t
+
+    def _detect_models(self):
+        for car in self.cars:
+            if not car.config.get("CARMODEL") and not car.data["car_model"] and car.model_data_ready.is_set():
+                car.find_car_model(timeout=0)
+
+
+def replay_capture(config: Dict[str, Any], cars: Optional[list], path: str, speed: float = 1.0) -> int:
+    """Replay a capture file through a broker-less bridge (see MessageReplayer)."""
+    messages = read_capture(path)
+    client = OfflineClient()
+    bridge: Any = TeslaMateABRPFleet(config, cars, client=client) if cars else TeslaMateABRP(config, client=client)
+    logging.info(f"Replaying {len(messages)} messages from {path} at {f'{speed}x' if speed > 0 else 'max'} speed.")
+    started = monotonic()
+    for sink in bridge.sinks:
+        sink.start()
+    try:
+        replayed = MessageReplayer(bridge, messages, speed).run()
+    finally:
+        for sink in bridge.sinks:
+            sink.stop(timeout=sum(bridge.session.timeout))
+        bridge.session.close()
+        if bridge.outbox is not None:
+            bridge.outbox.close()
+    span = messages[-1][0] - messages[0][0] if messages else 0.0
+    logging.info(f"Replayed {replayed} messages ({span:.1f}s of capture) in {monotonic() - started:.1f}s.")
+    return replayed
+
 
 def get_docker_secret(secret_name: str) -> Optional[str]:
     """Read a secret from Docker secrets directory."""
@@ -760,6 +3825,16 @@ def get_docker_secret(secret_name: str) -> Optional[str]:
              help='Car model according to https://api.iternio.com/1/tlm/get_CARMODELs_list')
 @click.option('--status-topic', 'status_topic', envvar='STATUS_TOPIC',
              help='MQTT topic to publish status messages to')
+@click.option('--status-format', 'status_format', type=click.Choice(STATUS_FORMATS), envvar='STATUS_FORMAT',
+             help='Publish status as one topic per field (topics, default) or one JSON document '
+                  'on <status-topic>/state (json)')
+@click.option('--status-qos', 'status_qos', type=click.IntRange(0, 2), envvar='STATUS_QOS',
+             help=f'QoS of status topic messages (default: {DEFAULT_STATUS_QOS})')
+@click.option('--status-retain/--no-status-retain', 'status_retain', default=None,
+             help='Retain status topic messages (default: enabled). Env var STATUS_RETAIN also accepted.')
+@click.option('--status-min-interval', 'status_min_interval', type=float, envvar='STATUS_MIN_INTERVAL',
+             help=f'Publish status at most every N seconds (default: {DEFAULT_STATUS_MIN_INTERVAL} '
+                  f'with --status-format json, no limit for per-field topics)')
 @click.option('-d', '--debug', is_flag=True, envvar='TM2ABRP_DEBUG',
              help='Debug mode (set logging level to DEBUG)')
 @click.option('-a', '--auth', 'use_auth', is_flag=True, envvar='MQTT_AUTH',
@@ -777,10 +3852,76 @@ def get_docker_secret(secret_name: str) -> Optional[str]:
              help=f'Update interval in seconds while charging (default: {DEFAULT_REFRESH_RATE_CHARGING}, min: {MIN_REFRESH_RATE})')
 @click.option('--refresh-parked', 'refresh_parked', type=float, envvar='REFRESH_RATE_PARKED',
              help=f'Update interval in seconds while parked/asleep (default: {DEFAULT_REFRESH_RATE_PARKED}, min: {MIN_REFRESH_RATE})')
+@click.option('--cars-config', 'cars_config', type=click.Path(dir_okay=False), envvar='CARS_CONFIG',
+             help='JSON file listing several cars (car_number, user_token, car_model, refresh_*) '
+                  'to serve from one process over a single MQTT connection')
+@click.option('--http-pool-size', 'http_pool_size', type=int, envvar='HTTP_POOL_SIZE',
+             help=f'Max pooled keep-alive connections to ABRP (default: {DEFAULT_HTTP_POOL_SIZE})')
+@click.option('--http-connect-timeout', 'http_connect_timeout', type=float, envvar='HTTP_CONNECT_TIMEOUT',
+             help=f'ABRP connect timeout in seconds (default: {DEFAULT_HTTP_CONNECT_TIMEOUT})')
+@click.option('--http-read-timeout', 'http_read_timeout', type=float, envvar='HTTP_READ_TIMEOUT',
+             help=f'ABRP read timeout in seconds (default: {DEFAULT_HTTP_READ_TIMEOUT})')
+@click.option('--queue-path', 'queue_path', type=click.Path(dir_okay=False), envvar='QUEUE_PATH',
+             help='SQLite file to queue telemetry ABRP did not receive and replay it later (default: disabled)')
+@click.option('--queue-max-age', 'queue_max_age', type=float, envvar='QUEUE_MAX_AGE',
+             help=f'Drop queued telemetry older than this many seconds (default: {DEFAULT_QUEUE_MAX_AGE})')
+@click.option('--queue-max-size', 'queue_max_size', type=int, envvar='QUEUE_MAX_SIZE',
+             help=f'Max queued updates, oldest dropped first (default: {DEFAULT_QUEUE_MAX_SIZE})')
+@click.option('--state-cache', 'state_cache_path', type=click.Path(dir_okay=False), envvar='STATE_CACHE_PATH',
+             help='File to keep the last known state in, so a restart resumes from it (default: disabled)')
+@click.option('--queue-drain-rate', 'queue_drain_rate', type=float, envvar='QUEUE_DRAIN_RATE',
+             help=f'Queued updates replayed per second once ABRP is back (default: {DEFAULT_QUEUE_DRAIN_RATE})')
+@click.option('--suppress-unchanged', 'suppress_unchanged', is_flag=True, envvar='SUPPRESS_UNCHANGED',
+             help='Skip sends that carry no meaningful change (see --deadbands, --send-keepalive)')
+@click.option('--deadbands', 'deadbands', envvar='DEADBANDS',
+             help='Per-field change thresholds as field=value,... (position in meters), '
+                  'e.g. "soc=1,ext_temp=0.5,position=25"')
+@click.option('--send-keepalive', 'send_keepalive', type=float, envvar='SEND_KEEPALIVE',
+             help=f'With --suppress-unchanged, still send at least every N seconds (default: {DEFAULT_SEND_KEEPALIVE})')
+@click.option('--adaptive-driving', 'adaptive_driving', is_flag=True, envvar='ADAPTIVE_DRIVING',
+             help='Adapt the driving send rate to heading, speed, power and distance (see --motion-thresholds)')
+@click.option('--motion-thresholds', 'motion_thresholds', envvar='MOTION_THRESHOLDS',
+             help='With --adaptive-driving, changes that trigger an early send as name=value,... '
+                  '(heading in degrees, speed in km/h, power in kW, distance in meters), '
+                  'e.g. "heading=15,speed=15,power=25,distance=250"')
+@click.option('--adaptive-max-interval', 'adaptive_max_interval', type=float, envvar='ADAPTIVE_MAX_INTERVAL',
+             help=f'With --adaptive-driving, longest driving send interval on steady stretches (default: {DEFAULT_ADAPTIVE_MAX_INTERVAL})')
+@click.option('--abrp-url', 'abrp_url', envvar='ABRP_URL',
+             help=f'ABRP telemetry endpoint, e.g. a local stand-in for testing (default: {ABRP_API_URL})')
+@click.option('--sink', 'sinks', multiple=True, envvar='SINKS',
+             help='Also send every update to webhook:URL (JSON), influx:URL (line protocol) or jsonl:PATH; '
+                  'repeatable (SINKS: space-separated)')
+@click.option('--sink-batch-size', 'sink_batch_size', type=int, envvar='SINK_BATCH_SIZE',
+             help=f'Max records per sink write (default: {DEFAULT_SINK_BATCH_SIZE})')
+@click.option('--sink-flush-interval', 'sink_flush_interval', type=float, envvar='SINK_FLUSH_INTERVAL',
+             help=f'Write queued sink records at least every N seconds (default: {DEFAULT_SINK_FLUSH_INTERVAL})')
+@click.option('--field-ttls', 'field_ttls', envvar='FIELD_TTLS',
+             help='Leave a field out of updates once its last MQTT message is older than N seconds, '
+                  'as field=seconds,... e.g. "speed=120,power=120,heading=600"')
+@click.option('--capture', 'capture_path', type=click.Path(dir_okay=False), envvar='CAPTURE_PATH',
+             help='Record the raw TeslaMate MQTT stream to this file for later --replay')
+@click.option('--replay', 'replay_path', type=click.Path(exists=True, dir_okay=False), envvar='REPLAY_PATH',
+             help='Replay a --capture file instead of connecting to MQTT (no broker needed)')
+@click.option('--replay-speed', 'replay_speed', type=float, default=1.0, envvar='REPLAY_SPEED',
+             help='Replay speed: 1 = real time, N = N times faster, 0 = as fast as possible (default: 1)')
+@click.option('--asyncio', 'async_runtime', is_flag=True, envvar='ASYNC_RUNTIME',
+             help='Run MQTT, scheduling and ABRP POSTs on one asyncio event loop (uses aiohttp if installed)')
+@click.option('--metrics-port', 'metrics_port', type=int, envvar='METRICS_PORT',
+             help='Serve Prometheus metrics at http://<bind>:<port>/metrics (default: disabled)')
+@click.option('--metrics-bind', 'metrics_bind', envvar='METRICS_BIND',
+             help=f'Address the metrics endpoint listens on (default: {DEFAULT_METRICS_BIND})')
 
 def main(user_token, car_number, mqtt_server, mqtt_username, mqtt_password, mqtt_port,
          car_model, status_topic, debug, use_auth, use_tls, verify_cert, skip_location,
-         refresh_driving, refresh_charging, refresh_parked):
+         refresh_driving, refresh_charging, refresh_parked, cars_config=None,
+         http_pool_size=None, http_connect_timeout=None, http_read_timeout=None,
+         queue_path=None, queue_max_age=None, queue_max_size=None, queue_drain_rate=None,
+         suppress_unchanged=False, deadbands=None, send_keepalive=None,
+         adaptive_driving=False, motion_thresholds=None, adaptive_max_interval=None,
+         metrics_port=None, metrics_bind=None, abrp_url=None, capture_path=None,
+         replay_path=None, replay_speed=1.0, async_runtime=False, status_format=None,
+         status_qos=None, status_retain=None, status_min_interval=None, state_cache_path=None,
+         sinks=(), sink_batch_size=None, sink_flush_interval=None, field_ttls=None):
     """teslamate-abrp
 
     A slightly convoluted way of getting your vehicle data from TeslaMate to A Better Route Planner.
@@ -823,14 +3964,43 @@ def main(user_token, car_number, mqtt_server, mqtt_username, mqtt_password, mqtt
             logging.debug("Automatically enabling MQTT authentication due to password from Docker secret")
 
     # Required arguments checks with better error messages
-    if not mqtt_server:
+    if not mqtt_server and not replay_path:
         click.echo("Error: MQTT server address not supplied. Please supply through environment variables or CLI argument.")
         sys.exit(1)
 
-    if not user_token:
+    # Multi-car mode: per-car tokens come from the cars config file, with the
+    # global USER_TOKEN as a fallback for entries that don't set their own.
+    cars = None
+    if cars_config:
+        try:
+            cars = load_fleet_config(cars_config)
+        except ValueError as e:
+            click.echo(f"Error: {e}")
+            sys.exit(1)
+        for car in cars:
+            car.setdefault("USERTOKEN", user_token)
+            if not car["USERTOKEN"]:
+                click.echo(f"Error: No user token for car {car['CARNUMBER']}. Set user_token in the cars config or USER_TOKEN.")
+                sys.exit(1)
+    elif not user_token:
         click.echo("Error: User token not supplied. Please generate it through ABRP and supply through environment variables or CLI argument.")
         sys.exit(1)
 
+    # Several tokens (comma-separated, optionally label=token) share one car.
+    for tokens in [car["USERTOKEN"] for car in cars] if cars else [user_token]:
+        try:
+            parse_user_tokens(tokens)
+        except ValueError as e:
+            click.echo(f"Error: {e}")
+            sys.exit(1)
+
+    for spec in sinks:
+        try:
+            parse_sink_spec(spec)
+        except ValueError as e:
+            click.echo(f"Error: {e}")
+            sys.exit(1)
+
     # Set up configuration dict
     config["MQTTSERVER"] = mqtt_server
     config["USERTOKEN"] = user_token
@@ -856,6 +4026,11 @@ def main(user_token, car_number, mqtt_server, mqtt_username, mqtt_password, mqtt
     config["MQTT_VERIFY_CERT"] = verify_cert
     config["CARMODEL"] = car_model
     config["BASETOPIC"] = status_topic
+    config["STATUS_FORMAT"] = status_format
+    config["STATUS_QOS"] = status_qos
+    # Same precedence as --verify-cert: the flag, then the env var.
+    config["STATUS_RETAIN"] = parse_bool_env('STATUS_RETAIN', True) if status_retain is None else status_retain
+    config["STATUS_MIN_INTERVAL"] = status_min_interval
     config["SKIPLOCATION"] = skip_location
     config["DEBUG"] = debug
 
@@ -864,6 +4039,47 @@ def main(user_token, car_number, mqtt_server, mqtt_username, mqtt_password, mqtt
     config["REFRESH_RATE_CHARGING"] = refresh_charging
     config["REFRESH_RATE_PARKED"] = refresh_parked
 
+    # ABRP HTTP session tuning (validated with fallback to defaults in ABRPSession)
+    config["HTTP_POOL_SIZE"] = http_pool_size
+    config["HTTP_CONNECT_TIMEOUT"] = http_connect_timeout
+    config["HTTP_READ_TIMEOUT"] = http_read_timeout
+
+    # Store-and-forward queue (disabled unless a path is given)
+    config["QUEUE_PATH"] = queue_path
+    config["QUEUE_MAX_AGE"] = queue_max_age
+    config["QUEUE_MAX_SIZE"] = queue_max_size
+    config["QUEUE_DRAIN_RATE"] = queue_drain_rate
+
+    # Warm-restart state cache (disabled unless a path is given)
+    config["STATE_CACHE_PATH"] = state_cache_path
+
+    # Change-detection send suppression (off unless enabled)
+    config["SUPPRESS_UNCHANGED"] = suppress_unchanged
+    config["DEADBANDS"] = deadbands
+    config["SEND_KEEPALIVE"] = send_keepalive
+
+    # Motion-adaptive driving rate (off unless enabled)
+    config["ADAPTIVE_DRIVING"] = adaptive_driving
+    config["MOTION_THRESHOLDS"] = motion_thresholds
+    config["ADAPTIVE_MAX_INTERVAL"] = adaptive_max_interval
+
+    # Prometheus metrics endpoint (disabled unless a port is given)
+    config["METRICS_PORT"] = metrics_port
+    config["METRICS_BIND"] = metrics_bind
+
+    # Extra telemetry sinks (none unless given)
+    config["SINKS"] = list(sinks)
+    config["SINK_BATCH_SIZE"] = sink_batch_size
+    config["SINK_FLUSH_INTERVAL"] = sink_flush_interval
+
+    # Per-field staleness TTLs (none unless given)
+    config["FIELD_TTLS"] = field_ttls
+
+    # Endpoint override and capture/replay tooling
+    config["ABRP_URL"] = abrp_url
+    config["CAPTURE_PATH"] = capture_path
+    config["ASYNC_RUNTIME"] = async_runtime
+
     # Optional ABRP application-key override (Docker secret or env var); falls
     # back to the shared default inside TeslaMateABRP. Not a per-user secret.
     config["APIKEY"] = get_docker_secret('ABRP_API_KEY') or os.environ.get('ABRP_API_KEY')
@@ -884,8 +4100,18 @@ def main(user_token, car_number, mqtt_server, mqtt_username, mqtt_password, mqtt
 
     # Run the application
     try:
-        teslamate_abrp = TeslaMateABRP(config)
-        teslamate_abrp.run()
+        if replay_path:
+            replay_capture(config, cars, replay_path, replay_speed)
+            return
+        if cars:
+            logging.info(f"Multi-car mode: serving cars {', '.join(car['CARNUMBER'] for car in cars)}.")
+            teslamate_abrp = TeslaMateABRPFleet(config, cars)
+        else:
+            teslamate_abrp = TeslaMateABRP(config)
+        if async_runtime:
+            AsyncRuntime(teslamate_abrp).run()
+        else:
+            teslamate_abrp.run()
     except KeyboardInterrupt:
         logging.info("Program terminated by user")
         sys.exit(0)
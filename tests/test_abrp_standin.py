@@ -0,0 +1,124 @@
+import json
+import pytest
+import requests
+from unittest.mock import patch
+from teslamate_mqtt2abrp import ABRPSession, TeslaMateABRP, token_key
+from tools.abrp_standin import ABRPStandin, parse_latency
+
+
+@pytest.fixture
+def standin_factory():
+    """Start stand-ins on ephemeral ports and close them after the test."""
+    started = []
+    def start(**kwargs):
+        standin = ABRPStandin(port=0, seed=1, **kwargs).start()
+        started.append(standin)
+        return standin
+    yield start
+    for standin in started:
+        standin.close()
+
+def _post(standin, session=None, token="tok"):
+    session = session or ABRPSession()
+    return session.post(f"{standin.url}?token={token}", json={"tlm": {"soc": 80}})
+
+# [ Latency specs ]
+def test_parse_latency():
+    import random
+    rng = random.Random(0)
+    assert parse_latency(None)(rng) == 0.0
+    assert parse_latency("0.25")(rng) == 0.25
+    assert all(0.1 <= parse_latency("uniform:0.1:0.2")(rng) <= 0.2 for _ in range(50))
+    assert all(parse_latency("normal:0:1")(rng) >= 0 for _ in range(50))
+    assert parse_latency("exp:0.5")(rng) >= 0
+    for bad in ("-1", "uniform:2:1", "gamma:1", "exp:0", "normal:1"):
+        with pytest.raises(ValueError):
+            parse_latency(bad)
+
+def test_rates_are_validated():
+    with pytest.raises(ValueError):
+        ABRPStandin(port=0, error_rate=0.6, reset_rate=0.6)
+    with pytest.raises(ValueError):
+        ABRPStandin(port=0, reject_rate=-0.1)
+
+# [ Endpoint behavior ]
+def test_accepts_and_records_payloads(standin_factory, tmp_path):
+    record = tmp_path / "received.jsonl"
+    standin = standin_factory(record_path=str(record))
+    session = ABRPSession()
+    for _ in range(3):
+        assert _post(standin, session).json() == {"status": "ok"}
+    # Keep-alive: three POSTs over one pooled connection.
+    assert session.stats() == {"connections": 1, "requests": 3, "reused": 2}
+    assert standin.stats() == {"requests": 3, "outcomes": {"ok": 3}}
+    assert standin.received[0]["tlm"] == {"soc": 80} and standin.received[0]["token_key"] == token_key("tok")
+    standin.close()
+    assert len(record.read_text().splitlines()) == 3
+    assert '"tok"' not in record.read_text()
+
+def test_request_log_hides_the_token(standin_factory, caplog):
+    import logging
+    standin = standin_factory()
+    with caplog.at_level(logging.DEBUG):
+        _post(standin, token="secret-tok")
+    # Only the stand-in's own lines (requests' urllib3 logs the client side).
+    lines = [r.getMessage() for r in caplog.records if r.name == "root"]
+    assert any("token=***" in line for line in lines) and not any("secret-tok" in line for line in lines)
+
+def test_missing_token_is_rejected(standin_factory):
+    standin = standin_factory()
+    assert _post(standin, token="").json()["status"] == "error"
+
+@pytest.mark.parametrize("fault, check", [
+    ("error_rate", lambda r: r.status_code == 500 and r.json()["status"] == "error"),
+    ("reject_rate", lambda r: r.status_code == 200 and r.json()["status"] == "error"),
+    ("non_json_rate", lambda r: r.status_code == 502 and r.headers["Content-Type"] == "text/html"),
+])
+def test_injected_replies(standin_factory, fault, check):
+    standin = standin_factory(**{fault: 1.0})
+    assert check(_post(standin))
+
+def test_injected_connection_reset(standin_factory):
+    standin = standin_factory(reset_rate=1.0)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        _post(standin)
+    assert standin.stats()["outcomes"] == {"reset": 1}
+
+def test_fault_sequence_is_reproducible():
+    """The same seed draws the same outcomes."""
+    draws = []
+    for _ in range(2):
+        standin = ABRPStandin(port=0, seed=7, error_rate=0.3, reject_rate=0.3, latency="uniform:0:1")
+        draws.append([standin.draw() for _ in range(20)])
+        standin.close()
+    assert draws[0] == draws[1]
+    assert {outcome for _, outcome in draws[0]} == {"ok", "error", "reject"}
+
+def test_stats_endpoint(standin_factory):
+    standin = standin_factory()
+    _post(standin)
+    stats_url = standin.url.replace("/1/tlm/send", "/_standin/stats")
+    assert requests.get(stats_url, timeout=5).json() == {"requests": 1, "outcomes": {"ok": 1}}
+
+# [ Bridge against the stand-in ]
+def _bridge(url, **config):
+    config = {"USERTOKEN": "tok", "CARNUMBER": "1", "BASETOPIC": None, "ABRP_URL": url, **config}
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        return TeslaMateABRP(config)
+
+def test_bridge_sends_real_http(standin_factory):
+    standin = standin_factory()
+    abrp = _bridge(standin.url)
+    abrp.data["soc"] = 64
+    abrp.update_abrp()
+    assert standin.received[0]["tlm"]["soc"] == 64
+    assert json.dumps(standin.received[0]["tlm"])  # a full, JSON-clean payload
+
+def test_slow_abrp_hits_the_read_timeout(standin_factory):
+    """A reply slower than HTTP_READ_TIMEOUT surfaces as a failed send (queued
+    if queueing is on) instead of hanging the bridge."""
+    standin = standin_factory(latency="0.5")
+    abrp = _bridge(standin.url, HTTP_READ_TIMEOUT=0.1)
+    with patch.object(abrp, 'queue_unsent') as mock_queue:
+        abrp.update_abrp()
+    mock_queue.assert_called_once()
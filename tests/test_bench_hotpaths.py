@@ -0,0 +1,31 @@
+import json
+from click.testing import CliRunner
+from tools.bench_hotpaths import compare, main, run_suite, simulate_day
+
+
+def test_suite_covers_every_hot_path():
+    report = run_suite(ops=50, repeat=1)
+    names = set(report["results"])
+    assert {"on_message[drive]", "publish_to_mqtt[unchanged]", "publish_to_mqtt[driving]",
+            "update_abrp[parked]", "update_abrp[driving]", "handle_parked_state",
+            "scheduler_tick[day]", "process_message[latitude]"} <= names
+    assert all(result["us_per_op"] > 0 for result in report["results"].values())
+    assert report["results"]["publish_to_mqtt[unchanged]"]["publishes_per_op"] < 1
+    json.dumps(report)
+
+def test_simulated_day_sends_at_each_states_rate():
+    _, ticks, posts = simulate_day([(0, "driving"), (3600, "asleep")])
+    # An hour of driving every 2.5s, then 23 hours every 30s.
+    assert posts == ticks and abs(posts - (1440 + 23 * 120)) <= 2
+
+def test_compare_flags_regressions(tmp_path):
+    baseline = {"results": {"a": {"us_per_op": 1.0}, "b": {"us_per_op": 2.0}}}
+    current = {"results": {"a": {"us_per_op": 1.5}, "b": {"us_per_op": 2.1}, "c": {"us_per_op": 9.0}}}
+    assert compare(current, baseline, 0.2) == [("a", 1.0, 1.5, True), ("b", 2.0, 2.1, False)]
+    path = tmp_path / "bench.json"
+    runner = CliRunner()
+    result = runner.invoke(main, ["--ops", "20", "--repeat", "1", "--only", "handle_parked", "--output", str(path)])
+    assert result.exit_code == 0 and "handle_parked_state" in json.loads(path.read_text())["results"]
+    path.write_text(json.dumps({"results": {"handle_parked_state": {"us_per_op": 1e-6}}}))
+    result = runner.invoke(main, ["--ops", "20", "--repeat", "1", "--only", "handle_parked", "--compare", str(path)])
+    assert result.exit_code == 1 and "REGRESSION" in result.output
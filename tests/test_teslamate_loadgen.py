@@ -0,0 +1,50 @@
+import itertools
+import pytest
+from teslamate_mqtt2abrp import supported_topics
+from tools.teslamate_loadgen import LoadGenerator, MALFORMED_PAYLOADS, parse_broker, percentiles, run_direct
+
+
+def _take(generator, count):
+    return list(itertools.islice(generator.messages(), count))
+
+# [ Message stream ]
+def test_stream_starts_with_a_retained_storm_of_known_topics():
+    generator = LoadGenerator(cars=2, profile="drive", seed=1)
+    storm = len(supported_topics()) * 2
+    messages = _take(generator, storm + 50)
+    assert all(m.retain for m in messages[:storm]) and not any(m.retain for m in messages[storm:])
+    assert {m.topic.split("/")[-1] for m in messages[:storm]} == set(supported_topics())
+    assert {m.car for m in messages} == {"1", "2"}
+    assert {m.topic.split("/")[-1] for m in messages} <= set(supported_topics())
+
+@pytest.mark.parametrize("profile", ["drive", "charge", "sleep"])
+def test_markers_only_grow(profile):
+    generator = LoadGenerator(cars=1, profile=profile, seed=2)
+    markers = [m.marker for m in _take(generator, 300) if m.marker is not None and not m.retain]
+    assert markers and markers == sorted(markers) and len(set(markers)) == len(markers)
+
+def test_malformed_payloads_and_repeated_storms():
+    generator = LoadGenerator(cars=1, profile="drive", malformed_rate=0.5, storm_every=100, seed=3)
+    messages = _take(generator, 1000)
+    assert 300 < generator.malformed < 700
+    assert {m.payload for m in messages} >= set(MALFORMED_PAYLOADS)
+    assert all(m.marker is None for m in messages if m.payload in MALFORMED_PAYLOADS)
+    assert generator.storms > 1
+
+def test_parse_broker_and_percentiles():
+    assert parse_broker("broker.local") == ("broker.local", 1883)
+    assert parse_broker("10.0.0.2:8883") == ("10.0.0.2", 8883)
+    with pytest.raises(ValueError):
+        parse_broker("host:port")
+    assert percentiles([0.001] * 99 + [0.5])["p50"] == 1.0
+    assert percentiles([])["max"] is None
+
+# [ Direct mode ]
+def test_direct_run_feeds_a_real_bridge():
+    """A short, unpaced run through on_message reaches the ABRP stand-in and
+    times the whole pipeline."""
+    generator = LoadGenerator(cars=1, profile="drive", malformed_rate=0.05, seed=4)
+    results = run_direct(generator, "drive", rate=0, duration=0.5, bridge_config={"REFRESH_RATE_DRIVING": 1})
+    assert results["messages"] > 100 and results["abrp_posts"] >= 1
+    assert results["on_message_ms"]["p50"] is not None
+    assert results["pipeline_ms"]["max"] is not None
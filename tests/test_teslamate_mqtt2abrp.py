@@ -6,11 +6,13 @@ import sys
 from unittest.mock import patch, MagicMock, mock_open
 from teslamate_mqtt2abrp import (
     TeslaMateABRP,
+    TelemetryData,
     APIKEY,
     DEFAULT_MQTT_PORT,
     DEFAULT_REFRESH_RATE_DRIVING,
     DEFAULT_REFRESH_RATE_CHARGING,
     DEFAULT_REFRESH_RATE_PARKED,
+    HAS_ORJSON,
     validate_refresh_rate,
     main,
 )
@@ -21,7 +23,15 @@ _MAIN_DEFAULTS = dict(
     mqtt_username=None, mqtt_password=None, mqtt_port=None, car_model=None,
     status_topic=None, debug=False, use_auth=False, use_tls=False,
     skip_location=False, verify_cert=True, refresh_driving=None,
-    refresh_charging=None, refresh_parked=None,
+    refresh_charging=None, refresh_parked=None, cars_config=None,
+    http_pool_size=None, http_connect_timeout=None, http_read_timeout=None,
+    queue_path=None, queue_max_age=None, queue_max_size=None, queue_drain_rate=None,
+    suppress_unchanged=False, deadbands=None, send_keepalive=None,
+    adaptive_driving=False, motion_thresholds=None, adaptive_max_interval=None,
+    metrics_port=None, metrics_bind=None, abrp_url=None, capture_path=None,
+    replay_path=None, replay_speed=1.0, async_runtime=False, status_format=None,
+    status_qos=None, status_retain=None, status_min_interval=None, state_cache_path=None,
+    sinks=(), sink_batch_size=None, sink_flush_interval=None, field_ttls=None,
 )
 
 
@@ -208,7 +218,7 @@ def test_find_car_model_falls_back_to_timeout(teslamate_abrp):
     assert teslamate_abrp.data["car_model"] == "3long_awd"
 
 def test_update_abrp(teslamate_abrp):
-    with patch('requests.post') as mock_post:
+    with patch('requests.Session.post') as mock_post:
         # Setup mock response
         mock_response = MagicMock()
         mock_response.json.return_value = {"status": "ok"}
@@ -223,8 +233,9 @@ def test_update_abrp(teslamate_abrp):
         assert "https://api.iternio.com/1/tlm/send" in args[0]
         assert "token=test-token" in args[0]
         assert kwargs["headers"]["Authorization"].startswith("APIKEY ")
-        assert "tlm" in kwargs["json"]
-        assert kwargs["timeout"] == 10
+        assert kwargs["headers"]["Content-Type"] == "application/json"
+        assert "tlm" in json.loads(kwargs["data"])
+        assert kwargs["timeout"] == (5.0, 10.0)
         
         # Test error handling
         mock_response.json.return_value = {"status": "error"}
@@ -266,9 +277,10 @@ def test_on_connect_without_base_topic(teslamate_abrp):
     
     teslamate_abrp.on_connect(client_mock, None, None, 0, None)
     
-    # Should only subscribe, not publish online status
-    client_mock.subscribe.assert_called_once_with("teslamate/cars/1/#")
-    client_mock.publish.assert_not_called()
+    # Should only subscribe (and send the bootstrap sentinel), not publish online status
+    sentinel = (teslamate_abrp.sentinel_topic, 0)
+    client_mock.subscribe.assert_called_once_with(teslamate_abrp.subscriptions() + [sentinel])
+    client_mock.publish.assert_called_once_with(teslamate_abrp.sentinel_topic, payload="", qos=0, retain=False)
 
 def test_on_connect_with_base_topic(teslamate_abrp_with_topic):
     client_mock = MagicMock()
@@ -276,8 +288,9 @@ def test_on_connect_with_base_topic(teslamate_abrp_with_topic):
     teslamate_abrp_with_topic.on_connect(client_mock, None, None, 0, None)
     
     # Should subscribe and publish online status
-    client_mock.subscribe.assert_called_once_with("teslamate/cars/1/#")
-    client_mock.publish.assert_called_once_with(
+    sentinel = (teslamate_abrp_with_topic.sentinel_topic, 0)
+    client_mock.subscribe.assert_called_once_with(teslamate_abrp_with_topic.subscriptions() + [sentinel])
+    client_mock.publish.assert_any_call(
         "tesla/abrp/status/_tm2abrp_status", 
         payload="online",
         qos=2,
@@ -306,7 +319,7 @@ def test_init(mock_args):
         assert abrp.prev_state == ""
         assert abrp.charger_phases == 1
         assert abrp.prefix == "_tm2abrp"
-        assert isinstance(abrp.data, dict)
+        assert isinstance(abrp.data, TelemetryData)
         assert "utc" in abrp.data
         assert "soc" in abrp.data
         assert "power" in abrp.data
@@ -516,10 +529,10 @@ def test_update_timely():
     abrp, mock_update, mock_publish, times = _run_state_loop(
         "online", duration=12.0, REFRESH_RATE_PARKED=5,
     )
-    # Parked sends at 0.5, 5.5, 10.5 over 12s.
+    # Parked sends at 0, 5, 10 over 12s.
     assert mock_update.call_count == 3
     assert all(iv == 5.0 for iv in _intervals(times))
-    # handle_parked_state ran every tick, keeping power/speed zeroed.
+    # handle_parked_state ran before every send, keeping power/speed zeroed.
     assert abrp.data["power"] == 0.0
     assert abrp.data["speed"] == 0
     # No base topic configured -> nothing published to MQTT.
@@ -714,7 +727,7 @@ def test_update_timely_comprehensive():
         "charging", duration=0.9, prev_state="driving", REFRESH_RATE_CHARGING=6,
     )
     assert mock_update.call_count == 1
-    assert times == [0.5]
+    assert times == [0.0]
 
 def test_setup_mqtt_client_comprehensive(mock_args):
     """Test all branches of setup_mqtt_client"""
@@ -854,7 +867,7 @@ def test_update_abrp_comprehensive(teslamate_abrp):
     import json
     
     # Test successful update
-    with patch('requests.post') as mock_post:
+    with patch('requests.Session.post') as mock_post:
         mock_response = MagicMock()
         mock_response.json.return_value = {"status": "ok"}
         mock_post.return_value = mock_response
@@ -864,7 +877,7 @@ def test_update_abrp_comprehensive(teslamate_abrp):
         mock_post.assert_called_once()
     
     # Test with JSON parsing error
-    with patch('requests.post') as mock_post:
+    with patch('requests.Session.post') as mock_post:
         mock_response = MagicMock()
         mock_response.json.side_effect = json.JSONDecodeError("Test error", "", 0)
         mock_post.return_value = mock_response
@@ -872,7 +885,7 @@ def test_update_abrp_comprehensive(teslamate_abrp):
         teslamate_abrp.update_abrp()  # Should not raise
     
     # Test with missing 'status' in response
-    with patch('requests.post') as mock_post:
+    with patch('requests.Session.post') as mock_post:
         mock_response = MagicMock()
         mock_response.json.return_value = {"not_status": "value"}
         mock_post.return_value = mock_response
@@ -880,13 +893,13 @@ def test_update_abrp_comprehensive(teslamate_abrp):
         teslamate_abrp.update_abrp()  # Should not raise
     
     # Test with connection error
-    with patch('requests.post') as mock_post:
+    with patch('requests.Session.post') as mock_post:
         mock_post.side_effect = requests.RequestException("Connection error")
         
         teslamate_abrp.update_abrp()  # Should not raise
     
     # Test with unexpected exception
-    with patch('requests.post') as mock_post:
+    with patch('requests.Session.post') as mock_post:
         mock_post.side_effect = Exception("Unexpected error")
         
         teslamate_abrp.update_abrp()  # Should not raise
@@ -894,7 +907,7 @@ def test_update_abrp_comprehensive(teslamate_abrp):
 def test_update_abrp_with_base_topic(teslamate_abrp_with_topic):
     """Test update_abrp with base_topic set"""
     # Test successful update
-    with patch('requests.post') as mock_post:
+    with patch('requests.Session.post') as mock_post:
         mock_response = MagicMock()
         mock_response.json.return_value = {"status": "ok"}
         mock_post.return_value = mock_response
@@ -1051,13 +1064,28 @@ def test_refresh_rates_invalid_config_falls_back(mock_args):
         assert abrp.refresh_rate_charging == DEFAULT_REFRESH_RATE_CHARGING
         assert abrp.refresh_rate_parked == DEFAULT_REFRESH_RATE_PARKED
 
+def _fake_clock(scheduler, duration):
+    """Put a scheduler on a virtual clock: each wait advances time straight to
+    the next deadline (KeyboardInterrupt once `duration` is reached, or when
+    nothing is scheduled). Returns the clock dict ({"t": now})."""
+    clock = {"t": 0.0}
+    def fake_wait(timeout):
+        if timeout is None:
+            raise KeyboardInterrupt()
+        clock["t"] = round(clock["t"] + timeout, 6)
+        if clock["t"] >= duration:
+            raise KeyboardInterrupt()
+    scheduler.clock = lambda: clock["t"]
+    scheduler._wait = fake_wait
+    return clock
+
 def _run_state_loop(state, duration, base_topic=None, prev_state=None, **rate_overrides):
     """Drive the REAL update_timely loop in a given state for `duration` seconds
-    of simulated wall-clock time.
+    of simulated time.
 
-    Both sleep() and monotonic() are patched onto a shared fake clock that each
-    sleep advances by the real REFRESH_TICK, so the actual wall-clock scheduler
-    runs deterministically and instantly. update_abrp/publish_to_mqtt are mocked.
+    The Scheduler runs on a virtual clock (see _fake_clock), so the actual
+    deadline scheduling runs deterministically and instantly.
+    update_abrp/publish_to_mqtt are mocked.
 
     Returns (abrp, mock_update_abrp, mock_publish_to_mqtt, send_times), where
     send_times holds the fake-clock time of each ABRP update.
@@ -1076,24 +1104,15 @@ def _run_state_loop(state, duration, base_topic=None, prev_state=None, **rate_ov
     # the steady-state cadence can be asserted; pass prev_state to exercise it.
     abrp.prev_state = state if prev_state is None else prev_state
 
-    clock = {"t": 0.0}
-    def fake_sleep(dt):
-        clock["t"] = round(clock["t"] + dt, 6)
-        if clock["t"] > duration:
-            raise KeyboardInterrupt()
-    def fake_monotonic():
-        return clock["t"]
-
+    clock = _fake_clock(abrp.scheduler, duration)
     send_times = []
-    with patch('teslamate_mqtt2abrp.sleep', side_effect=fake_sleep):
-        with patch('teslamate_mqtt2abrp.monotonic', side_effect=fake_monotonic):
-            with patch.object(abrp, 'update_abrp',
-                              side_effect=lambda: send_times.append(clock["t"])) as mock_update:
-                with patch.object(abrp, 'publish_to_mqtt') as mock_publish:
-                    try:
-                        abrp.update_timely()
-                    except KeyboardInterrupt:
-                        pass
+    with patch.object(abrp, 'update_abrp',
+                      side_effect=lambda: send_times.append(clock["t"])) as mock_update:
+        with patch.object(abrp, 'publish_to_mqtt') as mock_publish:
+            try:
+                abrp.update_timely()
+            except KeyboardInterrupt:
+                pass
     return abrp, mock_update, mock_publish, send_times
 
 def _intervals(times):
@@ -1124,7 +1143,7 @@ def test_update_timely_fractional_rate_no_drift():
     """Stability guarantee: a fractional rate stays exactly spaced over a long
     run (intervals never drift)."""
     _, _, _, times = _run_state_loop("driving", duration=250.0, REFRESH_RATE_DRIVING=2.5)
-    assert len(times) == 100  # 0.5, 3.0, ... 248.0
+    assert len(times) == 100  # 0.0, 2.5, ... 247.5
     assert all(iv == 2.5 for iv in _intervals(times))
 
 def test_update_timely_min_rate_guard():
@@ -1138,9 +1157,8 @@ def test_update_timely_exits_on_fatal_error(teslamate_abrp):
     """A fatal MQTT error flagged from the callback thread makes the main loop
     raise SystemExit (so the process actually terminates)."""
     teslamate_abrp.fatal_error = "MQTT Authentication failed."
-    with patch('teslamate_mqtt2abrp.sleep'):
-        with pytest.raises(SystemExit):
-            teslamate_abrp.update_timely()
+    with pytest.raises(SystemExit):
+        teslamate_abrp.update_timely()
 
 @pytest.mark.parametrize("reason_code", [2, 3, 4, 5])
 def test_on_connect_failure_sets_fatal_error_without_exit(teslamate_abrp, reason_code):
@@ -1156,7 +1174,20 @@ def test_on_connect_success_subscribes(teslamate_abrp):
     client_mock = MagicMock()
     teslamate_abrp.on_connect(client_mock, None, None, 0, None)
     assert teslamate_abrp.fatal_error is None
-    client_mock.subscribe.assert_called_once_with("teslamate/cars/1/#")
+    client_mock.subscribe.assert_called_once_with(teslamate_abrp.subscriptions() + [(teslamate_abrp.sentinel_topic, 0)])
+
+def test_subscriptions_cover_handled_topics(mock_args):
+    """One (topic, QoS 0) pair per handled topic; no location with SKIPLOCATION."""
+    from teslamate_mqtt2abrp import supported_topics
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(mock_args)
+        private = TeslaMateABRP({**mock_args, "SKIPLOCATION": True})
+    topics = abrp.subscriptions()
+    assert topics == [(f"teslamate/cars/1/{name}", 0) for name in supported_topics()]
+    assert ("teslamate/cars/1/state", 0) in topics and ("teslamate/cars/1/latitude", 0) in topics
+    assert [t for t in topics if t not in private.subscriptions()] == [
+        ("teslamate/cars/1/latitude", 0), ("teslamate/cars/1/longitude", 0)
+    ]
 
 def test_parse_bool_env_fail_secure(monkeypatch):
     """parse_bool_env returns the default for unset/invalid values and parses
@@ -1186,14 +1217,14 @@ def test_redact_secrets_strips_token():
 def test_update_abrp_skips_when_mqtt_disconnected(teslamate_abrp):
     """While the MQTT link is down, update_abrp must NOT POST stale telemetry."""
     teslamate_abrp.client.is_connected.return_value = False
-    with patch('requests.post') as mock_post:
+    with patch('requests.Session.post') as mock_post:
         teslamate_abrp.update_abrp()
         mock_post.assert_not_called()
 
 def test_update_abrp_sends_when_mqtt_connected(teslamate_abrp):
     """Sanity check: update_abrp still POSTs when the MQTT link is up."""
     teslamate_abrp.client.is_connected.return_value = True
-    with patch('requests.post') as mock_post:
+    with patch('requests.Session.post') as mock_post:
         mock_post.return_value.json.return_value = {"status": "ok"}
         teslamate_abrp.update_abrp()
         mock_post.assert_called_once()
@@ -1214,7 +1245,7 @@ def test_update_abrp_success_log_excludes_pii(teslamate_abrp, caplog):
     teslamate_abrp.data["lat"] = 47.123456
     teslamate_abrp.data["lon"] = 8.654321
     teslamate_abrp.data["odometer"] = 42424.2
-    with patch('requests.post') as mock_post:
+    with patch('requests.Session.post') as mock_post:
         mock_post.return_value.json.return_value = {"status": "ok"}
         with caplog.at_level(logging.INFO):
             teslamate_abrp.update_abrp()
@@ -1238,11 +1269,11 @@ def test_update_abrp_drops_non_finite_values(teslamate_abrp):
     so json(allow_nan=False) doesn't reject the whole payload."""
     teslamate_abrp.client.is_connected.return_value = True
     teslamate_abrp.data["power"] = float("nan")
-    with patch('requests.post') as mock_post:
+    with patch('requests.Session.post') as mock_post:
         mock_post.return_value.json.return_value = {"status": "ok"}
         teslamate_abrp.update_abrp()
         mock_post.assert_called_once()
-        body = mock_post.call_args.kwargs["json"]["tlm"]
+        body = json.loads(mock_post.call_args.kwargs["data"])["tlm"]
         assert "power" not in body  # non-finite value dropped
         # And it serializes as valid JSON (allow_nan=False, the requests default).
         json.dumps(body, allow_nan=False)
@@ -1316,5 +1347,1681 @@ def test_api_key_uses_config_override(mock_args):
         abrp = TeslaMateABRP(cfg)
     assert abrp.api_key == 'custom-app-key'
 
+# [ Topic dispatch registry ]
+def test_supported_topics_lists_registry():
+    """The handler registry is introspectable and covers the consumed topics."""
+    from teslamate_mqtt2abrp import TopicHandler, supported_topics
+    topics = supported_topics()
+    assert topics == sorted(TeslaMateABRP.TOPIC_HANDLERS)
+    for topic in ("state", "shift_state", "latitude", "usable_battery_level", "charger_phases"):
+        assert topic in topics
+    assert all(isinstance(h, TopicHandler) for h in TeslaMateABRP.TOPIC_HANDLERS.values())
+
+def test_process_message_range_limits(teslamate_abrp):
+    """Out-of-range values are dropped like unparsable ones."""
+    teslamate_abrp.process_message("usable_battery_level", "80")
+    teslamate_abrp.process_message("usable_battery_level", "180")
+    teslamate_abrp.process_message("usable_battery_level", "-3")
+    assert teslamate_abrp.data["soc"] == 80
+    teslamate_abrp.process_message("heading", "400")
+    assert teslamate_abrp.data["heading"] == 0
+
+def test_process_message_rejects_non_finite_floats(teslamate_abrp):
+    """Every float topic ignores nan/inf, not just power."""
+    teslamate_abrp.process_message("latitude", "47.5")
+    teslamate_abrp.process_message("latitude", "nan")
+    teslamate_abrp.process_message("outside_temp", "inf")
+    assert teslamate_abrp.data["lat"] == 47.5
+    assert teslamate_abrp.data["ext_temp"] == 0
+
+def test_process_message_present_above_drops_field(teslamate_abrp):
+    """Charger readings at/below their threshold remove the field."""
+    teslamate_abrp.process_message("charger_voltage", "230")
+    assert teslamate_abrp.data["voltage"] == 230
+    teslamate_abrp.process_message("charger_voltage", "2")
+    assert "voltage" not in teslamate_abrp.data
+
+def test_process_message_unknown_topic_is_ignored(teslamate_abrp, caplog):
+    """Unknown topics leave the data untouched and log at DEBUG."""
+    before = dict(teslamate_abrp.data)
+    with caplog.at_level(logging.DEBUG):
+        teslamate_abrp.process_message("tpms_pressure_fl", "2.9")
+    assert teslamate_abrp.data == before
+    assert "Unneeded topic: tpms_pressure_fl" in caplog.text
+
+# [ Event-driven scheduler ]
+def test_scheduler_pops_in_deadline_order():
+    """Keys come out by deadline; rescheduling a key replaces its old deadline."""
+    from teslamate_mqtt2abrp import Scheduler
+    scheduler = Scheduler(clock=lambda: 0.0)
+    scheduler.schedule("a", 5.0)
+    scheduler.schedule("b", 2.0)
+    scheduler.schedule("a", 1.0)  # replaces 5.0
+    assert scheduler.next_deadline() == 1.0
+    assert scheduler.pop_due(1.5) == ["a"]
+    assert scheduler.pop_due(10.0) == ["b"]  # the stale 5.0 entry is gone
+    assert scheduler.next_deadline() is None
+
+def test_scheduler_sleeps_until_deadline_without_polling():
+    """wait() sleeps once, for exactly the time left until the next deadline."""
+    from teslamate_mqtt2abrp import Scheduler
+    scheduler = Scheduler()
+    clock = _fake_clock(scheduler, 100.0)
+    waits = []
+    inner = scheduler._wait
+    scheduler._wait = lambda timeout: (waits.append(timeout), inner(timeout))
+    scheduler.schedule("car", 30.0)
+    assert scheduler.wait() == ["car"]
+    assert waits == [30.0] and clock["t"] == 30.0
+
+def test_scheduler_wake_interrupts_wait():
+    """A key woken from another thread is returned immediately, long before
+    the pending deadline."""
+    import threading, time
+    from teslamate_mqtt2abrp import Scheduler
+    scheduler = Scheduler()
+    scheduler.schedule("parked-car", time.monotonic() + 60)
+    threading.Timer(0.05, scheduler.wake, args=("driving-car",)).start()
+    start = time.monotonic()
+    assert scheduler.wait() == ["driving-car"]
+    assert time.monotonic() - start < 5
+
+def test_state_change_wakes_loop_immediately():
+    """A state message during a long parked wait triggers a send right away,
+    not at the next parked deadline."""
+    abrp, _, _, _ = _run_state_loop("online", duration=0.0)
+    clock = _fake_clock(abrp.scheduler, 100.0)
+    sends = []
+    abrp.update_abrp = lambda: sends.append((clock["t"], abrp.state))
+    inner = abrp.scheduler._wait
+    def wait_then_drive(timeout):
+        # 10s into the 30s parked wait, TeslaMate reports the car driving.
+        if clock["t"] == 0.0:
+            clock["t"] = 10.0
+            abrp.process_message("state", "driving")
+            return
+        inner(timeout)
+    abrp.scheduler._wait = wait_then_drive
+    with pytest.raises(KeyboardInterrupt):
+        abrp.update_timely()
+    assert sends[:2] == [(0.0, "online"), (10.0, "driving")]
+
+def test_shift_state_change_requests_send(teslamate_abrp):
+    """Leaving park schedules an immediate send; a repeated value does not."""
+    teslamate_abrp.data["is_parked"] = True
+    teslamate_abrp.process_message("shift_state", "D")
+    assert teslamate_abrp.send_requested is True
+    assert teslamate_abrp.scheduler.pop_due(teslamate_abrp.scheduler.clock()) == [teslamate_abrp]
+    teslamate_abrp.send_requested = False
+    teslamate_abrp.process_message("shift_state", "D")
+    assert teslamate_abrp.send_requested is False
+    assert teslamate_abrp.scheduler.next_deadline() is None
+
+def test_tick_honours_send_request(teslamate_abrp):
+    """tick() sends early when a send was requested, then returns the next deadline."""
+    teslamate_abrp.state = teslamate_abrp.prev_state = "online"
+    teslamate_abrp.last_send = 100.0
+    with patch.object(teslamate_abrp, 'update_abrp') as mock_update:
+        assert teslamate_abrp.tick(now=105.0) == 130.0
+        mock_update.assert_not_called()
+        teslamate_abrp.send_requested = True
+        assert teslamate_abrp.tick(now=106.0) == 136.0
+        mock_update.assert_called_once()
+
+def test_fatal_error_wakes_scheduler(teslamate_abrp):
+    """A failed CONNACK wakes the loop so it can exit without waiting."""
+    with patch.object(teslamate_abrp.scheduler, 'wake') as mock_wake:
+        teslamate_abrp.on_connect(MagicMock(), None, None, 5, None)
+    mock_wake.assert_called_once_with()
+
+# [ Pooled ABRP HTTP session ]
+def test_update_abrp_reuses_prebuilt_target(teslamate_abrp):
+    """The request URL and headers are built once and reused across sends."""
+    with patch('requests.Session.post') as mock_post:
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        teslamate_abrp.update_abrp()
+        teslamate_abrp.update_abrp()
+    first, second = mock_post.call_args_list
+    assert first.args[0] == "https://api.iternio.com/1/tlm/send?token=test-token"
+    assert first.args[0] is second.args[0]
+    assert first.kwargs["headers"] is second.kwargs["headers"]
+
+def test_abrp_session_from_config(mock_args):
+    """HTTP_* settings configure the pool and timeouts; invalid ones fall back."""
+    from teslamate_mqtt2abrp import ABRPSession, DEFAULT_HTTP_POOL_SIZE
+    session = ABRPSession.from_config(
+        {"HTTP_POOL_SIZE": 8, "HTTP_CONNECT_TIMEOUT": 2, "HTTP_READ_TIMEOUT": "15"}
+    )
+    assert session.timeout == (2.0, 15.0)
+    assert session.adapter._pool_maxsize == 8
+    session = ABRPSession.from_config({"HTTP_POOL_SIZE": 0, "HTTP_READ_TIMEOUT": "abc"})
+    assert session.adapter._pool_maxsize == DEFAULT_HTTP_POOL_SIZE
+    assert session.timeout[1] == 10.0
+
+def test_abrp_session_keeps_connections_alive():
+    """Consecutive POSTs reuse one keep-alive connection, visible in stats()."""
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from teslamate_mqtt2abrp import ABRPSession
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            body = b'{"status": "ok"}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        session = ABRPSession()
+        url = f"http://127.0.0.1:{server.server_address[1]}/1/tlm/send"
+        for _ in range(3):
+            assert session.post(url, json={"tlm": {}}).json()["status"] == "ok"
+        assert session.stats() == {"connections": 1, "requests": 3, "reused": 2}
+        session.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+# [ Store-and-forward queue ]
+def _now_utc():
+    import calendar, datetime
+    return calendar.timegm(datetime.datetime.now(datetime.UTC).timetuple())
+
+def test_outbox_persists_and_orders(tmp_path):
+    """Rows survive reopening the file and come out oldest first per target."""
+    from teslamate_mqtt2abrp import TelemetryOutbox
+    path = str(tmp_path / "queue.db")
+    outbox = TelemetryOutbox(path)
+    now = _now_utc()
+    outbox.put("1", {"utc": now - 20, "soc": 50})
+    outbox.put("2", {"utc": now - 15, "soc": 70})
+    outbox.put("1", {"utc": now - 10, "soc": 49})
+    outbox.close()
+
+    outbox = TelemetryOutbox(path)
+    assert outbox.count() == 3 and outbox.count("1") == 2
+    row_id, tlm = outbox.peek("1")
+    assert tlm == {"utc": now - 20, "soc": 50}
+    outbox.remove(row_id)
+    assert outbox.peek("1")[1]["soc"] == 49
+
+def test_outbox_evicts_by_age_and_size(tmp_path):
+    """Expired rows and rows beyond max_size are dropped, oldest first."""
+    from teslamate_mqtt2abrp import TelemetryOutbox
+    outbox = TelemetryOutbox(str(tmp_path / "queue.db"), max_age=60, max_size=2)
+    now = _now_utc()
+    outbox.put("1", {"utc": now - 120})  # already too old
+    assert outbox.count() == 0
+    for offset in (3, 2, 1):
+        outbox.put("1", {"utc": now - offset})
+    assert outbox.count() == 2
+    assert outbox.peek("1")[1]["utc"] == now - 2
+
+def _queueing_abrp(mock_args, tmp_path):
+    config = {**mock_args, "QUEUE_PATH": str(tmp_path / "queue.db")}
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(config)
+    abrp.client.is_connected.return_value = True
+    return abrp
+
+def test_update_abrp_queues_on_connection_failure(mock_args, tmp_path):
+    """A failed POST keeps the snapshot (with its original utc) on disk."""
+    import requests
+    abrp = _queueing_abrp(mock_args, tmp_path)
+    abrp.data["soc"] = 42
+    with patch('requests.Session.post', side_effect=requests.ConnectionError("tunnel")):
+        abrp.update_abrp()
+    _, tlm = abrp.outbox.peek(abrp.recipients[0].queue_target)
+    assert tlm["soc"] == 42 and tlm["utc"] == abrp.data["utc"]
+
+def test_update_abrp_does_not_queue_rejected_data(mock_args, tmp_path):
+    """An explicit ABRP error reply is not an outage: nothing is queued."""
+    abrp = _queueing_abrp(mock_args, tmp_path)
+    with patch('requests.Session.post') as mock_post:
+        mock_post.return_value.json.return_value = {"status": "error"}
+        abrp.update_abrp()
+    assert abrp.outbox.count() == 0
+
+def test_backlog_drains_after_live_success(mock_args, tmp_path):
+    """Once a live send succeeds, queued snapshots are replayed oldest first
+    with their original utc, then the drainer goes idle."""
+    abrp = _queueing_abrp(mock_args, tmp_path)
+    now = _now_utc()
+    abrp.outbox.put(abrp.recipients[0].queue_target, {"utc": now - 30, "soc": 60})
+    abrp.outbox.put(abrp.recipients[0].queue_target, {"utc": now - 20, "soc": 59})
+    with patch('requests.Session.post') as mock_post:
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        abrp.update_abrp()
+        assert abrp.drainer.active
+        assert abrp.scheduler.pop_due(abrp.scheduler.clock()) == [abrp.drainer]
+        t = 0.0
+        while (t := abrp.drainer.tick(now=t)) is not None:
+            pass
+    replayed = [json.loads(c.kwargs["data"])["tlm"]["utc"] for c in mock_post.call_args_list[1:]]
+    assert replayed == [now - 30, now - 20]
+    assert abrp.outbox.count() == 0 and not abrp.drainer.active
+
+def test_backlog_replay_ends_before_the_next_live_send(mock_args, tmp_path):
+    """Replay timeouts shrink to the time left before the next live send;
+    eviction runs when a drain starts, not on every replayed row."""
+    abrp = _queueing_abrp(mock_args, tmp_path)
+    abrp.outbox.put(abrp.recipients[0].queue_target, {"utc": _now_utc(), "soc": 60})
+    abrp.scheduler.clock = lambda: 100.0
+    abrp.next_send = 102.0
+    with patch('requests.Session.post') as mock_post, \
+            patch.object(abrp.outbox, '_evict', wraps=abrp.outbox._evict) as mock_evict:
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        abrp.drainer.start()
+        assert mock_evict.call_count == 1
+        assert abrp.drainer.tick(now=100.0) == 101.0
+        abrp.next_send = None
+        assert abrp.drainer.tick(now=101.0) is None
+        assert mock_evict.call_count == 1
+    assert mock_post.call_args_list[0].kwargs["timeout"] == (2.0, 2.0)
+    assert abrp.outbox.count() == 0
+
+def test_backlog_yields_to_live_send(mock_args, tmp_path):
+    """The drainer steps aside when a live send is about to go out, and stops
+    on the first failed replay."""
+    abrp = _queueing_abrp(mock_args, tmp_path)
+    abrp.outbox.put(abrp.recipients[0].queue_target, {"utc": _now_utc(), "soc": 60})
+    abrp.next_send = 100.2
+    with patch.object(abrp, 'replay_snapshot', return_value=False) as mock_replay:
+        assert abrp.drainer.tick(now=100.0) == 100.2
+        mock_replay.assert_not_called()
+        abrp.next_send = 130.0
+        assert abrp.drainer.tick(now=100.5) is None
+        mock_replay.assert_called_once()
+    assert abrp.outbox.count() == 1
+
+def test_backlog_replays_on_running_sender(mock_args, tmp_path):
+    """With the sender running, tick() only hands the replay over: the POST
+    runs on the sender thread, which then schedules the next tick."""
+    import threading
+    import time
+    abrp = _queueing_abrp(mock_args, tmp_path)
+    abrp.outbox.put(abrp.recipients[0].queue_target, {"utc": _now_utc(), "soc": 60})
+    threads = []
+    def replay(tlm, recipient, timeout=None):
+        threads.append(threading.current_thread().name)
+        return True
+    abrp.sender.start()
+    try:
+        with patch.object(abrp, 'replay_snapshot', side_effect=replay):
+            abrp.drainer.active = True
+            assert abrp.drainer.tick(now=0.0) is None
+            deadline = time.monotonic() + 5
+            while abrp.scheduler.next_deadline() is None and time.monotonic() < deadline:
+                time.sleep(0.01)
+    finally:
+        abrp.sender.stop(timeout=5)
+    assert threads == ["abrp-sender-1"]
+    assert abrp.outbox.count() == 0 and abrp.drainer.replayed == 1
+    assert abrp.scheduler.pop_due(math.inf) == [abrp.drainer]
+
+# [ Change-detection send suppression ]
+def test_parse_deadbands():
+    """Specs override the defaults; invalid entries are ignored."""
+    from teslamate_mqtt2abrp import parse_deadbands, DEFAULT_DEADBANDS
+    assert parse_deadbands(None) == DEFAULT_DEADBANDS
+    bands = parse_deadbands("soc=2, position=100,bogus,speed=-1,heading=5")
+    assert bands["soc"] == 2 and bands["position"] == 100 and bands["heading"] == 5
+    assert "bogus" not in bands and "speed" not in bands
+
+def test_change_detector_deadbands_and_keepalive():
+    """Changes inside the deadbands are suppressed until the keepalive."""
+    from teslamate_mqtt2abrp import ChangeDetector, parse_deadbands
+    detector = ChangeDetector(parse_deadbands("position=50"), keepalive=300)
+    base = {"utc": 1, "soc": 80, "ext_temp": 10.0, "lat": 47.0, "lon": 8.0, "is_charging": False}
+    assert detector.is_meaningful(base, 0.0)  # nothing sent yet
+    detector.mark_sent(base, 0.0)
+    # utc, +0.3 degC and ~11m of GPS jitter are not news.
+    assert not detector.is_meaningful({**base, "utc": 2, "ext_temp": 10.3, "lat": 47.0001}, 30.0)
+    assert detector.is_meaningful({**base, "soc": 79}, 30.0)
+    assert detector.is_meaningful({**base, "lat": 47.001}, 30.0)  # ~111m
+    assert detector.is_meaningful({**base, "is_charging": True}, 30.0)
+    assert detector.is_meaningful({**base, "kwh_charged": 0.1}, 30.0)
+    assert detector.is_meaningful(base, 300.0)  # keepalive ceiling
+
+def test_change_detector_skips_unchanged_version():
+    """A version already found unchanged isn't compared field by field again."""
+    from teslamate_mqtt2abrp import ChangeDetector, parse_deadbands
+    detector = ChangeDetector(parse_deadbands(None), keepalive=300)
+    base = {"utc": 1, "soc": 80}
+    detector.mark_sent(base, 0.0)
+    assert not detector.is_meaningful(base, 30.0, version=7)
+    with patch.object(detector, '_differs') as mock_differs:
+        assert not detector.is_meaningful(base, 60.0, version=7)
+        mock_differs.assert_not_called()
+    assert detector.is_meaningful({**base, "soc": 79}, 90.0, version=8)
+    assert detector.is_meaningful(base, 300.0, version=7)  # keepalive still applies
+
+def test_update_timely_suppresses_unchanged_parked_sends(mock_args):
+    """Parked with nothing changing: one send, then only keepalives."""
+    config = {**mock_args, "REFRESH_RATE_PARKED": 30, "SUPPRESS_UNCHANGED": True, "SEND_KEEPALIVE": 90}
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(config)
+    abrp.state = abrp.prev_state = "asleep"
+    _fake_clock(abrp.scheduler, 200.0)
+    with patch('requests.Session.post') as mock_post:
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        with pytest.raises(KeyboardInterrupt):
+            abrp.update_timely()
+    # Due every 30s (0..180 = 7 slots), but only 0, 90 and 180 go out.
+    assert mock_post.call_count == 3
+    assert abrp.change_detector.suppressed == 4
+
+def test_suppression_compares_without_stale_fields(mock_args):
+    """An expired field is left out of both sides of the comparison, so it
+    doesn't make every due send look meaningful."""
+    config = {**mock_args, "REFRESH_RATE_PARKED": 30, "SUPPRESS_UNCHANGED": True,
+              "SEND_KEEPALIVE": 600, "FIELD_TTLS": "heading=10"}
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(config)
+    abrp.state = abrp.prev_state = "asleep"
+    _fake_clock(abrp.scheduler, 170.0)
+    abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/heading", "90"))
+    with patch('requests.Session.post') as mock_post:
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        with pytest.raises(KeyboardInterrupt):
+            abrp.update_timely()
+    # Sent at 0 with heading, at 30 once it expired, then nothing new.
+    assert mock_post.call_count == 2
+    assert abrp.change_detector.suppressed == 4
+
+def test_tick_skips_send_without_news(teslamate_abrp):
+    """tick() consults the detector for routine sends only."""
+    from teslamate_mqtt2abrp import ChangeDetector, parse_deadbands
+    abrp = teslamate_abrp
+    abrp.change_detector = ChangeDetector(parse_deadbands(None), keepalive=600)
+    abrp.state = abrp.prev_state = "asleep"
+    abrp.handle_parked_state()
+    abrp.change_detector.mark_sent({**abrp.data}, 0.0)
+    abrp.last_send = 0.0
+    with patch.object(abrp, 'update_abrp') as mock_update:
+        assert abrp.tick(now=30.0) == 60.0
+        mock_update.assert_not_called()
+        assert abrp.change_detector.suppressed == 1
+        abrp.process_message("usable_battery_level", "55")
+        abrp.tick(now=60.0)
+        mock_update.assert_called_once()
+        # A requested send (shift change) bypasses the detector.
+        abrp.send_requested = True
+        abrp.tick(now=61.0)
+        assert mock_update.call_count == 2
+
+def test_update_abrp_marks_accepted_snapshot(teslamate_abrp):
+    """Only snapshots ABRP accepted become the comparison baseline."""
+    from teslamate_mqtt2abrp import ChangeDetector, parse_deadbands
+    teslamate_abrp.change_detector = ChangeDetector(parse_deadbands(None))
+    with patch('requests.Session.post') as mock_post:
+        mock_post.return_value.json.return_value = {"status": "error"}
+        teslamate_abrp.update_abrp()
+        assert teslamate_abrp.change_detector.last_sent is None
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        teslamate_abrp.update_abrp()
+    assert teslamate_abrp.change_detector.last_sent["soc"] == teslamate_abrp.data["soc"]
+
+# [ Motion-adaptive driving rate ]
+def _motion_policy(**thresholds):
+    from teslamate_mqtt2abrp import MotionPolicy, DEFAULT_MOTION_THRESHOLDS
+    return MotionPolicy({**DEFAULT_MOTION_THRESHOLDS, **thresholds}, base_interval=2.5, max_interval=10)
+
+def test_parse_motion_thresholds_rejects_unknown_names():
+    from teslamate_mqtt2abrp import parse_thresholds, DEFAULT_MOTION_THRESHOLDS
+    limits = parse_thresholds("heading=30,soc=1,distance=x", DEFAULT_MOTION_THRESHOLDS, "motion threshold", known=True)
+    assert limits == {**DEFAULT_MOTION_THRESHOLDS, "heading": 30}
+
+def test_motion_policy_triggers():
+    """Each threshold triggers an early send, once per sent point."""
+    point = {"heading": 350, "speed": 100, "power": 20.0, "lat": 47.0, "lon": 8.0}
+    policy = _motion_policy()
+    assert policy.check(point) is None  # no baseline yet
+    policy.mark_sent(point, stretch=False)
+    assert policy.check({**point, "heading": 2, "lat": 47.001}) is None  # 12 deg, ~111m
+    assert policy.check({**point, "heading": 5}) == "heading"  # wraps through north
+    assert policy.check({**point, "heading": 90}) is None  # already reported
+    for change, reason in (({"speed": 80}, "speed"), ({"power": 50.0}, "power"),
+                           ({"lat": 47.003}, "distance")):
+        policy.mark_sent(point, stretch=False)
+        assert policy.check({**point, **change}) == reason
+    assert policy.early_sends == 3
+    # A zero threshold disables that trigger.
+    policy = _motion_policy(heading=0)
+    policy.mark_sent(point, stretch=False)
+    assert policy.check({**point, "heading": 170}) is None
+
+def test_motion_policy_stretches_and_resets_interval():
+    policy = _motion_policy()
+    point = {"heading": 0, "speed": 100, "power": 20.0}
+    for expected in (3.75, 5.625, 8.4375, 10, 10):
+        policy.mark_sent(point, stretch=True)
+        assert policy.interval == expected
+    policy.check({**point, "speed": 50})
+    policy.mark_sent(point, stretch=True)  # early send: back to the base rate
+    assert policy.interval == 2.5
+    policy.mark_sent(point, stretch=True)
+    policy.reset()
+    assert policy.interval == 2.5 and policy.last_point is None
+
+def test_adaptive_driving_stretches_steady_cruise():
+    """Cruising straight, the interval grows to the max: fewer sends than the
+    fixed 2.5s cadence."""
+    _, _, _, times = _run_state_loop("driving", duration=60.0, ADAPTIVE_DRIVING=True,
+                                     REFRESH_RATE_DRIVING=2.5)
+    assert _intervals(times) == [2.5, 3.75, 5.625, 8.4375, 10, 10, 10]
+
+def test_adaptive_driving_sends_early_on_turn(mock_args):
+    """A heading change pulls the next send forward, but no sooner than
+    MIN_REFRESH_RATE after the previous one."""
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP({**mock_args, "ADAPTIVE_DRIVING": True})
+    abrp.state = abrp.prev_state = "driving"
+    clock = _fake_clock(abrp.scheduler, 100.0)
+    abrp.last_send = None
+    with patch.object(abrp, 'update_abrp'):
+        assert abrp.tick(now=0.0) == 2.5
+        abrp.tick(now=2.5)
+        assert abrp.next_send == 6.25
+        clock["t"] = 2.7
+        abrp.process_message("heading", "40")
+        assert abrp.send_requested
+        assert abrp.scheduler.next_deadline() == 3.5
+        assert abrp.tick(now=3.5) == 6.0
+    assert abrp.motion_policy.early_sends == 1
+    assert abrp.motion_policy.interval == 2.5
+
+# [ Metrics endpoint ]
+def test_metrics_from_config():
+    from teslamate_mqtt2abrp import Metrics
+    assert Metrics.from_config({}) is None
+    assert Metrics.from_config({"METRICS_PORT": "http"}) is None
+    assert Metrics.from_config({"METRICS_PORT": 70000}) is None
+    metrics = Metrics.from_config({"METRICS_PORT": "9100", "METRICS_BIND": "127.0.0.1"})
+    assert (metrics.port, metrics.bind) == (9100, "127.0.0.1")
+
+def test_metrics_render_exposition_format():
+    from teslamate_mqtt2abrp import Metrics
+    metrics = Metrics()
+    metrics.inc("tm2abrp_mqtt_messages_total", ("1", "speed"))
+    metrics.inc("tm2abrp_mqtt_messages_total", ("1", "speed"))
+    for seconds in (0.02, 0.05, 30.0):
+        metrics.observe("tm2abrp_abrp_post_seconds", ("1", "ok"), seconds)
+    text = metrics.render()
+    assert "# TYPE tm2abrp_mqtt_messages_total counter" in text
+    assert 'tm2abrp_mqtt_messages_total{car="1",topic="speed"} 2' in text
+    # Buckets are cumulative and upper-inclusive.
+    assert 'tm2abrp_abrp_post_seconds_bucket{car="1",outcome="ok",le="0.025"} 1' in text
+    assert 'tm2abrp_abrp_post_seconds_bucket{car="1",outcome="ok",le="0.05"} 2' in text
+    assert 'tm2abrp_abrp_post_seconds_bucket{car="1",outcome="ok",le="+Inf"} 3' in text
+    assert 'tm2abrp_abrp_post_seconds_count{car="1",outcome="ok"} 3' in text
+    assert 'tm2abrp_abrp_post_seconds_sum{car="1",outcome="ok"} 30.07' in text
+
+def test_bridge_records_hot_path_metrics(mock_args):
+    """Messages, POST outcomes, lag and send decisions are all recorded."""
+    import requests
+    from teslamate_mqtt2abrp import Metrics
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(mock_args, metrics=Metrics())
+    message = MagicMock(topic="teslamate/cars/1/speed", payload=b"42")
+    abrp.on_message(None, None, message)
+    assert abrp.data["speed"] == 42
+    with patch('requests.Session.post') as mock_post:
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        abrp.update_abrp()
+        mock_post.return_value.json.return_value = {"status": "error"}
+        abrp.update_abrp()
+        mock_post.side_effect = requests.exceptions.ConnectionError("down")
+        abrp.update_abrp()
+    abrp.state = abrp.prev_state = "driving"
+    abrp.last_send, abrp.next_send = 0.0, 2.5
+    with patch.object(abrp, 'update_abrp'):
+        abrp.tick(now=2.75)
+    text = abrp.metrics.render()
+    assert 'tm2abrp_mqtt_messages_total{car="1",topic="speed"} 1' in text
+    assert 'tm2abrp_process_message_seconds_count{car="1"} 1' in text
+    assert 'tm2abrp_data_lock_wait_seconds_count{car="1",site="message"} 1' in text
+    for outcome in ("ok", "rejected", "error"):
+        assert f'tm2abrp_abrp_post_seconds_count{{car="1",outcome="{outcome}"}} 1' in text
+    assert 'tm2abrp_scheduler_lag_seconds_sum{car="1"} 0.25' in text
+    assert 'tm2abrp_sends_total{car="1",state="driving",decision="sent"} 1' in text
+
+def test_metrics_server_serves_endpoint():
+    """The endpoint serves the registry, plus the HTTP session counters."""
+    import requests
+    from teslamate_mqtt2abrp import Metrics, ABRPSession
+    metrics = Metrics(port=0, bind="127.0.0.1", session=ABRPSession())
+    metrics.inc("tm2abrp_sends_total", ("1", "asleep", "sent"))
+    metrics.start_server()
+    try:
+        url = f"http://127.0.0.1:{metrics.server.port}"
+        response = requests.get(f"{url}/metrics", timeout=5)
+        assert response.status_code == 200
+        assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert 'tm2abrp_sends_total{car="1",state="asleep",decision="sent"} 1' in response.text
+        assert "tm2abrp_http_reused_total 0" in response.text
+        assert requests.get(f"{url}/other", timeout=5).status_code == 404
+    finally:
+        metrics.close()
+    assert metrics.server is None
+
+# [ Sender worker ]
+def test_sender_worker_latest_wins():
+    """While a send is in flight, newer snapshots replace the waiting one."""
+    import threading
+    from teslamate_mqtt2abrp import SenderWorker, Metrics
+    release = threading.Event()
+    in_flight = threading.Event()
+    delivered = []
+    def send(snapshot):
+        delivered.append(snapshot["n"])
+        in_flight.set()
+        release.wait(5)
+    worker = SenderWorker(send, "1", Metrics())
+    worker.start()
+    worker.submit({"n": 1})
+    assert in_flight.wait(5)
+    assert worker.in_flight_since is not None
+    worker.submit({"n": 2})
+    worker.submit({"n": 3})
+    release.set()
+    worker.stop(timeout=5)
+    assert delivered == [1, 3]
+    assert worker.superseded == 1 and not worker.running
+    text = worker.metrics.render()
+    assert 'tm2abrp_snapshots_superseded_total{car="1"} 1' in text
+    assert 'tm2abrp_send_in_flight_seconds_count{car="1"} 2' in text
+
+def test_sender_worker_survives_send_errors():
+    from teslamate_mqtt2abrp import SenderWorker
+    delivered = []
+    def send(snapshot):
+        delivered.append(snapshot)
+        raise RuntimeError("boom")
+    worker = SenderWorker(send)
+    worker.start()
+    worker.submit({"n": 1})
+    worker.stop(timeout=5)
+    worker.start()
+    worker.submit({"n": 2})
+    worker.stop(timeout=5)
+    assert delivered == [{"n": 1}, {"n": 2}]
+
+def test_sender_worker_runs_jobs_behind_snapshots():
+    """Jobs wait for any pending snapshot and run done(work()) on the thread."""
+    import threading
+    from teslamate_mqtt2abrp import SenderWorker
+    release = threading.Event()
+    in_flight = threading.Event()
+    order = []
+    def send(snapshot):
+        order.append(snapshot["n"])
+        in_flight.set()
+        release.wait(5)
+    worker = SenderWorker(send)
+    worker.start()
+    worker.submit({"n": 1})
+    assert in_flight.wait(5)
+    finished = threading.Event()
+    worker.submit_job(lambda: "job", lambda result: (order.append(result), finished.set()))
+    worker.submit({"n": 2})
+    release.set()
+    assert finished.wait(5)
+    worker.stop(timeout=5)
+    assert order == [1, 2, "job"]
+
+def test_update_abrp_hands_off_to_running_sender(teslamate_abrp):
+    """With the worker running, update_abrp returns without waiting for the POST."""
+    import threading
+    import time
+    release = threading.Event()
+    def slow_post(*args, **kwargs):
+        release.wait(5)
+        response = MagicMock()
+        response.json.return_value = {"status": "ok"}
+        return response
+    teslamate_abrp.sender.start()
+    try:
+        with patch('requests.Session.post', side_effect=slow_post) as mock_post:
+            teslamate_abrp.data["soc"] = 42
+            started = time.monotonic()
+            teslamate_abrp.update_abrp()  # would block until release if inline
+            assert time.monotonic() - started < 2
+            release.set()
+            teslamate_abrp.sender.stop(timeout=5)
+    finally:
+        release.set()
+        teslamate_abrp.sender.stop(timeout=5)
+    assert json.loads(mock_post.call_args.kwargs["data"])["tlm"]["soc"] == 42
+
+# [ asyncio runtime ]
+def test_async_sender_latest_wins():
+    import asyncio
+    from teslamate_mqtt2abrp import AsyncSender
+    delivered = []
+    async def deliver(snapshot):
+        delivered.append(snapshot["n"])
+        await asyncio.sleep(0.01)
+    async def scenario():
+        sender = AsyncSender(deliver, "1")
+        for n in (1, 2, 3):
+            sender.submit({"n": n})
+            await asyncio.sleep(0)  # let the first delivery start
+        await sender.flush(5)
+        return sender
+    sender = asyncio.run(scenario())
+    assert delivered == [1, 3] and sender.superseded == 1
+    assert sender.task is None and not sender.running
+
+def test_async_sender_runs_job_work_off_the_loop():
+    """A job's work runs in the executor, its done callback back on the loop."""
+    import asyncio
+    import threading
+    from teslamate_mqtt2abrp import AsyncSender
+    async def deliver(snapshot):
+        pass
+    threads = []
+    async def scenario():
+        sender = AsyncSender(deliver, "1")
+        finished = asyncio.Event()
+        sender.submit_job(lambda: threads.append(threading.current_thread()),
+                          lambda result: (threads.append(threading.current_thread()), finished.set()))
+        await asyncio.wait_for(finished.wait(), 5)
+    asyncio.run(scenario())
+    assert threads[0] is not threading.main_thread() and threads[1] is threading.main_thread()
+
+def test_async_runtime_watches_the_mqtt_socket(mock_args):
+    """attach_mqtt hands paho's socket to the event loop: readable data
+    triggers loop_read, pending output registers loop_write."""
+    import asyncio
+    import socket
+    from teslamate_mqtt2abrp import AsyncRuntime
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(mock_args)
+    ours, broker = socket.socketpair()
+    abrp.client.socket.return_value = ours
+    abrp.client.want_write.return_value = True
+    async def scenario():
+        runtime = AsyncRuntime(abrp)
+        runtime.attach_mqtt(asyncio.get_running_loop())
+        broker.send(b"\x20\x02\x00\x00")  # CONNACK
+        for _ in range(100):
+            if abrp.client.loop_read.called:
+                break
+            await asyncio.sleep(0.01)
+        abrp.client.on_socket_close(abrp.client, None, ours)
+    try:
+        asyncio.run(scenario())
+    finally:
+        ours.close()
+        broker.close()
+    abrp.client.loop_read.assert_called()
+    abrp.client.loop_write.assert_called()
+
+def test_async_runtime_keeps_replies_and_socket_changes_on_the_loop(mock_args):
+    """Without aiohttp only the POST runs in the executor: the reply is
+    handled on the loop, and a write registered from another thread is
+    handed over to it."""
+    import asyncio
+    import threading
+    from teslamate_mqtt2abrp import AsyncRuntime
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(mock_args)
+    abrp.client.socket.return_value = None
+    threads = {}
+    def post(*args, **kwargs):
+        threads["post"] = threading.current_thread()
+        return MagicMock(text='{"status": "ok"}')
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        runtime = AsyncRuntime(abrp)
+        runtime.attach_mqtt(loop)
+        with patch.object(loop, 'add_writer', side_effect=lambda *args: threads.setdefault(
+                "add_writer", threading.current_thread())):
+            worker = threading.Thread(target=abrp.client.on_socket_register_write, args=(abrp.client, None, 7))
+            worker.start()
+            worker.join()
+            await asyncio.sleep(0.01)
+        await runtime.post(abrp, {"utc": 1, "soc": 50})
+    with patch('requests.Session.post', side_effect=post), \
+            patch.object(abrp, 'handle_reply', side_effect=lambda *args: threads.setdefault(
+                "reply", threading.current_thread())):
+        asyncio.run(scenario())
+    assert threads["post"] is not threading.main_thread()
+    assert threads["reply"] is threading.main_thread() and threads["add_writer"] is threading.main_thread()
+
+def test_async_runtime_reconnects_off_the_loop(mock_args):
+    """A dropped link is reconnected from the executor, not the loop thread."""
+    import asyncio
+    import threading
+    import paho.mqtt.client as mqtt
+    from teslamate_mqtt2abrp import AsyncRuntime
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(mock_args)
+    abrp.client.loop_misc.return_value = mqtt.MQTT_ERR_NO_CONN
+    threads = []
+    abrp.client.reconnect.side_effect = lambda: threads.append(threading.current_thread())
+    async def scenario():
+        runtime = AsyncRuntime(abrp)
+        runtime.MISC_INTERVAL = 0.01
+        task = asyncio.get_running_loop().create_task(runtime.mqtt_misc())
+        while not threads:
+            await asyncio.sleep(0.01)
+        task.cancel()
+    asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert threads[0] is not threading.main_thread()
+
+def test_async_runtime_sends_on_schedule_and_exits_on_fatal_error(mock_args):
+    """The awaited scheduler ticks at the configured rate; a fatal MQTT error
+    flagged from another thread stops the runtime promptly."""
+    import asyncio
+    from teslamate_mqtt2abrp import AsyncRuntime
+    config = {**mock_args, "CARMODEL": "s100d", "REFRESH_RATE_PARKED": 1, "ASYNC_RUNTIME": True}
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(config)
+    abrp.client.socket.return_value = None
+    abrp.client.loop_start.assert_not_called()
+    abrp.state = "asleep"
+    def post(*args, **kwargs):
+        if post.calls == 1:
+            abrp.fatal_error = "MQTT Authentication failed."
+            abrp.scheduler.wake()
+        post.calls += 1
+        response = MagicMock()
+        response.json.return_value = {"status": "ok"}
+        return response
+    post.calls = 0
+    with patch('requests.Session.post', side_effect=post), \
+         patch('teslamate_mqtt2abrp.HAS_AIOHTTP', False):
+        with pytest.raises(SystemExit, match="Authentication"):
+            asyncio.run(AsyncRuntime(abrp).main())
+    assert post.calls == 2
+    assert abrp.scheduler.listener is None
+
+def test_buffered_reply_feeds_handle_reply(teslamate_abrp):
+    """A reply read by aiohttp goes through the same handling as requests'."""
+    from teslamate_mqtt2abrp import BufferedReply
+    with patch.object(teslamate_abrp, 'queue_unsent') as mock_queue:
+        teslamate_abrp.handle_reply({"soc": 1}, 0.0, BufferedReply("<html>502</html>"))
+    mock_queue.assert_called_once_with({"soc": 1}, teslamate_abrp.recipients[0])
+
+def test_main_uses_async_runtime_when_requested():
+    with patch('teslamate_mqtt2abrp.TeslaMateABRP') as mock_bridge, \
+         patch('teslamate_mqtt2abrp.AsyncRuntime') as mock_runtime:
+        _call_main(async_runtime=True)
+    mock_runtime.assert_called_once_with(mock_bridge.return_value)
+    mock_runtime.return_value.run.assert_called_once()
+    mock_bridge.return_value.run.assert_not_called()
+    assert mock_bridge.call_args[0][0]["ASYNC_RUNTIME"] is True
+
+# [ Capture and replay ]
+def _write_capture(tmp_path, lines):
+    path = tmp_path / "drive.jsonl"
+    path.write_text("".join(json.dumps(line) + "\n" for line in lines))
+    return str(path)
+
+_DRIVE_CAPTURE = [
+    [0.0, "teslamate/cars/1/state", "asleep"],
+    [0.1, "teslamate/cars/1/usable_battery_level", "80"],
+    [0.2, "teslamate/cars/2/usable_battery_level", "10"],
+    [65.0, "teslamate/cars/1/state", "driving"],
+    [66.0, "teslamate/cars/1/speed", "50"],
+    [70.0, "teslamate/cars/1/speed", "80"],
+]
+
+def test_message_recorder_round_trip(tmp_path):
+    """Recorded messages (even non-UTF-8 payloads) read back unchanged."""
+    from teslamate_mqtt2abrp import MessageRecorder, read_capture
+    import paho.mqtt.client as mqtt
+    ticks = iter([100.0, 100.5, 102.25])
+    path = str(tmp_path / "capture.jsonl")
+    recorder = MessageRecorder(path, clock=lambda: next(ticks))
+    delivered = []
+    on_message = recorder.wrap(lambda client, userdata, message: delivered.append(message.payload))
+    for topic, payload in (("teslamate/cars/1/speed", b"42"), ("teslamate/cars/1/model", b"\xff3")):
+        message = mqtt.MQTTMessage(topic=topic.encode())
+        message.payload = payload
+        on_message(None, None, message)
+    recorder.close()
+    assert delivered == [b"42", b"\xff3"]
+    assert read_capture(path) == [(0.5, "teslamate/cars/1/speed", b"42"),
+                                  (2.25, "teslamate/cars/1/model", b"\xff3")]
+
+def test_replay_runs_sends_on_the_virtual_clock(mock_args, tmp_path):
+    """Replay is deterministic: sends land at the same virtual times, at the
+    configured endpoint, with only this car's messages applied."""
+    from teslamate_mqtt2abrp import MessageReplayer, OfflineClient, read_capture
+    config = {**mock_args, "ABRP_URL": "http://127.0.0.1:8080/1/tlm/send"}
+    abrp = TeslaMateABRP(config, client=OfflineClient())
+    replayer = MessageReplayer(abrp, read_capture(_write_capture(tmp_path, _DRIVE_CAPTURE)), speed=0)
+    send_times = []
+    with patch('requests.Session.post') as mock_post:
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        mock_post.side_effect = lambda *a, **kw: send_times.append(replayer.now) or mock_post.return_value
+        assert replayer.run() == 5
+    assert send_times == [0.0, 30.0, 60.0, 65.0, 67.5, 70.0]
+    assert mock_post.call_args[0][0].startswith("http://127.0.0.1:8080/1/tlm/send?token=")
+    assert abrp.data["soc"] == 80 and abrp.data["speed"] == 80
+
+def test_replay_paces_against_the_wall_clock(mock_args, tmp_path):
+    """At Nx speed, the capture's gaps are slept through N times faster."""
+    from teslamate_mqtt2abrp import MessageReplayer, OfflineClient, read_capture
+    abrp = TeslaMateABRP(mock_args, client=OfflineClient())
+    slept = []
+    replayer = MessageReplayer(abrp, read_capture(_write_capture(tmp_path, _DRIVE_CAPTURE)),
+                               speed=10, sleep=slept.append)
+    with patch('requests.Session.post'):
+        replayer.run()
+    assert round(sum(slept), 6) == 7.0
+
+def test_main_replays_without_a_broker(tmp_path):
+    path = _write_capture(tmp_path, _DRIVE_CAPTURE)
+    with patch('teslamate_mqtt2abrp.mqtt.Client') as mock_client, \
+         patch('requests.Session.post') as mock_post:
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        _call_main(mqtt_server=None, replay_path=path, replay_speed=0)
+    mock_client.assert_not_called()
+    assert mock_post.call_count == 6
+
+# [ Multi-car mode ]
+def _write_cars_config(tmp_path, entries):
+    path = tmp_path / "cars.json"
+    path.write_text(json.dumps(entries))
+    return str(path)
+
+def _make_fleet(mock_args, cars, base_topic=None):
+    from teslamate_mqtt2abrp import TeslaMateABRPFleet
+    config = {**mock_args, "BASETOPIC": base_topic}
+    with patch('teslamate_mqtt2abrp.mqtt.Client') as mock_client:
+        fleet = TeslaMateABRPFleet(config, cars)
+    return fleet, mock_client
+
+def test_load_fleet_config(tmp_path):
+    """The cars config maps per-car keys onto config keys and normalises car numbers."""
+    from teslamate_mqtt2abrp import load_fleet_config
+    path = _write_cars_config(tmp_path, [
+        {"car_number": 1, "user_token": "tok-1", "refresh_parked": 60},
+        {"car_number": "2", "car_model": "s100d"},
+    ])
+    cars = load_fleet_config(path)
+    assert cars == [
+        {"CARNUMBER": "1", "USERTOKEN": "tok-1", "REFRESH_RATE_PARKED": 60},
+        {"CARNUMBER": "2", "CARMODEL": "s100d"},
+    ]
+
+@pytest.mark.parametrize("entries", [
+    [],
+    {"car_number": 1},
+    [{"user_token": "tok"}],
+    [{"car_number": 1}, {"car_number": "1"}],
+])
+def test_load_fleet_config_rejects_invalid(tmp_path, entries):
+    """Empty, non-list, numberless or duplicate entries raise ValueError."""
+    from teslamate_mqtt2abrp import load_fleet_config
+    with pytest.raises(ValueError):
+        load_fleet_config(_write_cars_config(tmp_path, entries))
+
+def test_fleet_shares_one_client(mock_args):
+    """All cars share one MQTT client; per-car settings override the globals."""
+    fleet, mock_client = _make_fleet(mock_args, [
+        {"CARNUMBER": "1", "USERTOKEN": "tok-1"},
+        {"CARNUMBER": "2", "USERTOKEN": "tok-2", "REFRESH_RATE_DRIVING": 5},
+    ], base_topic="tesla/abrp")
+    mock_client.assert_called_once()
+    assert fleet.cars["1"].client is fleet.client
+    assert fleet.cars["2"].client is fleet.client
+    assert fleet.cars["2"].refresh_rate_driving == 5
+    assert fleet.cars["1"].refresh_rate_driving == DEFAULT_REFRESH_RATE_DRIVING
+    assert fleet.cars["2"].config["USERTOKEN"] == "tok-2"
+    assert fleet.cars["1"].session is fleet.cars["2"].session
+    assert fleet.cars["2"].state_topic == "tesla/abrp/2/_tm2abrp_status"
+    fleet.client.connect.assert_called_once()
+
+def test_fleet_on_connect_single_subscribe(mock_args):
+    """on_connect issues one SUBSCRIBE covering every car."""
+    fleet, _ = _make_fleet(mock_args, [{"CARNUMBER": "1"}, {"CARNUMBER": "3"}])
+    client_mock = MagicMock()
+    fleet.on_connect(client_mock, None, None, 0, None)
+    client_mock.subscribe.assert_called_once_with(
+        fleet.cars["1"].subscriptions() + fleet.cars["3"].subscriptions() + [(fleet.sentinel_topic, 0)]
+    )
+    assert ("teslamate/cars/3/usable_battery_level", 0) in client_mock.subscribe.call_args[0][0]
+    fleet.on_connect(MagicMock(), None, None, 5, None)
+    assert fleet.fatal_error is not None
+
+def test_fleet_routes_messages_by_car(mock_args):
+    """Messages land in the state of the car named in the topic only."""
+    fleet, _ = _make_fleet(mock_args, [{"CARNUMBER": "1"}, {"CARNUMBER": "2"}])
+    message = MagicMock()
+    message.topic = "teslamate/cars/2/speed"
+    message.payload = b"88"
+    fleet.on_message(None, None, message)
+    assert fleet.cars["2"].data["speed"] == 88
+    assert fleet.cars["1"].data["speed"] == 0
+    # Unknown cars are ignored rather than raising.
+    message.topic = "teslamate/cars/9/speed"
+    fleet.on_message(None, None, message)
+
+def test_fleet_update_timely_ticks_every_car(mock_args):
+    """The shared loop sends for each car on its own cadence."""
+    fleet, _ = _make_fleet(mock_args, [
+        {"CARNUMBER": "1", "REFRESH_RATE_DRIVING": 2},
+        {"CARNUMBER": "2", "REFRESH_RATE_PARKED": 5},
+    ])
+    fleet.cars["1"].state = fleet.cars["1"].prev_state = "driving"
+    fleet.cars["2"].state = fleet.cars["2"].prev_state = "asleep"
+
+    clock = _fake_clock(fleet.scheduler, 10.0)
+    sends = {"1": [], "2": []}
+    for number, car in fleet.cars.items():
+        car.update_abrp = lambda n=number: sends[n].append(clock["t"])
+    with pytest.raises(KeyboardInterrupt):
+        fleet.update_timely()
+    assert _intervals(sends["1"]) == [2.0] * 4
+    assert _intervals(sends["2"]) == [5.0]
+
+def test_main_cars_config_builds_fleet(tmp_path):
+    """--cars-config runs the fleet; the global token fills in missing ones."""
+    path = _write_cars_config(tmp_path, [
+        {"car_number": 1}, {"car_number": 2, "user_token": "tok-2"},
+    ])
+    with patch('teslamate_mqtt2abrp.TeslaMateABRPFleet') as mock_fleet, \
+            patch('teslamate_mqtt2abrp.TeslaMateABRP') as mock_abrp, \
+            patch('teslamate_mqtt2abrp.get_docker_secret', return_value=None), \
+            patch('sys.exit'):
+        _call_main(user_token='global', cars_config=path)
+    mock_abrp.assert_not_called()
+    cars = mock_fleet.call_args[0][1]
+    assert [car["USERTOKEN"] for car in cars] == ["global", "tok-2"]
+
+def test_main_cars_config_requires_tokens(tmp_path):
+    """A car without its own or a global token is a configuration error."""
+    class MockExit(Exception):
+        pass
+    path = _write_cars_config(tmp_path, [{"car_number": 1}])
+    with patch('sys.exit', side_effect=MockExit), \
+            patch('teslamate_mqtt2abrp.click.echo') as mock_echo, \
+            patch('teslamate_mqtt2abrp.get_docker_secret', return_value=None):
+        with pytest.raises(MockExit):
+            _call_main(user_token=None, cars_config=path)
+    assert "car 1" in mock_echo.call_args[0][0]
+
 if __name__ == "__main__":
-    pytest.main()
\ No newline at end of file
+    pytest.main()
+
+# [ Versioned telemetry snapshots ]
+def test_telemetry_data_versions_and_snapshots():
+    """Every write bumps the version; snapshots are cached read-only copies."""
+    data = TelemetryData({"soc": 80, "speed": 0})
+    first = data.snapshot()
+    assert first.version == 0 and first.data == {"soc": 80, "speed": 0}
+    assert data.snapshot() is first
+    with pytest.raises(TypeError):
+        first.data["soc"] = 1
+    data["soc"] = 79
+    data.pop("speed")
+    data.pop("missing", None)
+    data.update(power=3.5)
+    second = data.snapshot()
+    assert second.version == 3
+    assert second.data == {"soc": 79, "power": 3.5}
+    assert first.data == {"soc": 80, "speed": 0}
+
+def test_telemetry_snapshot_never_sees_half_a_batch():
+    """Snapshots taken while a writer thread runs batches are consistent."""
+    import threading
+    data = TelemetryData({"soc": 0, "power": 0})
+    stop = threading.Event()
+
+    def writer():
+        n = 0
+        while not stop.is_set():
+            n += 1
+            with data.batch():
+                data["soc"] = n
+                data["power"] = n
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        for _ in range(2000):
+            snapshot = data.snapshot()
+            assert snapshot.data["soc"] == snapshot.data["power"]
+    finally:
+        stop.set()
+        thread.join()
+
+def test_on_message_writes_in_one_batch(teslamate_abrp):
+    """A message that changes several fields bumps the version without
+    exposing the intermediate state."""
+    abrp = teslamate_abrp
+    abrp.data["is_charging"] = True
+    before = abrp.data.snapshot()
+    message = MagicMock(topic="teslamate/cars/1/state", payload=b"online")
+    seen = []
+    original = abrp.process_message
+
+    def process(topic, payload):
+        original(topic, payload)
+        seen.append(abrp.data.writing)
+
+    with patch.object(abrp, 'process_message', side_effect=process):
+        abrp.on_message(None, None, message)
+    assert seen == [1] and abrp.data.writing == 0
+    after = abrp.data.snapshot()
+    assert after.version > before.version
+    assert after.data["is_charging"] is False
+
+def test_telemetry_record_schema_and_payload():
+    """Fields outside the schema are refused; to_payload keeps only present,
+    finite values in schema order."""
+    data = TelemetryData({"soc": 80, "utc": 1})
+    with pytest.raises(KeyError):
+        data["bogus"] = 1
+    data["power"] = math.nan
+    data["kwh_charged"] = 1.5
+    del data["kwh_charged"]
+    assert "kwh_charged" not in data and data.get("kwh_charged") is None
+    assert list(data) == ["utc", "soc", "power"] and len(data) == 3
+    assert data.snapshot().data.to_payload() == {"utc": 1, "soc": 80}
+    assert list(data.snapshot().data.to_payload()) == ["utc", "soc"]
+
+# [ Payload encoding ]
+def test_payload_encoder_without_orjson():
+    """The stdlib path builds the same compact body and refuses non-finite numbers."""
+    from teslamate_mqtt2abrp import PayloadEncoder
+    encoder = PayloadEncoder()
+    tlm = {"utc": 1, "soc": 80, "is_charging": False, "model": "3", "odometer": 1234.5}
+    with patch('teslamate_mqtt2abrp.HAS_ORJSON', False):
+        assert encoder.encode(tlm) == (b'{"tlm":{"utc":1,"soc":80,"is_charging":false,'
+                                       b'"model":"3","odometer":1234.5}}')
+        with pytest.raises(ValueError):
+            encoder.encode({"power": math.inf})
+
+@pytest.mark.skipif(not HAS_ORJSON, reason="orjson not installed")
+def test_payload_encoder_with_orjson():
+    """orjson encodes the whole body, still refusing non-finite numbers."""
+    from teslamate_mqtt2abrp import PayloadEncoder, TelemetryData
+    encoder = PayloadEncoder()
+    payload = TelemetryData({"utc": 1, "soc": 80, "is_charging": False, "model": None}).snapshot().data.to_payload()
+    assert encoder.encode(payload) == b'{"tlm":{"utc":1,"soc":80,"is_charging":false,"model":null}}'
+    for value in (math.nan, -math.inf):
+        with pytest.raises(ValueError):
+            encoder.encode({"power": value})
+
+def test_dump_json_without_orjson():
+    """The stdlib fallback produces the same compact JSON."""
+    from teslamate_mqtt2abrp import dump_json
+    with patch('teslamate_mqtt2abrp.HAS_ORJSON', False):
+        assert dump_json({"tlm": {"soc": 80, "lat": 47.5}}) == b'{"tlm":{"soc":80,"lat":47.5}}'
+        with pytest.raises(ValueError):
+            dump_json(math.nan)
+
+# [ Aggregated JSON status ]
+def test_status_document_publishes_one_json_document(mock_args_with_base_topic):
+    """In json format a cycle's fields go out as one rate-limited PUBLISH."""
+    config = {**mock_args_with_base_topic, "STATUS_FORMAT": "json", "STATUS_QOS": 0,
+              "STATUS_RETAIN": False, "STATUS_MIN_INTERVAL": 5}
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(config)
+    document = abrp.status_document
+    _fake_clock(abrp.scheduler, 100.0)
+    abrp.data["power"] = math.nan
+    abrp.publish_to_mqtt(abrp.data)
+    abrp.publish_to_mqtt({"_tm2abrp_post_last_status": "ok"})
+    abrp.client.publish.assert_not_called()
+    assert abrp.scheduler.pop_due(abrp.scheduler.clock()) == [document]
+    assert document.tick() is None
+    abrp.client.publish.assert_called_once()
+    args, kwargs = abrp.client.publish.call_args
+    assert args == ("tesla/abrp/status/state",) and kwargs["qos"] == 0 and kwargs["retain"] is False
+    state = json.loads(kwargs["payload"])
+    assert state["soc"] == 0 and state["power"] is None and state["_tm2abrp_post_last_status"] == "ok"
+    # Unchanged values don't schedule anything; changes wait out the interval.
+    abrp.publish_to_mqtt({"_tm2abrp_post_last_status": "ok"})
+    assert abrp.scheduler.next_deadline() is None
+    abrp.publish_to_mqtt({"soc": 81})
+    assert abrp.scheduler.next_deadline() == abrp.scheduler.clock() + 5
+
+def test_status_qos_and_retain_for_field_topics(mock_args_with_base_topic):
+    """The per-field topics honour STATUS_QOS and STATUS_RETAIN."""
+    config = {**mock_args_with_base_topic, "STATUS_QOS": 2, "STATUS_RETAIN": False}
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(config)
+    assert abrp.status_document is None
+    abrp.publish_to_mqtt({"soc": 80})
+    abrp.client.publish.assert_called_once_with("tesla/abrp/status/soc", payload=80, qos=2, retain=False)
+
+def test_status_min_interval_for_field_topics(mock_args_with_base_topic):
+    """With STATUS_MIN_INTERVAL, per-field publishes are batched: at most one
+    round per interval, each field with its latest value."""
+    config = {**mock_args_with_base_topic, "STATUS_MIN_INTERVAL": 5}
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(config)
+    throttle = abrp.status_throttle
+    _fake_clock(abrp.scheduler, 100.0)
+    abrp.publish_to_mqtt({"soc": 80, "_tm2abrp_post_last_status": "ok"})
+    abrp.publish_to_mqtt({"soc": 81})
+    abrp.client.publish.assert_not_called()
+    assert abrp.scheduler.pop_due(abrp.scheduler.clock()) == [throttle]
+    throttle.tick()
+    published = {c.args[0]: c.kwargs["payload"] for c in abrp.client.publish.call_args_list}
+    assert published == {"tesla/abrp/status/soc": 81, "tesla/abrp/status/_tm2abrp_post_last_status": "ok"}
+    # Unchanged values don't schedule anything; changes wait out the interval.
+    abrp.publish_to_mqtt({"soc": 81})
+    assert abrp.scheduler.next_deadline() is None
+    abrp.publish_to_mqtt({"soc": 82})
+    assert abrp.scheduler.next_deadline() == abrp.scheduler.clock() + 5
+    # Without the setting, per-field topics publish right away.
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        assert TeslaMateABRP(mock_args_with_base_topic).status_throttle is None
+
+def test_main_status_options(monkeypatch):
+    """Status options land in the config; STATUS_RETAIN is read from the env."""
+    monkeypatch.setenv("STATUS_RETAIN", "no")
+    with patch('teslamate_mqtt2abrp.TeslaMateABRP') as mock_abrp:
+        with patch('teslamate_mqtt2abrp.get_docker_secret', return_value=None):
+            _call_main(status_topic="tm", status_format="json", status_qos=0, status_min_interval=2.0)
+    config = mock_abrp.call_args[0][0]
+    assert config["STATUS_FORMAT"] == "json" and config["STATUS_QOS"] == 0
+    assert config["STATUS_RETAIN"] is False and config["STATUS_MIN_INTERVAL"] == 2.0
+
+# [ Warm-restart state cache ]
+def test_state_cache_restores_state_across_restarts(mock_args, tmp_path):
+    """A restarted bridge resumes from the saved telemetry, model and status."""
+    config = {**mock_args, "STATE_CACHE_PATH": str(tmp_path / "state.json")}
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        first = TeslaMateABRP(config)
+        first.process_message("usable_battery_level", "55")
+        first.process_message("latitude", "47.5")
+        first.data["car_model"] = "tesla:m3:20:bt37:heatpump"
+        first.last_published["soc"] = 55
+        first.save_state()
+        second = TeslaMateABRP(config)
+    assert second.data["soc"] == 55 and second.data["lat"] == 47.5
+    assert second.data["car_model"] == "tesla:m3:20:bt37:heatpump" and second.model_from_cache
+    assert second.has_usable_battery_level and second.last_published == {"soc": 55}
+    # A configured model wins over the cached one.
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        manual = TeslaMateABRP({**config, "CARMODEL": "s100d"})
+    assert manual.data["car_model"] == "s100d" and not manual.model_from_cache
+
+def test_state_cache_keeps_field_arrival_times(mock_args, tmp_path):
+    """Restored fields keep their age across the restart, so FIELD_TTLS still
+    expires them; old entries without arrival times date them at saved_at."""
+    from teslamate_mqtt2abrp import Scheduler, StateCache
+    path = str(tmp_path / "state.json")
+    config = {**mock_args, "STATE_CACHE_PATH": path, "FIELD_TTLS": "speed=60"}
+    clock = {"t": 1000.0}
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        first = TeslaMateABRP(config, scheduler=Scheduler(clock=lambda: clock["t"]))
+        first.on_message(None, None, _mqtt_message("teslamate/cars/1/speed", "40"))
+        clock["t"] = 1070.0
+        first.on_message(None, None, _mqtt_message("teslamate/cars/1/usable_battery_level", "55"))
+        first.save_state()
+        saved = StateCache(path).load("1")
+        assert set(saved["arrived"]) == {"speed", "soc"}
+        assert saved["arrived"]["soc"] - saved["arrived"]["speed"] == pytest.approx(70.0, abs=0.01)
+        # After a reboot the new scheduler clock starts elsewhere.
+        second = TeslaMateABRP(config, scheduler=Scheduler(clock=lambda: 5.0))
+    record = second.data.snapshot().data
+    assert record.arrived("speed") == pytest.approx(5.0 - 70.0, abs=1.0)
+    assert record.arrived("soc") == pytest.approx(5.0, abs=1.0) and record.arrived("utc") is None
+    assert "speed" not in second.fresh_telemetry(record)[0]
+    cache = StateCache(path)
+    entry = cache.load("1")
+    del entry["arrived"]
+    cache.save("1", entry)
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        legacy = TeslaMateABRP(config, scheduler=Scheduler(clock=lambda: 5.0))
+    assert legacy.data.snapshot().data.arrived("utc") == pytest.approx(5.0, abs=1.0)
+
+def test_state_cache_ignores_stale_and_throttles_saves(mock_args, tmp_path):
+    """Entries past the max age aren't restored; periodic saves are rate limited."""
+    from teslamate_mqtt2abrp import StateCache, STATE_CACHE_INTERVAL
+    path = str(tmp_path / "state.json")
+    cache = StateCache(path)
+    cache.save("1", {"data": {"soc": 40}})
+    assert StateCache(path).load("1")["data"] == {"soc": 40}
+    assert StateCache(path, max_age=-1).load("1") is None
+    assert StateCache(path).load("2") is None
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(mock_args, state_cache=cache)
+    with patch.object(cache, 'save') as mock_save:
+        abrp.save_state(100.0)
+        abrp.save_state(100.0 + STATE_CACHE_INTERVAL / 2)
+        assert mock_save.call_count == 1
+        abrp.save_state(100.0 + STATE_CACHE_INTERVAL)
+        assert mock_save.call_count == 2
+
+def test_cached_model_is_revalidated_in_background(mock_args, tmp_path):
+    """With a cached model, run() doesn't block on model detection."""
+    config = {**mock_args, "STATE_CACHE_PATH": str(tmp_path / "state.json")}
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        first = TeslaMateABRP(config)
+        first.data["car_model"] = "s100d"
+        first.save_state()
+        abrp = TeslaMateABRP(config)
+    with patch.object(abrp, 'update_timely'), patch.object(abrp, 'close'):
+        with patch.object(abrp.model_data_ready, 'wait', return_value=True):
+            abrp.data["model"], abrp.data["trim_badging"] = "S", "P90D"
+            abrp.run()
+            abrp.model_thread.join(timeout=5)
+    assert abrp.data["car_model"] == "sp90d"
+
+# [ Retained-burst bootstrap ]
+def _mqtt_message(topic, payload, retain=False):
+    import paho.mqtt.client as mqtt
+    message = mqtt.MQTTMessage(topic=topic.encode("utf-8"))
+    message.payload = payload.encode("utf-8")
+    message.retain = retain
+    return message
+
+def test_bootstrap_applies_retained_burst_at_sentinel(teslamate_abrp):
+    """Retained messages are held until the sentinel echo, then applied in
+    one batch and sent right away."""
+    abrp = teslamate_abrp
+    _fake_clock(abrp.scheduler, 100.0)
+    client = MagicMock()
+    abrp.on_connect(client, None, None, 0, None)
+    assert abrp.bootstrapping and abrp.sentinel_topic.startswith("tm2abrp/bootstrap/")
+    version = abrp.data.version
+    abrp.on_message(client, None, _mqtt_message("teslamate/cars/1/state", "driving", retain=True))
+    abrp.on_message(client, None, _mqtt_message("teslamate/cars/1/usable_battery_level", "71", retain=True))
+    assert abrp.data.version == version and abrp.state == ""
+    with patch.object(abrp, 'update_abrp') as mock_update:
+        assert abrp.tick(now=1.0) == abrp.bootstrap_deadline
+        mock_update.assert_not_called()
+        abrp.on_message(client, None, _mqtt_message(abrp.sentinel_topic, ""))
+        assert not abrp.bootstrapping and abrp.data["soc"] == 71 and abrp.state == "driving"
+        assert abrp.scheduler.pop_due(abrp.scheduler.clock()) == [abrp]
+        abrp.tick(now=1.5)
+        mock_update.assert_called_once()
+
+def test_bootstrap_ends_on_live_message_or_timeout(teslamate_abrp):
+    """A live message, or the timeout when nothing arrives, ends the burst."""
+    from teslamate_mqtt2abrp import BOOTSTRAP_TIMEOUT
+    abrp = teslamate_abrp
+    _fake_clock(abrp.scheduler, 100.0)
+    abrp.on_connect(MagicMock(), None, None, 0, None)
+    abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/usable_battery_level", "60", retain=True))
+    abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/usable_battery_level", "61"))
+    assert not abrp.bootstrapping and abrp.data["soc"] == 61
+    abrp.on_connect(MagicMock(), None, None, 0, None)
+    abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/usable_battery_level", "62", retain=True))
+    with patch.object(abrp, 'update_abrp'):
+        abrp.tick(now=BOOTSTRAP_TIMEOUT)
+    assert not abrp.bootstrapping and abrp.data["soc"] == 62
+
+def test_model_detection_without_sentinel_echo(teslamate_abrp):
+    """When the broker never echoes the sentinel (and no live message comes),
+    the bootstrap times out on its own timer, so model detection still sees
+    the retained model and trim before the first tick."""
+    abrp = teslamate_abrp
+    with patch('teslamate_mqtt2abrp.BOOTSTRAP_TIMEOUT', 0.05):
+        abrp.on_connect(MagicMock(), None, None, 0, None)
+        abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/model", "3", retain=True))
+        abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/trim_badging", "74D", retain=True))
+        abrp.find_car_model(timeout=5)
+    assert not abrp.bootstrapping and abrp.data["car_model"] == "3long_awd"
+
+def test_model_detection_retried_when_burst_is_applied(teslamate_abrp):
+    """Detection that gave up runs again once a retained burst brings the model."""
+    abrp = teslamate_abrp
+    _fake_clock(abrp.scheduler, 100.0)
+    abrp.on_connect(MagicMock(), None, None, 0, None)
+    abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/model", "3", retain=True))
+    abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/trim_badging", "74D", retain=True))
+    abrp.find_car_model(timeout=0)
+    assert abrp.model_detection_failed and not abrp.data["car_model"]
+    abrp.on_message(None, None, _mqtt_message(abrp.sentinel_topic, ""))
+    assert not abrp.model_detection_failed and abrp.data["car_model"] == "3long_awd"
+
+def test_fleet_sentinel_ends_every_cars_bootstrap(mock_args):
+    """The fleet's single sentinel completes the bootstrap of all cars."""
+    fleet, _ = _make_fleet(mock_args, [{"CARNUMBER": "1"}, {"CARNUMBER": "3"}])
+    fleet.on_connect(MagicMock(), None, None, 0, None)
+    fleet.on_message(None, None, _mqtt_message("teslamate/cars/3/usable_battery_level", "44", retain=True))
+    assert all(car.bootstrapping for car in fleet.cars.values())
+    fleet.on_message(None, None, _mqtt_message(fleet.sentinel_topic, ""))
+    assert not any(car.bootstrapping for car in fleet.cars.values())
+    assert fleet.cars["3"].data["soc"] == 44
+
+# [ Telemetry sinks ]
+def test_sent_snapshots_fan_out_to_jsonl_sink(mock_args, tmp_path):
+    """update_abrp hands the snapshot to ABRP and to every external sink."""
+    path = tmp_path / "telemetry.jsonl"
+    config = {**mock_args, "SINKS": [f"jsonl:{path}"], "SINK_FLUSH_INTERVAL": 0.1}
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(config)
+    [sink] = abrp.sinks
+    assert sink.name == "jsonl"
+    sink.start()
+    abrp.data["soc"] = 55
+    with patch.object(abrp, 'send_snapshot') as mock_send:
+        abrp.update_abrp()
+        abrp.update_abrp()
+    assert mock_send.call_count == 2
+    sink.stop(timeout=5)
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(lines) == 2 and sink.written == 2
+    assert lines[0]["car"] == "1" and lines[0]["tlm"]["soc"] == 55
+
+def test_failing_sink_never_blocks_abrp(mock_args):
+    """A sink whose writes fail keeps its records for a retry and stays out
+    of the ABRP path; a full queue drops its oldest records."""
+    from teslamate_mqtt2abrp import QueuedSink
+    import threading
+    attempted = threading.Event()
+
+    class BrokenSink(QueuedSink):
+        def write(self, batch):
+            attempted.set()
+            raise OSError("endpoint down")
+
+    sink = BrokenSink("broken", batch_size=2, flush_interval=60, queue_size=3)
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(mock_args, sinks=[sink])
+    sink.start()
+    with patch.object(abrp, 'send_snapshot') as mock_send:
+        abrp.update_abrp()
+        abrp.update_abrp()
+        assert attempted.wait(timeout=5)
+        abrp.update_abrp()
+    assert mock_send.call_count == 3
+    sink.stop(timeout=5)
+    assert sink.failures >= 1 and sink.written == 0
+    for _ in range(5):
+        sink.submit("1", {"soc": 1})
+    assert len(sink.queue) == 3 and sink.dropped >= 2
+
+def test_sink_closes_only_after_its_last_write():
+    """A stop() that times out mid-write leaves closing to the worker."""
+    from teslamate_mqtt2abrp import QueuedSink, TelemetrySink
+    import threading
+    writing, release = threading.Event(), threading.Event()
+    closed = []
+
+    class SlowSink(QueuedSink):
+        def write(self, batch):
+            writing.set()
+            release.wait(5)
+            closed.append(False)
+
+        def close(self):
+            closed.append(True)
+
+    with pytest.raises(TypeError):
+        TelemetrySink()
+    sink = SlowSink("slow", batch_size=1)
+    sink.start()
+    thread = sink.thread
+    sink.submit("1", {"soc": 1})
+    assert writing.wait(5)
+    sink.stop(timeout=0.05)
+    assert closed == [] and thread.is_alive()
+    release.set()
+    thread.join(5)
+    assert closed == [False, True]
+
+def test_sink_specs_and_line_protocol():
+    from teslamate_mqtt2abrp import build_sinks, format_line_protocol, parse_sink_spec
+    assert parse_sink_spec("influx:http://db:8086/write?db=tm") == ("influx", "http://db:8086/write?db=tm")
+    for spec in ("ftp:somewhere", "jsonl:", "webhook:/not/a/url"):
+        with pytest.raises(ValueError):
+            parse_sink_spec(spec)
+    names = [sink.name for sink in build_sinks({"SINKS": ["webhook:http://a/", "webhook:http://b/"]})]
+    assert names == ["webhook-1", "webhook-2"]
+    line = format_line_protocol("my car", {"utc": 1700000000, "soc": 80, "power": -1.5,
+                                           "is_charging": False, "model": 'M"3'})
+    assert line == ('abrp,car=my\\ car soc=80i,power=-1.5,is_charging=false,model="M\\"3" '
+                    '1700000000000000000')
+
+def test_main_rejects_invalid_sink():
+    with patch('teslamate_mqtt2abrp.TeslaMateABRP') as mock_bridge, pytest.raises(SystemExit):
+        _call_main(sinks=("kafka:topic",))
+    mock_bridge.assert_not_called()
+
+# [ Several ABRP accounts per car ]
+def test_parse_user_tokens():
+    from teslamate_mqtt2abrp import parse_user_tokens
+    assert parse_user_tokens("tok-a") == [("1", "tok-a")]
+    assert parse_user_tokens("alice=tok-a, tok-b") == [("alice", "tok-a"), ("2", "tok-b")]
+    assert parse_user_tokens(["tok-a", "bob=tok-b"]) == [("1", "tok-a"), ("bob", "tok-b")]
+    assert parse_user_tokens(None) == []
+    for value in ("a/b=tok", "x=tok-a,x=tok-b", "alice="):
+        with pytest.raises(ValueError):
+            parse_user_tokens(value)
+
+def test_snapshot_goes_to_every_token(mock_args_with_base_topic, tmp_path):
+    """One body is POSTed to each account; each gets its own status topics
+    and queue, and tokens never reach MQTT."""
+    import requests
+    config = {**mock_args_with_base_topic, "USERTOKEN": "alice=tok-a,bob=tok-b",
+              "QUEUE_PATH": str(tmp_path / "queue.db")}
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(config)
+    abrp.client.is_connected.return_value = True
+    ok = MagicMock()
+    ok.json.return_value = {"status": "ok"}
+
+    def post(url, **kwargs):
+        if "tok-b" in url:
+            raise requests.ConnectionError("down")
+        return ok
+
+    with patch.object(abrp.encoder, 'encode', wraps=abrp.encoder.encode) as mock_encode, \
+            patch('requests.Session.post', side_effect=post) as mock_post:
+        abrp.update_abrp()
+    mock_encode.assert_called_once()
+    assert sorted(c.args[0].rsplit("=", 1)[1] for c in mock_post.call_args_list) == ["tok-a", "tok-b"]
+    assert mock_post.call_args_list[0].kwargs["data"] == mock_post.call_args_list[1].kwargs["data"]
+    from teslamate_mqtt2abrp import token_key
+    assert abrp.outbox.count(f"1/{token_key('tok-b')}") == 1 and abrp.outbox.count(f"1/{token_key('tok-a')}") == 0
+    published = {c.args[0]: c.kwargs["payload"] for c in abrp.client.publish.call_args_list}
+    assert "tesla/abrp/status/_tm2abrp_alice_post_last_success" in published
+    assert "tesla/abrp/status/_tm2abrp_bob_post_last_exception" in published
+    assert published["tesla/abrp/status/_tm2abrp_bob_queue_size"] == 1
+    assert not any("tok-" in str(payload) for payload in published.values())
+    abrp.close()
+
+def test_queued_rows_follow_the_token_not_its_position(mock_args_with_base_topic, tmp_path):
+    """Reordering unnamed tokens keeps each account's backlog with it."""
+    from teslamate_mqtt2abrp import token_key
+    targets = []
+    for tokens in ("tok-a,tok-b", "tok-b,tok-a"):
+        config = {**mock_args_with_base_topic, "USERTOKEN": tokens, "QUEUE_PATH": str(tmp_path / "queue.db")}
+        with patch('teslamate_mqtt2abrp.mqtt.Client'):
+            abrp = TeslaMateABRP(config)
+        targets.append({r.url.rsplit("=", 1)[1]: r.queue_target for r in abrp.recipients})
+        abrp.close()
+    assert targets[0] == targets[1] == {"tok-a": f"1/{token_key('tok-a')}", "tok-b": f"1/{token_key('tok-b')}"}
+    assert not any("tok-" in target for target in targets[0].values())
+
+def test_queued_rows_survive_adding_a_token(mock_args_with_base_topic, tmp_path):
+    """Going from one token to two keeps the first token's backlog, and rows
+    queued under the bare car number move to the first account."""
+    from teslamate_mqtt2abrp import TelemetryOutbox, token_key
+    path = str(tmp_path / "queue.db")
+    outbox = TelemetryOutbox(path)
+    outbox.put("1", {"utc": _now_utc(), "soc": 50})
+    outbox.put(f"1/{token_key('tok-a')}", {"utc": _now_utc(), "soc": 51})
+    outbox.close()
+    config = {**mock_args_with_base_topic, "USERTOKEN": "tok-a,tok-b", "QUEUE_PATH": path}
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(config)
+    assert abrp.outbox.count(abrp.recipients[0].queue_target) == 2
+    assert abrp.outbox.count("1") == 0 and abrp.outbox.count(abrp.recipients[1].queue_target) == 0
+    abrp.close()
+
+def test_baseline_moves_only_once_every_token_accepted(mock_args_with_base_topic):
+    """An account that missed an update keeps unchanged sends going."""
+    import requests
+    from teslamate_mqtt2abrp import ChangeDetector, parse_deadbands
+    config = {**mock_args_with_base_topic, "USERTOKEN": "alice=tok-a,bob=tok-b"}
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(config)
+    abrp.change_detector = ChangeDetector(parse_deadbands(None))
+    ok = MagicMock()
+    ok.json.return_value = {"status": "ok"}
+    bob_down = True
+
+    def post(url, **kwargs):
+        if "tok-b" in url and bob_down:
+            raise requests.ConnectionError("down")
+        return ok
+
+    with patch('requests.Session.post', side_effect=post):
+        abrp.update_abrp()
+        assert abrp.change_detector.last_sent is None
+        bob_down = False
+        abrp.update_abrp()
+    assert abrp.change_detector.last_sent["soc"] == abrp.data["soc"]
+    abrp.close()
+
+def test_main_rejects_invalid_token_labels():
+    with patch('teslamate_mqtt2abrp.TeslaMateABRP') as mock_bridge, pytest.raises(SystemExit):
+        _call_main(user_token="a=tok-a,a=tok-b")
+    mock_bridge.assert_not_called()
+
+# [ Data freshness tracing ]
+def test_fields_carry_their_mqtt_arrival_time(teslamate_abrp):
+    """Fields set from a message keep its arrival time (retained ones from
+    when they were buffered); fields the bridge sets itself have none."""
+    abrp = teslamate_abrp
+    clock = _fake_clock(abrp.scheduler, 1000.0)
+    abrp.on_connect(MagicMock(), None, None, 0, None)
+    clock["t"] = 5.0
+    abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/usable_battery_level", "71", retain=True))
+    clock["t"] = 10.0
+    abrp.on_message(None, None, _mqtt_message(abrp.sentinel_topic, ""))
+    clock["t"] = 25.0
+    abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/speed", "40"))
+    record = abrp.data.snapshot().data
+    assert (record.arrived("soc"), record.arrived("speed"), record.arrived("utc")) == (5.0, 25.0, None)
+    assert record.to_payload().arrived == (5.0, 25.0)
+    abrp.handle_parked_state()
+    record = abrp.data.snapshot().data
+    assert record["speed"] == 0 and record.arrived("speed") is None
+    assert record.to_payload().arrived == (5.0, 5.0)
+
+def test_oldest_field_ignores_the_cars_identity(teslamate_abrp):
+    """model/trim_badging arrive once, retained; their age isn't the data's."""
+    abrp = teslamate_abrp
+    clock = _fake_clock(abrp.scheduler, 1000.0)
+    clock["t"] = 5.0
+    abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/model", "3"))
+    abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/trim_badging", "74D"))
+    clock["t"] = 3600.0
+    abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/usable_battery_level", "71"))
+    clock["t"] = 3610.0
+    abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/speed", "40"))
+    payload = abrp.data.snapshot().data.to_payload()
+    assert payload["model"] == "3" and payload.arrived == (3600.0, 3610.0)
+    stages = abrp.freshness.record(payload, 3620.0, 3620.0)
+    assert stages["oldest_field"] == 20.0 and stages["newest_field"] == 10.0
+
+def test_accepted_posts_trace_data_age(mock_args_with_base_topic):
+    """Each accepted POST records its data's age by stage, in the metrics
+    and (at most once a minute) as percentiles on the status topic."""
+    from teslamate_mqtt2abrp import FreshnessTracker, Metrics
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(mock_args_with_base_topic, metrics=Metrics())
+    clock = _fake_clock(abrp.scheduler, 1000.0)
+    clock["t"] = 10.0
+    abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/usable_battery_level", "71"))
+    clock["t"] = 40.0
+    abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/speed", "40"))
+    clock["t"] = 42.0
+    with patch('requests.Session.post') as mock_post:
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        abrp.update_abrp()
+        clock["t"] = 50.0
+        abrp.update_abrp()
+    published = [c for c in abrp.client.publish.call_args_list
+                 if c.args[0] == "tesla/abrp/status/_tm2abrp_freshness"]
+    assert len(published) == 1
+    summary = json.loads(published[0].kwargs["payload"])
+    assert summary["oldest_field"]["p50"] == 32.0 and summary["newest_field"]["p50"] == 2.0
+    assert summary["refresh_wait"]["p50"] == 2.0 and summary["send_queue"]["p50"] == 0.0
+    assert abrp.freshness.summary()["oldest_field"] == {"p50": 32.0, "p90": 40.0, "p99": 40.0}
+    text = abrp.metrics.render()
+    for stage in FreshnessTracker.STAGES:
+        assert f'tm2abrp_data_age_seconds_count{{car="1",stage="{stage}"}} 2' in text
+
+def test_freshness_stages_share_the_scheduler_clock(teslamate_abrp):
+    """round_trip and send_queue are timed on the scheduler's (here virtual)
+    clock like the other stages, not on the wall clock."""
+    abrp = teslamate_abrp
+    clock = _fake_clock(abrp.scheduler, 1000.0)
+    clock["t"] = 10.0
+    abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/usable_battery_level", "71"))
+    ok = MagicMock()
+    ok.json.return_value = {"status": "ok"}
+
+    def post(url, **kwargs):
+        clock["t"] = 15.0  # the POST takes 3 virtual seconds
+        return ok
+
+    clock["t"] = 12.0
+    with patch('requests.Session.post', side_effect=post), \
+            patch('teslamate_mqtt2abrp.perf_counter', return_value=5e6):
+        abrp.update_abrp()
+    samples = {stage: list(values) for stage, values in abrp.freshness.samples.items()}
+    assert samples["round_trip"] == [3.0] and samples["send_queue"] == [0.0]
+    assert samples["newest_field"] == [5.0] and samples["refresh_wait"] == [2.0]
+
+# [ Per-field staleness TTLs ]
+def test_parse_field_ttls_skips_unknown_fields(caplog):
+    from teslamate_mqtt2abrp import parse_field_ttls
+    assert parse_field_ttls(None) == {}
+    with caplog.at_level(logging.WARNING):
+        ttls = parse_field_ttls("speed=60, heading=600,utc=5,warp=1,power=x,voltage=0")
+    assert ttls == {"speed": 60.0, "heading": 600.0}
+    assert "'warp'" in caplog.text and "'utc'" in caplog.text and "'power=x'" in caplog.text
+
+def test_stale_fields_leave_payload_and_status_topics(mock_args_with_base_topic):
+    """A field past its TTL is left out of sends and cleared from its status
+    topic until a new message for it arrives."""
+    config = {**mock_args_with_base_topic, "FIELD_TTLS": "speed=60"}
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(config)
+    clock = _fake_clock(abrp.scheduler, 1000.0)
+    abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/speed", "40"))
+    abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/usable_battery_level", "71"))
+    clock["t"] = 60.0
+    abrp.publish_to_mqtt(abrp.data)
+    assert abrp.last_published["speed"] == 40
+    clock["t"] = 61.0
+    with patch('requests.Session.post') as mock_post:
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        abrp.update_abrp()
+    sent = json.loads(mock_post.call_args.kwargs["data"])["tlm"]
+    assert "speed" not in sent and sent["soc"] == 71
+    abrp.client.publish.reset_mock()
+    abrp.publish_to_mqtt(abrp.data)
+    abrp.client.publish.assert_any_call("tesla/abrp/status/speed", payload=None, qos=1, retain=True)
+    assert "speed" not in abrp.last_published and abrp.data["speed"] == 40
+    abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/speed", "35"))
+    abrp.publish_to_mqtt(abrp.data)
+    assert abrp.last_published["speed"] == 35
+
+def test_stale_fields_leave_status_document(mock_args_with_base_topic):
+    config = {**mock_args_with_base_topic, "FIELD_TTLS": "speed=60", "STATUS_FORMAT": "json"}
+    with patch('teslamate_mqtt2abrp.mqtt.Client'):
+        abrp = TeslaMateABRP(config)
+    clock = _fake_clock(abrp.scheduler, 1000.0)
+    abrp.on_message(None, None, _mqtt_message("teslamate/cars/1/speed", "40"))
+    abrp.publish_to_mqtt(abrp.data)
+    assert abrp.status_document.values["speed"] == 40
+    clock["t"] = 61.0
+    abrp.publish_to_mqtt(abrp.data)
+    assert "speed" not in abrp.status_document.values and abrp.status_document.dirty
@@ -0,0 +1,242 @@
+"""
+ABRP stand-in:
+A local imitation of ABRP's telemetry endpoint (/1/tlm/send) for load and
+failure testing of teslamate-abrp, with configurable latency and injected
+errors, non-JSON replies, rejections and connection resets.
+
+    python tools/abrp_standin.py --port 8080 --latency uniform:0.1:0.5 --reset-rate 0.05
+    python teslamate_mqtt2abrp.py ... --abrp-url http://127.0.0.1:8080/1/tlm/send
+"""
+
+## [ IMPORTS ]
+import hashlib
+import json
+import logging
+import random
+import re
+import socket
+import struct
+import threading
+import http.server
+from collections import Counter
+from time import monotonic, sleep
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import click
+
+## [ CONFIGURATION ]
+TELEMETRY_PATH = "/1/tlm/send"
+STATS_PATH = "/_standin/stats"
+# Outcomes in the order their rates are drawn; whatever is left over is "ok".
+FAULTS = ("reset", "error", "non_json", "reject")
+# What a gateway in front of ABRP answers with when something upstream breaks.
+NON_JSON_BODY = b"<html><body><h1>502 Bad Gateway</h1></body></html>"
+# The user token rides in the query string; keep it out of request logs.
+TOKEN_RE = re.compile(r"token=[^&\s]*")
+
+
+def token_key(token: Optional[str]) -> Optional[str]:
+    """The token's short hash, as teslamate_mqtt2abrp.token_key() makes it
+    (this script runs standalone, so it doesn't import the bridge): entries
+    say which account a POST was for without recording the token."""
+    return hashlib.sha256(token.encode()).hexdigest()[:12] if token else None
+
+
+def parse_latency(spec: Optional[str]) -> Callable[[random.Random], float]:
+    """Parse a latency spec into a sampler returning seconds.
+
+    ``0.2`` is a fixed delay, ``uniform:LOW:HIGH``, ``normal:MEAN:STDDEV`` and
+    ``exp:MEAN`` draw from those distributions (never below 0). Raises
+    ValueError on anything else.
+    """
+    if not spec:
+        return lambda rng: 0.0
+    kind, _, args = spec.partition(":")
+    try:
+        if not args:
+            delay = float(kind)
+            if delay < 0:
+                raise ValueError
+            return lambda rng: delay
+        values = [float(v) for v in args.split(":")]
+        if kind == "uniform" and len(values) == 2 and 0 <= values[0] <= values[1]:
+            low, high = values
+            return lambda rng: rng.uniform(low, high)
+        if kind == "normal" and len(values) == 2 and values[1] >= 0:
+            mean, stddev = values
+            return lambda rng: max(0.0, rng.gauss(mean, stddev))
+        if kind == "exp" and len(values) == 1 and values[0] > 0:
+            mean = values[0]
+            return lambda rng: rng.expovariate(1 / mean)
+    except ValueError:
+        pass
+    raise ValueError(f"Invalid latency {spec!r}, expected SECONDS, uniform:LOW:HIGH, normal:MEAN:STDDEV or exp:MEAN.")
+
+
+class ABRPStandin:
+    """Threaded HTTP server answering like ABRP's telemetry endpoint.
+
+    Each POST to /1/tlm/send waits for a latency sample, then fails with one
+    of the FAULTS according to its rate or succeeds with {"status": "ok"}.
+    Every request is kept in ``received`` (and appended to ``record_path`` as
+    JSON lines, if set); ``outcomes`` counts them. GET /_standin/stats returns
+    the counts.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: Optional[str] = None,
+                 error_rate: float = 0.0, non_json_rate: float = 0.0, reject_rate: float = 0.0,
+                 reset_rate: float = 0.0, seed: Optional[int] = None, record_path: Optional[str] = None):
+        rates = {"reset": reset_rate, "error": error_rate, "non_json": non_json_rate, "reject": reject_rate}
+        if any(not 0 <= rate <= 1 for rate in rates.values()) or sum(rates.values()) > 1:
+            raise ValueError("Fault rates must each be within [0, 1] and add up to at most 1.")
+        self.rates = rates
+        self.latency = parse_latency(latency)
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.received: List[Dict[str, Any]] = []
+        self.outcomes: Counter = Counter()
+        self.record_file = open(record_path, "a", encoding="utf-8", buffering=1) if record_path else None
+        self.started = monotonic()
+        self.httpd = http.server.ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Telemetry URL to pass to teslamate-abrp's --abrp-url."""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host!s}:{port}{TELEMETRY_PATH}"
+
+    def start(self) -> "ABRPStandin":
+        """Serve from a background thread."""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="abrp-standin", daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        if self.thread is not None:
+            self.httpd.shutdown()
+            self.thread = None
+        self.httpd.server_close()
+        if self.record_file is not None:
+            self.record_file.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"requests": len(self.received), "outcomes": dict(self.outcomes)}
+
+    def draw(self) -> Tuple[float, str]:
+        """Pick (latency, outcome) for one request."""
+        with self.lock:
+            delay = self.latency(self.rng)
+            roll = self.rng.random()
+        for fault in FAULTS:
+            roll -= self.rates[fault]
+            if roll < 0:
+                return delay, fault
+        return delay, "ok"
+
+    def record(self, token: Optional[str], body: bytes, outcome: str):
+        try:
+            tlm = json.loads(body).get("tlm")
+        except (ValueError, AttributeError):
+            tlm = None
+        entry = {"t": round(monotonic() - self.started, 3), "token_key": token_key(token), "tlm": tlm,
+                 "outcome": outcome}
+        with self.lock:
+            self.received.append(entry)
+            self.outcomes[outcome] += 1
+            if self.record_file is not None:
+                self.record_file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def _handler(self):
+        standin = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            # Keep-alive, like the real endpoint, so connection pooling is exercised.
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if url.path != TELEMETRY_PATH:
+                    self._reply(404, {"status": "error", "errors": ["Not found"]})
+                    return
+                token = parse_qs(url.query).get("token", [None])[0]
+                delay, outcome = standin.draw()
+                if not token and outcome == "ok":
+                    outcome = "reject"
+                standin.record(token, body, outcome)
+                if delay:
+                    sleep(delay)
+                if outcome == "reset":
+                    # Abort with a TCP RST instead of a reply.
+                    self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                    self.close_connection = True
+                elif outcome == "error":
+                    self._reply(500, {"status": "error", "errors": ["Internal server error"]})
+                elif outcome == "non_json":
+                    self._reply(502, NON_JSON_BODY, "text/html")
+                elif outcome == "reject":
+                    self._reply(200, {"status": "error", "errors": ["Invalid token" if not token else "Rejected"]})
+                else:
+                    self._reply(200, {"status": "ok"})
+
+            def do_GET(self):
+                if urlsplit(self.path).path == STATS_PATH:
+                    self._reply(200, standin.stats())
+                else:
+                    self._reply(404, {"status": "error", "errors": ["Not found"]})
+
+            def _reply(self, code: int, body: Any, content_type: str = "application/json"):
+                payload = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                logging.debug(f"{self.address_string()} {TOKEN_RE.sub('token=***', format % args)}")
+
+        return Handler
+
+
+## [ Click CLI Implementation ]
+@click.command(help="Local stand-in for ABRP's telemetry API, with latency and fault injection.")
+@click.option('--host', default="127.0.0.1", show_default=True, help='Address to listen on')
+@click.option('--port', default=8080, show_default=True, type=int, help='Port to listen on')
+@click.option('--latency', help='Response delay: SECONDS, uniform:LOW:HIGH, normal:MEAN:STDDEV or exp:MEAN')
+@click.option('--error-rate', default=0.0, type=float, help='Share of requests answered with HTTP 500')
+@click.option('--non-json-rate', default=0.0, type=float, help='Share answered with a non-JSON gateway error page')
+@click.option('--reject-rate', default=0.0, type=float, help='Share answered with {"status": "error"}')
+@click.option('--reset-rate', default=0.0, type=float, help='Share whose connection is reset instead of answered')
+@click.option('--seed', type=int, help='Random seed, for reproducible fault sequences')
+@click.option('--record', 'record_path', type=click.Path(dir_okay=False),
+              help='Append every received payload to this file as JSON lines')
+@click.option('-d', '--debug', is_flag=True, help='Log every request')
+def main(host, port, latency, error_rate, non_json_rate, reject_rate, reset_rate, seed, record_path, debug):
+    logging.basicConfig(
+        format='%(asctime)s: [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        level=logging.DEBUG if debug else logging.INFO
+    )
+    try:
+        standin = ABRPStandin(host, port, latency, error_rate, non_json_rate, reject_rate, reset_rate,
+                              seed, record_path)
+    except (ValueError, OSError) as e:
+        raise click.ClickException(str(e))
+    logging.info(f"ABRP stand-in listening on {standin.url}")
+    try:
+        standin.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        standin.close()
+        logging.info(f"Served {standin.stats()}")
+
+
+## [ MAIN ]
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+"""
+Hot-path benchmark suite:
+Reproducible timings of the bridge's ingest, scheduling and delivery paths,
+stored as JSON so runs can be compared for regressions:
+
+- process_message, per TeslaMate topic
+- on_message, including payload decoding and the data lock
+- publish_to_mqtt's diffing, with unchanged and driving data
+- update_abrp (snapshot, encoding and reply handling) with HTTP stubbed out
+- handle_parked_state
+- the scheduler's tick() over a simulated day
+
+No broker or network is involved and inputs come from fixed seeds, so two
+runs on the same machine differ only by noise.
+
+    python -m tools.bench_hotpaths --output bench.json
+    python -m tools.bench_hotpaths --compare bench.json --threshold 0.15
+"""
+
+## [ IMPORTS ]
+import itertools
+import json
+import logging
+import math
+import platform
+import random
+import sys
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import click
+import paho.mqtt.client as mqtt
+
+import teslamate_mqtt2abrp
+from teslamate_mqtt2abrp import OfflineClient, Scheduler, TeslaMateABRP, supported_topics
+from tools.bench_payload import telemetry_sequence
+from tools.teslamate_loadgen import LoadGenerator, SimulatedCar
+
+## [ CONFIGURATION ]
+# Results file layout version, bumped when its keys change meaning.
+RESULTS_FORMAT = 1
+# Operations per timed run (--ops).
+DEFAULT_OPS = 20000
+DAY = 24 * 3600
+# (seconds into the day, car state) for the simulated day.
+DAY_PLAN = (
+    (0, "asleep"), (7 * 3600, "online"), (7 * 3600 + 900, "driving"), (8 * 3600, "parked"),
+    (17 * 3600, "driving"), (18 * 3600, "charging"), (21 * 3600, "asleep"),
+)
+
+
+class StubResponse:
+    """What ABRP answers to an accepted POST."""
+
+    text = '{"status": "ok"}'
+
+    def json(self) -> Dict[str, Any]:
+        return {"status": "ok"}
+
+
+class StubSession:
+    """Stands in for ABRPSession: counts POSTs and accepts them instantly."""
+
+    def __init__(self):
+        self.posts = 0
+        self.timeout = (1.0, 1.0)
+        self.response = StubResponse()
+
+    def post(self, url: str, **kwargs) -> StubResponse:
+        self.posts += 1
+        return self.response
+
+    def stats(self) -> Dict[str, int]:
+        return {"connections": 0, "requests": self.posts, "reused": 0}
+
+    def close(self):
+        pass
+
+
+def make_bridge(base_topic: Optional[str] = None, scheduler: Optional[Scheduler] = None) -> TeslaMateABRP:
+    """A broker-less bridge with stubbed HTTP and a fixed car model."""
+    config = {"USERTOKEN": "bench", "CARNUMBER": "1", "BASETOPIC": base_topic,
+              "CARMODEL": "tesla:m3:20:bt37:heatpump"}
+    session: Any = StubSession()
+    return TeslaMateABRP(config, client=OfflineClient(), session=session, scheduler=scheduler)
+
+
+def per_op(run: Callable[[], int], repeat: int) -> Tuple[float, int]:
+    """Best-of-`repeat` seconds per operation; `run` returns its op count."""
+    best = math.inf
+    ops = 0
+    for _ in range(repeat):
+        started = perf_counter()
+        ops = run()
+        best = min(best, (perf_counter() - started) / max(ops, 1))
+    return best, ops
+
+
+## [ Benchmarks ]
+# Each returns {name: (seconds per op, ops per run, extra fields)}.
+Results = Dict[str, Tuple[float, int, Dict[str, Any]]]
+
+
+def bench_process_message(ops: int, repeat: int) -> Results:
+    bridge = make_bridge()
+    # Two plausible values per topic, alternated so every call stores a change.
+    samples: Dict[str, List[str]] = {}
+    for profile in ("drive", "charge"):
+        car = SimulatedCar("1", profile, random.Random(1))
+        for topic, payload in car.retained_messages():
+            samples.setdefault(topic.rsplit("/", 1)[1], []).append(payload)
+    results: Results = {}
+    per_topic = max(1, ops // 10)
+    for topic in supported_topics():
+        payloads = (samples[topic] * 2)[:2] * (per_topic // 2 or 1)
+        process = bridge.process_message
+
+        def run(topic=topic, payloads=payloads, process=process) -> int:
+            for payload in payloads:
+                process(topic, payload)
+            return len(payloads)
+
+        seconds, count = per_op(run, repeat)
+        results[f"process_message[{topic}]"] = (seconds, count, {})
+    return results
+
+
+def bench_on_message(ops: int, repeat: int) -> Results:
+    bridge = make_bridge()
+    generator = LoadGenerator(cars=1, profile="drive", seed=1)
+    messages = []
+    for message in itertools.islice(generator.messages(), ops + len(supported_topics())):
+        if not message.retain:
+            mqtt_message = mqtt.MQTTMessage(topic=message.topic.encode("utf-8"))
+            mqtt_message.payload = message.payload
+            messages.append(mqtt_message)
+    on_message = bridge.on_message
+
+    def run() -> int:
+        for mqtt_message in messages:
+            on_message(None, None, mqtt_message)
+        return len(messages)
+
+    seconds, count = per_op(run, repeat)
+    return {"on_message[drive]": (seconds, count, {})}
+
+
+def bench_publish_to_mqtt(ops: int, repeat: int) -> Results:
+    results: Results = {}
+    for name, profile in (("unchanged", "parked"), ("driving", "driving")):
+        bridge = make_bridge(base_topic="bench/abrp")
+        states = telemetry_sequence(profile, ops)
+        if name == "unchanged":
+            states = [states[0]] * ops
+        publish = bridge.publish_to_mqtt
+        client = bridge.client
+
+        def run(states=states, publish=publish, client=client) -> int:
+            for state in states:
+                publish(state)
+            return len(states)
+
+        published = client.published
+        seconds, count = per_op(run, repeat)
+        fields = (client.published - published) / repeat / max(count, 1)
+        results[f"publish_to_mqtt[{name}]"] = (seconds, count, {"publishes_per_op": round(fields, 3)})
+    return results
+
+
+def bench_update_abrp(ops: int, repeat: int) -> Results:
+    results: Results = {}
+    for name, profile in (("parked", "parked"), ("driving", "driving")):
+        bridge = make_bridge()
+        states = telemetry_sequence(profile, ops)
+        data = bridge.data
+        update = bridge.update_abrp
+        changing = ("speed", "power", "lat", "lon", "heading", "elevation") if profile == "driving" else ()
+
+        def run(states=states, data=data, update=update, changing=changing) -> int:
+            for state in states:
+                for field in changing:
+                    data[field] = state[field]
+                update()
+            return len(states)
+
+        seconds, count = per_op(run, repeat)
+        results[f"update_abrp[{name}]"] = (seconds, count, {})
+    return results
+
+
+def bench_handle_parked_state(ops: int, repeat: int) -> Results:
+    bridge = make_bridge()
+    bridge.data.update({"power": 4.2, "speed": 30, "kwh_charged": 3.5})
+    handle = bridge.handle_parked_state
+
+    def run() -> int:
+        for _ in range(ops):
+            handle()
+        return ops
+
+    seconds, count = per_op(run, repeat)
+    return {"handle_parked_state": (seconds, count, {})}
+
+
+def simulate_day(plan: Sequence[Tuple[float, str]] = DAY_PLAN) -> Tuple[float, int, int]:
+    """Drive one bridge through a day on a virtual clock.
+
+    Returns (wall seconds, ticks run, ABRP POSTs).
+    """
+    clock = [0.0]
+    scheduler = Scheduler(clock=lambda: clock[0])
+    bridge = make_bridge(scheduler=scheduler)
+    changes = list(plan)
+    ticks = 0
+    started = perf_counter()
+    while True:
+        deadline = scheduler.next_deadline()
+        change = changes[0][0] if changes else math.inf
+        if change <= (math.inf if deadline is None else deadline):
+            if change >= DAY:
+                break
+            clock[0], state = changes.pop(0)
+            message = mqtt.MQTTMessage(topic=b"teslamate/cars/1/state")
+            message.payload = state.encode("utf-8")
+            bridge.on_message(None, None, message)
+            scheduler.wake(bridge)
+            continue
+        if deadline is None or deadline >= DAY:
+            break
+        clock[0] = deadline
+        for key in scheduler.pop_due(deadline):
+            ticks += 1
+            next_deadline = key.tick(deadline)
+            if next_deadline is not None:
+                scheduler.schedule(key, next_deadline)
+    session: Any = bridge.session
+    return perf_counter() - started, ticks, session.posts
+
+
+def bench_scheduler_day(ops: int, repeat: int) -> Results:
+    best = math.inf
+    ticks = posts = 0
+    for _ in range(repeat):
+        seconds, ticks, posts = simulate_day()
+        best = min(best, seconds)
+    return {"scheduler_tick[day]": (best / max(ticks, 1), ticks, {"abrp_posts": posts, "day_seconds": best})}
+
+
+BENCHMARKS: Dict[str, Callable[[int, int], Results]] = {
+    "process_message": bench_process_message,
+    "on_message": bench_on_message,
+    "publish_to_mqtt": bench_publish_to_mqtt,
+    "update_abrp": bench_update_abrp,
+    "handle_parked_state": bench_handle_parked_state,
+    "scheduler_tick": bench_scheduler_day,
+}
+
+
+def run_suite(ops: int = DEFAULT_OPS, repeat: int = 5, only: Optional[str] = None) -> Dict[str, Any]:
+    """Run the benchmarks (those whose name contains `only`, if given) and
+    return the results document."""
+    results: Dict[str, Dict[str, Any]] = {}
+    # The bridge logs every send; keep log I/O out of the timings.
+    logging.disable(logging.CRITICAL)
+    try:
+        for group, bench in BENCHMARKS.items():
+            if only and only not in group:
+                continue
+            for name, (seconds, count, extra) in bench(ops, repeat).items():
+                results[name] = {"us_per_op": round(seconds * 1e6, 4), "ops": count, **extra}
+    finally:
+        logging.disable(logging.NOTSET)
+    return {
+        "format": RESULTS_FORMAT,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "orjson": teslamate_mqtt2abrp.HAS_ORJSON,
+        "ops": ops,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Tuple[str, float, float, bool]]:
+    """(name, baseline us, current us, regressed) for benchmarks in both runs;
+    regressed means more than `threshold` (a fraction) slower."""
+    rows = []
+    for name, result in current["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            continue
+        old, new = before["us_per_op"], result["us_per_op"]
+        rows.append((name, old, new, old > 0 and new > old * (1 + threshold)))
+    return rows
+
+
+## [ Click CLI Implementation ]
+@click.command(help="Benchmark the bridge's hot paths and store or compare the results as JSON.")
+@click.option('--ops', default=DEFAULT_OPS, show_default=True, type=click.IntRange(min=10),
+              help='Operations per timed run')
+@click.option('--repeat', default=5, show_default=True, type=click.IntRange(min=1), help='Runs, best one counts')
+@click.option('--only', help='Run only the benchmark groups whose name contains this')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the results to this JSON file')
+@click.option('--compare', 'baseline_path', type=click.Path(exists=True, dir_okay=False),
+              help='Compare against a previous results file; exit 1 on a regression')
+@click.option('--threshold', default=0.2, show_default=True, type=click.FloatRange(min=0),
+              help='Slowdown (fraction) counted as a regression')
+def main(ops, repeat, only, output, baseline_path, threshold):
+    report = run_suite(ops, repeat, only)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if not baseline_path:
+        for name, result in report["results"].items():
+            click.echo(f"  {name:<45} {result['us_per_op']:10.3f} us/op")
+        return
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    rows = compare(report, baseline, threshold)
+    for name, old, new, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        click.echo(f"  {name:<45} {old:10.3f} -> {new:10.3f} us/op  {new / old if old else math.nan:5.2f}x{flag}")
+    if any(regressed for *_, regressed in rows):
+        sys.exit(1)
+
+
+## [ MAIN ]
+if __name__ == '__main__':
+    main()
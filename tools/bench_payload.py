@@ -0,0 +1,110 @@
+"""
+Payload micro-benchmark:
+Per-send cost of turning the telemetry into an ABRP request body, the way
+update_abrp used to (copy the data, filter non-finite values, let requests
+json-encode the dict) against to_payload() plus PayloadEncoder, with the
+stdlib json backend and, if installed, orjson.
+
+    python -m tools.bench_payload --profile driving --sends 20000
+"""
+
+## [ IMPORTS ]
+import json
+import math
+import random
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Tuple
+
+import click
+
+import teslamate_mqtt2abrp
+from teslamate_mqtt2abrp import PayloadEncoder, TelemetryData, TelemetryRecord
+
+## [ CONFIGURATION ]
+# Fields that change between two sends, per profile.
+PROFILES = {
+    "driving": ("utc", "speed", "power", "lat", "lon", "heading", "elevation"),
+    "charging": ("utc", "power", "soc", "kwh_charged", "voltage", "current"),
+    "parked": ("utc",),
+}
+BASE_TELEMETRY: Dict[str, Any] = {
+    "utc": 1760000000, "soc": 64, "power": 18.5, "speed": 92, "lat": 46.9480, "lon": 7.4474,
+    "elevation": 540, "is_charging": False, "is_dcfc": False, "is_parked": False,
+    "est_battery_range": 301.4, "ideal_battery_range": 322.9, "ext_temp": 14.5, "model": "3",
+    "trim_badging": "74D", "car_model": "tesla:m3:20:bt37:heatpump", "tlm_type": "api",
+    "voltage": 0, "current": 0, "kwh_charged": 12.3, "heading": 184, "odometer": 48211.7,
+}
+
+
+def telemetry_sequence(profile: str, sends: int, seed: int = 1) -> List[Dict[str, Any]]:
+    """`sends` successive telemetry states where only the profile's fields move."""
+    rng = random.Random(seed)
+    state = dict(BASE_TELEMETRY)
+    sequence = []
+    for _ in range(sends):
+        for field in PROFILES[profile]:
+            value = state[field]
+            if field == "utc":
+                state[field] = value + 1
+            elif isinstance(value, float):
+                state[field] = round(value + rng.uniform(-0.001, 0.001) * max(1.0, abs(value)), 6)
+            else:
+                state[field] = value + rng.randint(-2, 2)
+        sequence.append(dict(state))
+    return sequence
+
+
+def previous_path(data: Dict[str, Any]) -> bytes:
+    """What update_abrp + requests' json= did per send."""
+    snapshot = dict(data)
+    snapshot = {k: v for k, v in snapshot.items() if not (isinstance(v, float) and not math.isfinite(v))}
+    return json.dumps({"tlm": snapshot}, allow_nan=False).encode("utf-8")
+
+
+def time_per_send(encode: Callable[[Any], bytes], inputs: List[Any], repeat: int) -> float:
+    """Best-of-`repeat` seconds per call of `encode` over `inputs`."""
+    best = math.inf
+    for _ in range(repeat):
+        started = perf_counter()
+        for item in inputs:
+            encode(item)
+        best = min(best, (perf_counter() - started) / len(inputs))
+    return best
+
+
+def run(profile: str, sends: int, repeat: int) -> List[Tuple[str, float]]:
+    dicts = telemetry_sequence(profile, sends)
+    records: List[TelemetryRecord] = [TelemetryData(state).snapshot().data for state in dicts]
+    results = [("previous: dict copy + filter + json=", time_per_send(previous_path, dicts, repeat))]
+    backends = [("stdlib json", False)]
+    if teslamate_mqtt2abrp.HAS_ORJSON:
+        backends.append(("orjson", True))
+    for name, use_orjson in backends:
+        teslamate_mqtt2abrp.HAS_ORJSON = use_orjson
+        encoder = PayloadEncoder()
+        results.append((f"to_payload + PayloadEncoder ({name})",
+                        time_per_send(lambda record: encoder.encode(record.to_payload()), records, repeat)))
+    return results
+
+
+## [ Click CLI Implementation ]
+@click.command(help="Compare the per-send cost of building ABRP request bodies.")
+@click.option('--profile', type=click.Choice(sorted(PROFILES)), default="driving", show_default=True,
+              help='Which fields change between sends')
+@click.option('--sends', default=10000, show_default=True, type=click.IntRange(min=1), help='Sends per run')
+@click.option('--repeat', default=5, show_default=True, type=click.IntRange(min=1), help='Runs, best one counts')
+def main(profile, sends, repeat):
+    has_orjson = teslamate_mqtt2abrp.HAS_ORJSON
+    try:
+        results = run(profile, sends, repeat)
+    finally:
+        teslamate_mqtt2abrp.HAS_ORJSON = has_orjson
+    baseline = results[0][1]
+    click.echo(f"{profile}, {sends} sends, best of {repeat}:")
+    for name, seconds in results:
+        click.echo(f"  {name:<45} {seconds * 1e6:8.2f} us/send  {baseline / seconds:5.2f}x")
+
+
+## [ MAIN ]
+if __name__ == '__main__':
+    main()
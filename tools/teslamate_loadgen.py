@@ -0,0 +1,404 @@
+"""
+TeslaMate load generator:
+Synthetic TeslaMate MQTT traffic for stress-testing teslamate-abrp without a
+car: drive, charge and sleep profiles at a chosen message rate, retained
+message storms and malformed payloads, either published to a broker or fed
+straight into a bridge's on_message (POSTing to an in-process ABRP stand-in),
+with throughput and latency measured.
+
+    python -m tools.teslamate_loadgen --profile drive --cars 2 --rate 0 --duration 10
+    python -m tools.teslamate_loadgen --broker 127.0.0.1:1883 --profile charge --rate 200
+"""
+
+## [ IMPORTS ]
+import json
+import logging
+import math
+import random
+import threading
+from collections import deque
+from time import perf_counter, sleep
+from typing import Any, Deque, Dict, Iterator, List, Mapping, NamedTuple, Optional, Tuple
+
+import click
+import paho.mqtt.client as mqtt
+
+from teslamate_mqtt2abrp import (
+    OfflineClient, TelemetrySink, TeslaMateABRP, TeslaMateABRPFleet, connect_mqtt_client,
+    create_mqtt_client, run_schedule,
+)
+from tools.abrp_standin import ABRPStandin
+
+
+## [ CONFIGURATION ]
+class Profile(NamedTuple):
+    state: str
+    shift_state: str
+    # A topic whose value only ever grows while the profile runs, and the
+    # telemetry field it lands in: a sent snapshot carrying marker value v
+    # reflects every message up to the one that published v.
+    marker_topic: str
+    marker_field: str
+
+
+PROFILES = {
+    "drive": Profile("driving", "D", "odometer", "odometer"),
+    "charge": Profile("charging", "P", "charge_energy_added", "kwh_charged"),
+    "sleep": Profile("asleep", "", "outside_temp", "ext_temp"),
+}
+# Payloads TeslaMate never sends but a broken publisher (or broker) might.
+MALFORMED_PAYLOADS = (b"", b"nan", b"inf", b"-1", b"1e999", b"abc", b"{}", b"\xff\xfe", b"9" * 400)
+
+
+class SimulatedCar:
+    """One car's state, advanced one simulated second per step()."""
+
+    def __init__(self, number: str, profile: str, rng: random.Random):
+        self.number = number
+        self.profile = PROFILES[profile]
+        self.rng = rng
+        self.soc = 80.0 if profile != "charge" else 35.0
+        self.lat, self.lon = 46.948, 7.447
+        self.heading = rng.uniform(0, 360)
+        self.speed = 60.0 if profile == "drive" else 0.0
+        self.elevation = 540.0
+        self.odometer = 48211.7
+        self.kwh_charged = 0.0
+        self.outside_temp = 14.5
+
+    @property
+    def marker(self) -> float:
+        return {"odometer": self.odometer, "charge_energy_added": self.kwh_charged,
+                "outside_temp": self.outside_temp}[self.profile.marker_topic]
+
+    def topic(self, name: str) -> str:
+        return f"teslamate/cars/{self.number}/{name}"
+
+    def retained_messages(self) -> List[Tuple[str, str]]:
+        """Every topic's current value, as a broker replays them to a new
+        subscriber."""
+        charging = self.profile.state == "charging"
+        values = {
+            "model": "3", "trim_badging": "74D", "state": self.profile.state,
+            "shift_state": self.profile.shift_state, "latitude": f"{self.lat:.6f}",
+            "longitude": f"{self.lon:.6f}", "elevation": str(round(self.elevation)),
+            "speed": str(round(self.speed)), "heading": str(round(self.heading) % 360),
+            "power": f"{self._power():.1f}", "odometer": f"{self.odometer:.2f}",
+            "outside_temp": f"{self.outside_temp:.1f}", "usable_battery_level": str(round(self.soc)),
+            "battery_level": str(round(self.soc)), "est_battery_range_km": f"{self.soc * 4.1:.2f}",
+            "ideal_battery_range_km": f"{self.soc * 4.4:.2f}",
+            "charger_power": "11" if charging else "0", "charger_actual_current": "16" if charging else "0",
+            "charger_voltage": "230" if charging else "0", "charger_phases": "3" if charging else "",
+            "charge_energy_added": f"{self.kwh_charged:.2f}",
+        }
+        return [(self.topic(name), payload) for name, payload in values.items()]
+
+    def step(self) -> List[Tuple[str, str]]:
+        """Advance one second and return the messages TeslaMate would publish."""
+        state = self.profile.state
+        if state == "driving":
+            return self._drive()
+        if state == "charging":
+            return self._charge()
+        self.outside_temp = round(self.outside_temp + 0.1, 1)
+        return [(self.topic("outside_temp"), f"{self.outside_temp:.1f}")]
+
+    def _power(self) -> float:
+        if self.profile.state == "charging":
+            return -11.0
+        return self.speed * 0.2 if self.profile.state == "driving" else 0.0
+
+    def _drive(self) -> List[Tuple[str, str]]:
+        rng = self.rng
+        self.speed = min(130.0, max(0.0, self.speed + rng.uniform(-5, 5)))
+        self.heading = (self.heading + rng.uniform(-10, 10)) % 360
+        km = self.speed / 3600
+        self.lat += km / 111.0 * math.cos(math.radians(self.heading))
+        self.lon += km / 76.0 * math.sin(math.radians(self.heading))
+        self.elevation += rng.uniform(-1, 1)
+        self.odometer = round(self.odometer + max(km, 0.01), 2)
+        self.soc = max(5.0, self.soc - km * 0.15)
+        return [
+            (self.topic("latitude"), f"{self.lat:.6f}"), (self.topic("longitude"), f"{self.lon:.6f}"),
+            (self.topic("speed"), str(round(self.speed))), (self.topic("heading"), str(round(self.heading) % 360)),
+            (self.topic("power"), f"{self._power():.1f}"), (self.topic("elevation"), str(round(self.elevation))),
+            (self.topic("est_battery_range_km"), f"{self.soc * 4.1:.2f}"),
+            (self.topic("usable_battery_level"), str(round(self.soc))),
+            (self.topic("odometer"), f"{self.odometer:.2f}"),
+        ]
+
+    def _charge(self) -> List[Tuple[str, str]]:
+        self.kwh_charged = round(self.kwh_charged + 0.01, 2)
+        self.soc = min(100.0, self.soc + 0.015)
+        return [
+            (self.topic("charger_actual_current"), str(16 + self.rng.randint(-1, 0))),
+            (self.topic("charger_voltage"), str(230 + self.rng.randint(-2, 2))),
+            (self.topic("usable_battery_level"), str(round(self.soc))),
+            (self.topic("est_battery_range_km"), f"{self.soc * 4.1:.2f}"),
+            (self.topic("charge_energy_added"), f"{self.kwh_charged:.2f}"),
+        ]
+
+
+class Message(NamedTuple):
+    car: str
+    topic: str
+    payload: bytes
+    retain: bool
+    # The marker value this message publishes, None for any other topic.
+    marker: Optional[float]
+
+
+class LoadGenerator:
+    """The message stream: a retained storm for every car first (and every
+    ``storm_every`` messages after that, if set), then the cars' steps in
+    turn, with a ``malformed_rate`` share of the payloads corrupted."""
+
+    def __init__(self, cars: int, profile: str, malformed_rate: float = 0.0, storm_every: int = 0,
+                 seed: Optional[int] = None):
+        if not 0 <= malformed_rate <= 1:
+            raise ValueError("The malformed rate must be within [0, 1].")
+        self.rng = random.Random(seed)
+        self.cars = [SimulatedCar(str(n), profile, self.rng) for n in range(1, cars + 1)]
+        self.malformed_rate = malformed_rate
+        self.storm_every = storm_every
+        self.malformed = 0
+        self.storms = 0
+
+    def messages(self) -> Iterator[Message]:
+        count = 0
+        yield from self._storm()
+        while True:
+            for car in self.cars:
+                for topic, payload in car.step():
+                    if self.storm_every and count and count % self.storm_every == 0:
+                        yield from self._storm()
+                    count += 1
+                    yield self._message(car, topic, payload)
+
+    def _storm(self) -> Iterator[Message]:
+        self.storms += 1
+        for car in self.cars:
+            for topic, payload in car.retained_messages():
+                yield self._message(car, topic, payload, retain=True)
+
+    def _message(self, car: SimulatedCar, topic: str, payload: str, retain: bool = False) -> Message:
+        if self.malformed_rate and self.rng.random() < self.malformed_rate:
+            self.malformed += 1
+            return Message(car.number, topic, self.rng.choice(MALFORMED_PAYLOADS), retain, None)
+        marker = car.marker if topic.endswith("/" + car.profile.marker_topic) else None
+        return Message(car.number, topic, payload.encode("utf-8"), retain, marker)
+
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p90/p99/max of `samples` in milliseconds (None when empty)."""
+    if not samples:
+        return {"p50": None, "p90": None, "p99": None, "max": None}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": pick(1.0)}
+
+
+class PipelineProbe(TelemetrySink):
+    """Bridge sink timing each marker message from on_message to the first
+    send whose snapshot carries it (the full pipeline: handling, scheduling
+    and the refresh interval)."""
+
+    name = "loadgen-probe"
+
+    def __init__(self, field: str):
+        self.field = field
+        self.lock = threading.Lock()
+        self.pending: Dict[str, Deque[Tuple[float, float]]] = {}
+        self.latencies: List[float] = []
+        self.sends = 0
+
+    def expect(self, car: str, marker: float, injected: float):
+        with self.lock:
+            self.pending.setdefault(car, deque()).append((marker, injected))
+
+    def submit(self, car: str, tlm: Mapping[str, Any]):
+        now = perf_counter()
+        value = tlm.get(self.field)
+        with self.lock:
+            self.sends += 1
+            pending = self.pending.get(car)
+            while pending and value is not None and pending[0][0] <= value:
+                self.latencies.append(now - pending.popleft()[1])
+
+
+def make_message(topic: str, payload: bytes, retain: bool) -> mqtt.MQTTMessage:
+    message = mqtt.MQTTMessage(topic=topic.encode("utf-8"))
+    message.payload = payload
+    message.retain = retain
+    return message
+
+
+def run_direct(generator: LoadGenerator, profile: str, rate: float, duration: float,
+               bridge_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Feed the stream into a broker-less bridge (one car or a fleet) whose
+    ABRP sends go to an in-process stand-in; measure on_message throughput
+    and latency and the end-to-end pipeline latency."""
+    standin = ABRPStandin(port=0).start()
+    numbers = [car.number for car in generator.cars]
+    config = {"USERTOKEN": "loadgen", "CARNUMBER": numbers[0], "ABRP_URL": standin.url, "BASETOPIC": None,
+              "CARMODEL": "tesla:m3:20:bt37:heatpump", **(bridge_config or {})}
+    probe = PipelineProbe(PROFILES[profile].marker_field)
+    bridge: Any
+    if len(numbers) > 1:
+        bridge = TeslaMateABRPFleet(config, [{"CARNUMBER": n} for n in numbers], client=OfflineClient())
+        cars = list(bridge.cars.values())
+    else:
+        bridge = TeslaMateABRP(config, client=OfflineClient())
+        cars = [bridge]
+    for car in cars:
+        car.sinks = car.sinks + [probe]
+        car.abrp_sink.start()
+        car.last_send = None
+        bridge.scheduler.wake(car)
+    stopping = threading.Event()
+
+    def update_loop():
+        try:
+            run_schedule(bridge.scheduler, lambda: "done" if stopping.is_set() else None)
+        except SystemExit:
+            pass
+
+    loop = threading.Thread(target=update_loop, name="loadgen-bridge", daemon=True)
+    loop.start()
+
+    handling: List[float] = []
+    on_message = bridge.on_message
+    interval = 1.0 / rate if rate > 0 else 0.0
+    started = perf_counter()
+    deadline = started + duration
+    sent = 0
+    for message in generator.messages():
+        now = perf_counter()
+        if now >= deadline:
+            break
+        if interval:
+            due = started + sent * interval
+            if due > now:
+                sleep(due - now)
+        mqtt_message = make_message(message.topic, message.payload, message.retain)
+        t0 = perf_counter()
+        on_message(None, None, mqtt_message)
+        t1 = perf_counter()
+        handling.append(t1 - t0)
+        if message.marker is not None:
+            probe.expect(message.car, message.marker, t0)
+        sent += 1
+    elapsed = perf_counter() - started
+
+    # Let the sends still due for the last markers go out, then stop.
+    sleep(min(1.0, duration))
+    stopping.set()
+    bridge.scheduler.wake()
+    loop.join(timeout=5)
+    for car in cars:
+        car.abrp_sink.stop(timeout=5)
+    bridge.session.close()
+    standin.close()
+    return {
+        "target": "direct", "profile": profile, "cars": len(numbers), "messages": sent,
+        "malformed": generator.malformed, "storms": generator.storms, "seconds": round(elapsed, 3),
+        "messages_per_second": round(sent / elapsed, 1) if elapsed else None,
+        "on_message_ms": percentiles(handling), "pipeline_ms": percentiles(probe.latencies),
+        "abrp_posts": standin.stats()["requests"],
+    }
+
+
+def run_broker(generator: LoadGenerator, profile: str, rate: float, duration: float,
+               config: Dict[str, Any]) -> Dict[str, Any]:
+    """Publish the stream to an MQTT broker (QoS 0) and measure the publish rate."""
+    client = create_mqtt_client(config, "teslamate-loadgen", None)
+    connect_mqtt_client(client, config)
+    interval = 1.0 / rate if rate > 0 else 0.0
+    started = perf_counter()
+    deadline = started + duration
+    sent = 0
+    try:
+        for message in generator.messages():
+            now = perf_counter()
+            if now >= deadline:
+                break
+            if interval:
+                due = started + sent * interval
+                if due > now:
+                    sleep(due - now)
+            client.publish(message.topic, payload=message.payload, qos=0, retain=message.retain)
+            sent += 1
+    finally:
+        elapsed = perf_counter() - started
+        client.loop_stop()
+        client.disconnect()
+    return {
+        "target": "broker", "profile": profile, "cars": len(generator.cars), "messages": sent,
+        "malformed": generator.malformed, "storms": generator.storms, "seconds": round(elapsed, 3),
+        "messages_per_second": round(sent / elapsed, 1) if elapsed else None,
+    }
+
+
+def parse_broker(spec: str) -> Tuple[str, int]:
+    host, _, port = spec.rpartition(":") if ":" in spec else (spec, "", "1883")
+    try:
+        return host, int(port)
+    except ValueError:
+        raise ValueError(f"Invalid broker {spec!r}, expected HOST or HOST:PORT.")
+
+
+## [ Click CLI Implementation ]
+@click.command(help="Generate synthetic TeslaMate MQTT traffic and measure how the bridge keeps up.")
+@click.option('--profile', type=click.Choice(sorted(PROFILES)), default="drive", show_default=True,
+              help='What the simulated cars are doing')
+@click.option('--cars', default=1, show_default=True, type=click.IntRange(min=1), help='Simulated cars')
+@click.option('--rate', default=0.0, show_default=True, type=click.FloatRange(min=0),
+              help='Messages per second over all cars, 0 = as fast as possible')
+@click.option('--duration', default=10.0, show_default=True, type=click.FloatRange(min=0.1), help='Seconds to run')
+@click.option('--malformed-rate', default=0.0, show_default=True, type=click.FloatRange(0, 1),
+              help='Share of payloads replaced with malformed ones')
+@click.option('--storm-every', default=0, show_default=True, type=click.IntRange(min=0),
+              help='Repeat the retained-message storm every N messages (0 = only at the start)')
+@click.option('--broker', help='Publish to this MQTT broker (HOST[:PORT]) instead of an in-process bridge')
+@click.option('--username', help='MQTT username')
+@click.option('--password', help='MQTT password')
+@click.option('--seed', type=int, help='Random seed, for reproducible streams')
+@click.option('--json', 'as_json', is_flag=True, help='Print the results as JSON')
+@click.option('-v', '--verbose', is_flag=True,
+              help="Show the bridge's warnings and errors (silenced by default: logging every malformed "
+                   "payload would skew the measurements)")
+def main(profile, cars, rate, duration, malformed_rate, storm_every, broker, username, password, seed, as_json,
+         verbose):
+    logging.basicConfig(
+        format='%(asctime)s: [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        level=logging.WARNING
+    )
+    if not verbose:
+        logging.disable(logging.CRITICAL)
+    generator = LoadGenerator(cars, profile, malformed_rate, storm_every, seed)
+    if broker:
+        try:
+            host, port = parse_broker(broker)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        config = {"MQTTSERVER": host, "MQTTPORT": port, "MQTTUSERNAME": username, "MQTTPASSWORD": password}
+        results = run_broker(generator, profile, rate, duration, config)
+    else:
+        results = run_direct(generator, profile, rate, duration)
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+    click.echo(f"{results['messages']} messages ({results['malformed']} malformed, {results['storms']} retained "
+               f"storms) to {results['target']} in {results['seconds']}s: {results['messages_per_second']} msg/s")
+    for key in ("on_message_ms", "pipeline_ms"):
+        if key in results:
+            click.echo(f"  {key:<14} " + "  ".join(f"{q}={v}" for q, v in results[key].items()))
+
+
+## [ MAIN ]
+if __name__ == '__main__':
+    main()